@@ -0,0 +1,79 @@
+"""
+Точность (recall@1) и скорость IVFMatcher относительно точного FaceMatcher.
+Данные синтетические: запрос - энкодинг сотрудника с небольшим шумом.
+Отдельно - задержка set/match, пока рост индекса переобучает его в фоне.
+Запуск: python -m benchmarks.ann [size]
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+import numpy as np
+
+from src.matcher.matcher import FaceMatcher, ENCODING_SIZE
+from src.matcher.ivf import IVFMatcher
+
+
+def timed(fn, queries):
+    timings, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(fn(query))
+        timings.append(time.perf_counter() - start)
+    return results, np.percentile(np.asarray(timings) * 1000, [50, 95])
+
+
+def main(size: int, queries: int = 500):
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(0, 0.1, (size, ENCODING_SIZE)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    ids = np.arange(1, size + 1)
+    picks = rng.integers(0, size, queries)
+    probes = matrix[picks] + rng.normal(0, 0.02, (queries, ENCODING_SIZE)).astype(np.float32)
+
+    exact = FaceMatcher(tolerance=10)
+    exact.load_matrix(ids, matrix)
+    expected, exact_latency = timed(exact.match, probes)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "ivf.npz"
+        for nprobe in (1, 4, 8, 16):
+            ivf = IVFMatcher(tolerance=10, path=path, nprobe=nprobe)
+            start = time.perf_counter()
+            ivf.load_matrix(ids, matrix)
+            load_time = time.perf_counter() - start
+            found, latency = timed(ivf.match, probes)
+            recall = np.mean([a is not None and b is not None and a[0] == b[0] for a, b in zip(found, expected)])
+            print(f"ivf nprobe={nprobe:<3} lists={len(ivf.lists):<4} load {load_time * 1000:6.0f} ms, "
+                  f"recall@1 {recall:.3f}, p50 {latency[0]:.3f} ms, p95 {latency[1]:.3f} ms")
+    print(f"exact{'':<22}p50 {exact_latency[0]:.3f} ms, p95 {exact_latency[1]:.3f} ms")
+    rebuild_latency(ids, matrix, probes)
+
+
+def rebuild_latency(ids, matrix, probes):
+    """Добавление сотрудников по одному через порог обучения: set не должен ждать k-means"""
+    half = len(ids) // 2
+    ivf = IVFMatcher(tolerance=10, min_train_size=half)
+    ivf.load_matrix(ids[:half - 1], matrix[:half - 1])
+    set_timings, match_timings = [], []
+    for i in range(half - 1, len(ids)):
+        start = time.perf_counter()
+        ivf.set(int(ids[i]), matrix[i])
+        set_timings.append(time.perf_counter() - start)
+        if ivf.pending is not None:
+            start = time.perf_counter()
+            ivf.match(probes[i % len(probes)])
+            match_timings.append(time.perf_counter() - start)
+    during = len(match_timings)
+    start = time.perf_counter()
+    ivf.wait_rebuild()
+    waited = time.perf_counter() - start
+    ok = len(ivf) == len(ids) and len(ivf.lists) > 1
+    print(f"{'ok' if ok else 'FAIL'} background rebuild: lists={len(ivf.lists)}, size={len(ivf)}, "
+          f"set max {max(set_timings) * 1000:.1f} ms, {during} matches during rebuild"
+          + (f" (max {max(match_timings) * 1000:.1f} ms)" if match_timings else "")
+          + f", waited {waited * 1000:.0f} ms after the last set")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
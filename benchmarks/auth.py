@@ -0,0 +1,51 @@
+"""
+Стоимость проверки JWT на один запрос: старая схема (decode + повторная подпись)
+против проверки подписи и против кэша проверенных токенов.
+Запуск: python -m benchmarks.auth
+"""
+import tempfile
+import time
+from pathlib import Path
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from src.utils.auth import UserAuth
+
+
+def old_check(token, private_pem, public_pem):
+    decoded = jwt.decode(jwt=token.encode(), key=public_pem, algorithms=['RS256'])
+    if token != jwt.encode(payload=decoded, algorithm="RS256", key=private_pem):
+        return None
+    return decoded
+
+
+def per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main(repeat: int = 2000):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode()
+    public_pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                               serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    with tempfile.TemporaryDirectory() as tmp:
+        (Path(tmp) / "private.pem").write_text(private_pem)
+        (Path(tmp) / "public.pem").write_text(public_pem)
+        cached = UserAuth(Path(tmp) / "private.pem", Path(tmp) / "public.pem")
+        uncached = UserAuth(Path(tmp) / "private.pem", Path(tmp) / "public.pem", token_cache_size=0)
+
+    token = cached.create_jwt(1, "admin", 0)
+    assert old_check(token, private_pem, public_pem) is not None
+    # Старая схема в сотни раз медленнее, ей хватает меньшего числа повторов
+    print(f"decode + re-sign (before): {per_call(lambda: old_check(token, private_pem, public_pem), 20):8.1f} us")
+    print(f"verify only:               {per_call(lambda: uncached.check_access_jwt(token), repeat):8.1f} us")
+    print(f"verify, cached token:      {per_call(lambda: cached.check_access_jwt(token), repeat):8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Скорость массового импорта сотрудников: POST /employees/import (CSV + ZIP)
+против пары POST /employees + POST /employees/photo на каждого человека.
+Работает с базой и ключами из .env, созданных сотрудников и фото удаляет.
+Запуск: python -m benchmarks.bulk_import [rows] [baseline_rows]
+"""
+import io
+import sys
+import tempfile
+import time
+import zipfile
+from PIL import Image
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, select
+
+from src.main import app, database, user_auth, IMAGES_DIR
+from src.database.models import EmployeeModel, EncodingJobModel
+
+BENCH_NAME = "bench-import"
+
+
+def photo_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (160, 160), (120, 90, 60)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def build_files(rows: int):
+    """CSV и ZIP во временных файлах, как их прислал бы клиент"""
+    photo = photo_bytes()
+    csv_file = tempfile.TemporaryFile()
+    zip_file = tempfile.TemporaryFile()
+    lines = ["name,info,isAccess,photo"]
+    with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_STORED) as archive:
+        for i in range(rows):
+            lines.append(f"{BENCH_NAME}-{i},imported,{'true' if i % 2 else 'false'},{i}.png")
+            archive.writestr(f"photos/{i}.png", photo)
+    # Повтор имени и ошибочная строка попадают в отчёт
+    lines.append(f"{BENCH_NAME}-0,duplicate,true,")
+    lines.append(",no name,maybe,")
+    csv_file.write("\n".join(lines).encode())
+    csv_file.seek(0)
+    zip_file.seek(0)
+    return csv_file, zip_file
+
+
+def cleanup(client):
+    async def remove():
+        async with database.Session() as session:
+            ids = (await session.execute(select(EmployeeModel.id)
+                                         .where(EmployeeModel.name.like(f"{BENCH_NAME}%")))).scalars().all()
+            for chunk in range(0, len(ids), 1000):
+                part = ids[chunk:chunk + 1000]
+                await session.execute(delete(EncodingJobModel).where(EncodingJobModel.employee_id.in_(part)))
+                await session.execute(delete(EmployeeModel).where(EmployeeModel.id.in_(part)))
+            await session.commit()
+        for employee_id in ids:
+            (IMAGES_DIR / "employees" / f"{employee_id}.png").unlink(missing_ok=True)
+    client.portal.call(remove)
+
+
+def main(rows: int, baseline_rows: int):
+    access, refresh = user_auth.create_tokens(0, "root", 0)
+    with TestClient(app, cookies={"access_token": access, "refresh_token": refresh}) as client:
+        try:
+            photo = photo_bytes()
+            start = time.perf_counter()
+            for i in range(baseline_rows):
+                employee_id = client.post("/employees", json={"name": f"{BENCH_NAME}-b{i}", "isAccess": True}).json()["id"]
+                client.post("/employees/photo", params={"id": employee_id},
+                            files={"photo": (f"{i}.png", photo, "image/png")})
+            baseline = baseline_rows / (time.perf_counter() - start)
+            print(f"per-person requests: {baseline:8.0f} employees/s ({baseline_rows} employees)")
+
+            csv_file, zip_file = build_files(rows)
+            start = time.perf_counter()
+            report = client.post("/employees/import", files={"employees": ("employees.csv", csv_file, "text/csv"),
+                                                             "photos": ("photos.zip", zip_file, "application/zip")}).json()
+            elapsed = time.perf_counter() - start
+            statuses = {}
+            for row in report["rows"]:
+                statuses[row["status"]] = statuses.get(row["status"], 0) + 1
+            print(f"bulk import:         {report['created'] / elapsed:8.0f} employees/s ({rows} employees, "
+                  f"{elapsed:.2f} s with upload, {report['seconds']:.2f} s in the importer), rows {statuses}")
+        finally:
+            cleanup(client)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*(args + [10_000, 200][len(args):]))
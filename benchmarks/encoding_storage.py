@@ -0,0 +1,57 @@
+"""
+Сравнение хранения энкодингов: numeric[] против bytea с float32.
+Нужна PostgreSQL база из DB_URL, таблицы создаются временные.
+Запуск: python -m benchmarks.encoding_storage [rows]
+"""
+import os
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text, bindparam, LargeBinary
+
+from src.matcher.matcher import ENCODING_SIZE
+from src.matcher.storage import pack_encoding, unpack_encodings, ENCODING_VERSION
+
+
+def main(rows: int):
+    load_dotenv()
+    engine = create_engine(os.getenv('DB_URL'))
+    matrix = np.random.default_rng(0).normal(0, 0.1, (rows, ENCODING_SIZE)).astype(np.float32)
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS bench_numeric, bench_bytea"))
+        conn.execute(text("CREATE TABLE bench_numeric (employee_id INTEGER PRIMARY KEY, encoding NUMERIC[])"))
+        conn.execute(text("CREATE TABLE bench_bytea (employee_id INTEGER PRIMARY KEY, version INTEGER, encoding BYTEA)"))
+        conn.execute(text("INSERT INTO bench_numeric VALUES (:id, :encoding)"),
+                     [{"id": i, "encoding": list(map(float, v))} for i, v in enumerate(matrix)])
+        conn.execute(text("INSERT INTO bench_bytea VALUES (:id, :version, :encoding)")
+                     .bindparams(bindparam("encoding", type_=LargeBinary)),
+                     [{"id": i, "version": ENCODING_VERSION, "encoding": pack_encoding(v)}
+                      for i, v in enumerate(matrix)])
+
+    try:
+        with engine.connect() as conn:
+            start = time.perf_counter()
+            res = conn.execute(text("SELECT employee_id, encoding FROM bench_numeric")).all()
+            np.asarray([encoding for _, encoding in res], dtype=np.float32)
+            numeric_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            res = conn.execute(text("SELECT employee_id, version, encoding FROM bench_bytea")).all()
+            unpack_encodings(res)
+            bytea_time = time.perf_counter() - start
+
+            numeric_size = conn.execute(text("SELECT pg_total_relation_size('bench_numeric')")).scalar()
+            bytea_size = conn.execute(text("SELECT pg_total_relation_size('bench_bytea')")).scalar()
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS bench_numeric, bench_bytea"))
+
+    print(f"{rows} encodings")
+    print(f"numeric[]: load {numeric_time * 1000:.0f} ms, table {numeric_size / 1024:.0f} KiB")
+    print(f"bytea:     load {bytea_time * 1000:.0f} ms, table {bytea_size / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
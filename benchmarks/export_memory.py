@@ -0,0 +1,102 @@
+"""
+Проверка памяти выгрузки /accessLogs/export: пик выделенной Python памяти (tracemalloc) при выгрузке
+10 тыс., 100 тыс. и rows строк в CSV, NDJSON и CSV+gzip должен оставаться примерно одинаковым.
+Приложение вызывается напрямую через ASGI, тело ответа считается и отбрасывается, как у клиента,
+пишущего в файл. Пишет логи за 2002 год в базу из DB_URL (лучше отдельную) и удаляет их и их агрегаты в конце.
+Код выхода 1, если пик на rows строках больше чем вдвое выше пика на 10 тыс.
+Запуск: python -m benchmarks.export_memory [rows]
+"""
+import asyncio
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from sqlalchemy import insert, delete
+
+from src.main import app, database, user_auth
+from src.database.models import AccessLogModel, AccessLogRollupModel, EmployeeDailyModel
+
+START = datetime(2002, 1, 1)
+# Запас на шум: кэши SQLAlchemy, ленивые импорты
+SLACK_BYTES = 4 * 2 ** 20
+
+
+async def export(params: dict, cookie: str) -> tuple[int, int, float]:
+    """(status, байт в теле, секунды)"""
+    status = 0
+    size = 0
+    done = asyncio.Event()
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/accessLogs/export", "raw_path": b"/accessLogs/export",
+             "query_string": urlencode(params).encode(), "root_path": "",
+             "headers": [(b"host", b"bench"), (b"cookie", f"access_token={cookie}".encode())],
+             "client": ("127.0.0.1", 0), "server": ("bench", 80)}
+
+    async def receive():
+        if done.is_set():
+            return {"type": "http.disconnect"}
+        await asyncio.sleep(0)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return status, size, time.perf_counter() - start
+
+
+async def main(rows: int):
+    await database.init()
+    access, _ = user_auth.create_tokens(0, "root", 0)
+    end = START + timedelta(days=365)
+    step = timedelta(days=365) / rows
+    try:
+        async with database.engine.begin() as conn:
+            for chunk in range(0, rows, 20_000):
+                await conn.execute(insert(AccessLogModel), [
+                    {"employee_id": 0, "timestamp": START + step * i, "photo_url": str(i) if i % 3 == 0 else None}
+                    for i in range(chunk, min(chunk + 20_000, rows))])
+        sizes = sorted({min(10_000, rows), min(100_000, rows), rows})
+        peaks = {}
+        for fmt, gzip in (("csv", False), ("ndjson", False), ("csv", True)):
+            for count in sizes:
+                params = {"format": fmt, "gzip": str(gzip).lower(), "start": START.isoformat(),
+                          "end": (START + step * count).isoformat()}
+                # Прогрев: кэш пользователей и скомпилированных запросов не должен попасть в замер
+                await export({**params, "end": (START + step).isoformat()}, access)
+                gc.collect()
+                tracemalloc.start()
+                status, size, seconds = await export(params, access)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                peaks[(fmt, gzip, count)] = peak
+                print(f"{fmt + ('+gzip' if gzip else ''):10} {count:>9} rows: status {status}, "
+                      f"{size / 2 ** 20:8.1f} MB body, peak {peak / 2 ** 20:6.2f} MB, {seconds:6.2f} s")
+        failed = [key for key in peaks if key[2] == rows
+                  and peaks[key] > 2 * peaks[(key[0], key[1], sizes[0])] + SLACK_BYTES]
+        print("memory is flat" if not failed else f"memory grows with rows: {failed}")
+        return 1 if failed else 0
+    finally:
+        async with database.engine.begin() as conn:
+            await conn.execute(delete(AccessLogModel).where(AccessLogModel.timestamp >= START,
+                                                            AccessLogModel.timestamp < end))
+            # В SQLite вставка обновила агрегаты триггером
+            await conn.execute(delete(AccessLogRollupModel).where(AccessLogRollupModel.bucket >= START,
+                                                                  AccessLogRollupModel.bucket < end))
+            await conn.execute(delete(EmployeeDailyModel).where(EmployeeDailyModel.day >= START,
+                                                                EmployeeDailyModel.day < end))
+        await database.close()
+        database.hasher.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)))
@@ -0,0 +1,80 @@
+"""
+Проверка выдачи id последовательностями: параллельные вставки сотрудников, пользователей и логов
+без конфликтов ключей, с одним INSERT (плюс COMMIT) на каждую вставку.
+Работает с базой из .env, созданные строки (и агрегаты логов за 2003 год) удаляет.
+Запуск: python -m benchmarks.id_allocation [parallel]
+"""
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+
+from src.main import app, database, encoding_queue, access_log_retention
+from src.database.models import AccessLogModel, AccessLogRollupModel, EmployeeDailyModel
+from benchmarks.query_counts import QueryCounter
+
+BENCH_NAME = "bench-ids"
+# Логи пишутся в прошлое, чтобы их агрегаты не смешивались с настоящими и удалялись целиком
+LOG_TIME = datetime(2003, 1, 1)
+
+
+async def run(counter, name, calls):
+    counter.statements.clear()
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    round_trips = len(counter.statements) / len(results)
+    ok = not errors and round_trips <= 2
+    print(f"{'ok  ' if ok else 'FAIL'} {name:<14} {len(results)} parallel, {len(errors)} errors, "
+          f"{round_trips:.1f} round trips each")
+    for error in errors[:3]:
+        print(f"     {error!r}")
+    return results, not ok
+
+
+async def main(parallel: int):
+    async with app.router.lifespan_context(app):
+        # Фоновые задачи ходят в ту же базу (диспетчер энкодингов по таймеру, хранение логов при старте),
+        # их запросы попали бы в счётчик
+        await encoding_queue.stop()
+        await access_log_retention.stop()
+        counter = QueryCounter(database.engine)
+        employee_ids, failed = await run(counter, "add_employee", [
+            database.add_employee(f"{BENCH_NAME}-{i}", "-", True) for i in range(parallel)])
+        ids = [employee_id for employee_id in employee_ids if isinstance(employee_id, int)]
+        if len(set(ids)) != parallel or 0 in ids:
+            print(f"FAIL employee ids are not unique or reuse reserved 0: {sorted(ids)[:10]}")
+            failed = True
+
+        results, bad = await run(counter, "add_access_log", [
+            database.add_access_log(ids[i % len(ids)] if ids else 0, LOG_TIME + timedelta(seconds=i))
+            for i in range(parallel)])
+        failed |= bad or not all(result is True for result in results)
+
+        # bcrypt дорогой, пользователей меньше
+        users = max(parallel // 10, 2)
+        results, bad = await run(counter, "add_user", [
+            database.add_user(f"{BENCH_NAME}-{i}", "-", 1) for i in range(users)])
+        failed |= bad or not all(result is True for result in results)
+        duplicate = await database.add_user(f"{BENCH_NAME}-0", "-", 1)
+        if duplicate:
+            print("FAIL duplicate login was accepted")
+            failed = True
+
+        async with database.Session() as session:
+            await session.execute(delete(AccessLogModel).where(AccessLogModel.employee_id.in_(ids)))
+            await session.execute(delete(AccessLogRollupModel)
+                                  .where(AccessLogRollupModel.bucket >= LOG_TIME,
+                                         AccessLogRollupModel.bucket < LOG_TIME + timedelta(days=1)))
+            await session.execute(delete(EmployeeDailyModel).where(EmployeeDailyModel.employee_id.in_(ids)))
+            await session.commit()
+        for employee_id in ids:
+            await database.delete_employee(employee_id)
+        for i in range(users):
+            user = await database.get_user(f"{BENCH_NAME}-{i}")
+            if user is not None:
+                await database.delete_user(user.id)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
@@ -0,0 +1,70 @@
+"""
+Пропускная способность записи событий проходов, events/s:
+по одному через add_access_log и пачками через POST /accessLogs/batch с буфером.
+Пишет в базу из DB_URL.
+Запуск: python -m benchmarks.ingest [producers] [batch] [seconds]
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+import httpx
+
+from src.main import app, database, user_auth, access_log_buffer
+
+
+async def single(producers: int, seconds: float):
+    deadline = time.perf_counter() + seconds
+    written = 0
+
+    async def producer():
+        nonlocal written
+        while time.perf_counter() < deadline:
+            await database.add_access_log(0, datetime.now())
+            written += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer() for _ in range(producers)))
+    return written / (time.perf_counter() - start)
+
+
+async def batched(client, producers: int, batch: int, seconds: float):
+    access, _ = user_auth.create_tokens(0, "root", 0)
+    deadline = time.perf_counter() + seconds
+    rejected = 0
+    written_before = access_log_buffer.written
+
+    async def producer():
+        nonlocal rejected
+        while time.perf_counter() < deadline:
+            timestamp = datetime.now().isoformat()
+            events = [{"employeeId": 0, "timestamp": timestamp} for _ in range(batch)]
+            response = (await client.post("/accessLogs/batch", json={"events": events},
+                                          cookies={"access_token": access})).json()
+            if response["resultCode"] == 6:
+                rejected += 1
+                await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer() for _ in range(producers)))
+    # Считаем только то, что реально записано в базу
+    while access_log_buffer.written < access_log_buffer.accepted:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    return (access_log_buffer.written - written_before) / elapsed, rejected
+
+
+async def main(producers: int, batch: int, seconds: float):
+    async with app.router.lifespan_context(app):
+        print(f"add_access_log x{producers}: {await single(producers, seconds):.0f} events/s")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            rate, rejected = await batched(client, producers, batch, seconds)
+        print(f"POST /accessLogs/batch x{producers} by {batch}: {rate:.0f} events/s, "
+              f"{rejected} batches rejected")
+        print(access_log_buffer.stats())
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]] + [float(arg) for arg in sys.argv[3:4]]
+    asyncio.run(main(*(args + [8, 200, 5][len(args):])))
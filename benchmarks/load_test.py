@@ -0,0 +1,74 @@
+"""
+Нагрузочный тест: requests/s на чтении списка сотрудников
+для синхронного Database (def эндпоинт в threadpool) и AsyncDatabase (async def).
+Использует базу из DB_URL.
+Запуск: python -m benchmarks.load_test [concurrency] [seconds]
+"""
+import asyncio
+import os
+import sys
+import time
+import httpx
+from dotenv import load_dotenv
+from fastapi import FastAPI
+
+from src.database.database import Database
+from src.database.async_database import AsyncDatabase
+
+
+def sync_app(database: Database):
+    app = FastAPI()
+
+    @app.get("/employees")
+    def get_employees(page: int = 1):
+        employees, _ = database.get_employees(page, 10, None)
+        return {"employees": employees}
+
+    return app
+
+
+def async_app(database: AsyncDatabase):
+    app = FastAPI()
+
+    @app.get("/employees")
+    async def get_employees(page: int = 1):
+        employees, _ = await database.get_employees(page, 10, None)
+        return {"employees": employees}
+
+    return app
+
+
+async def run(app, concurrency: int, seconds: float):
+    transport = httpx.ASGITransport(app=app)
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker(client):
+        nonlocal done
+        while time.perf_counter() < deadline:
+            response = await client.get("/employees", params={"page": 1})
+            response.raise_for_status()
+            done += 1
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return done / seconds
+
+
+async def main(concurrency: int, seconds: float):
+    load_dotenv()
+    args = (os.getenv('DB_URL'), os.getenv('ROOT_PASSWORD'), os.getenv('ADMIN_PASSWORD'))
+    sync_database = Database(*args)
+    async_database = AsyncDatabase(*args, pool_size=concurrency)
+    await async_database.init()
+    try:
+        print(f"Database, def:             {await run(sync_app(sync_database), concurrency, seconds):8.0f} req/s")
+        print(f"AsyncDatabase, async def: {await run(async_app(async_database), concurrency, seconds):8.0f} req/s")
+    finally:
+        await async_database.close()
+        sync_database.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+                     float(sys.argv[2]) if len(sys.argv) > 2 else 10))
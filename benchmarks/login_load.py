@@ -0,0 +1,49 @@
+"""
+Нагрузочный тест: поток входов (bcrypt) вперемешку с чтением /accessLogs.
+Показывает задержку чтения под нагрузкой входами и сколько входов отклонил лимитер.
+Запуск: python -m benchmarks.login_load [login_workers] [read_workers] [seconds]
+"""
+import asyncio
+import os
+import sys
+import time
+import httpx
+import numpy as np
+
+from src.main import app, user_auth
+
+
+async def main(login_workers: int, read_workers: int, seconds: float):
+    access, _ = user_auth.create_tokens(0, "root", 0)
+    password = os.getenv('ADMIN_PASSWORD')
+    read_latency = []
+    logins = {"ok": 0, "rejected": 0}
+    deadline = time.perf_counter() + seconds
+
+    async def login_worker(client, i):
+        while time.perf_counter() < deadline:
+            # Половина воркеров ломится в один аккаунт, как при подборе пароля
+            login = "admin" if i % 2 == 0 else f"missing-{i}"
+            response = (await client.post("/auth/login", json={"login": login, "password": password})).json()
+            logins["rejected" if response["resultCode"] == 6 else "ok"] += 1
+
+    async def read_worker(client):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await client.get("/accessLogs", params={"page": 1}, cookies={"access_token": access})
+            read_latency.append(time.perf_counter() - start)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await asyncio.gather(*(login_worker(client, i) for i in range(login_workers)),
+                                 *(read_worker(client) for _ in range(read_workers)))
+
+    p50, p95 = np.percentile(np.asarray(read_latency) * 1000, [50, 95])
+    print(f"reads:  {len(read_latency) / seconds:.0f} req/s, p50 {p50:.1f} ms, p95 {p95:.1f} ms")
+    print(f"logins: {logins['ok']} handled, {logins['rejected']} rejected by the limiter")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]] + [float(arg) for arg in sys.argv[3:4]]
+    asyncio.run(main(*(args + [32, 8, 10][len(args):])))
@@ -0,0 +1,58 @@
+"""
+Замер времени распознавания на 10k и 100k сотрудников.
+Запуск: python -m benchmarks.matcher
+"""
+import time
+import numpy as np
+
+from src.matcher.matcher import FaceMatcher, ENCODING_SIZE
+
+
+def naive_match(rows, query, tolerance=0.6):
+    # То, что приходилось делать без индекса: сравнение строк по одной
+    best_id, best_distance = None, None
+    for employee_id, encoding in rows:
+        distance = sum((a - b) ** 2 for a, b in zip(encoding, query)) ** 0.5
+        if best_distance is None or distance < best_distance:
+            best_id, best_distance = employee_id, distance
+    return (best_id, best_distance) if best_distance <= tolerance else None
+
+
+def percentile(values, q):
+    return np.percentile(np.asarray(values) * 1000, q)
+
+
+def run(size, queries=200):
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(0, 0.1, (size, ENCODING_SIZE)).astype(np.float32)
+    ids = np.arange(1, size + 1)
+
+    matcher = FaceMatcher()
+    start = time.perf_counter()
+    matcher.load_matrix(ids, matrix)
+    load_time = time.perf_counter() - start
+
+    picks = rng.integers(0, size, queries)
+    probes = matrix[picks] + rng.normal(0, 0.01, (queries, ENCODING_SIZE)).astype(np.float32)
+    timings = []
+    for probe in probes:
+        start = time.perf_counter()
+        matcher.match(probe)
+        timings.append(time.perf_counter() - start)
+    print(f"{size:>7} employees: load {load_time * 1000:.1f} ms, "
+          f"match p50 {percentile(timings, 50):.3f} ms, p95 {percentile(timings, 95):.3f} ms")
+
+    start = time.perf_counter()
+    matcher.match_many(probes)
+    print(f"{'':>7}            batch of {queries}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    if size <= 10_000:
+        rows = [(int(i), list(map(float, v))) for i, v in zip(ids, matrix)]
+        start = time.perf_counter()
+        naive_match(rows, list(map(float, probes[0])))
+        print(f"{'':>7}            python loop: {(time.perf_counter() - start) * 1000:.1f} ms per query")
+
+
+if __name__ == "__main__":
+    for size in (10_000, 100_000):
+        run(size)
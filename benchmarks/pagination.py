@@ -0,0 +1,67 @@
+"""
+Задержка /accessLogs: OFFSET против курсора на странице 1 и 10 000.
+Вставляет тестовые логи за конец 1999 года в базу из DB_URL (лучше отдельную) и удаляет их и их агрегаты в конце.
+Запуск: python -m benchmarks.pagination [rows]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import insert, delete, select, desc
+
+from src.database.database import Database
+from src.database.models import AccessLogModel, AccessLogRollupModel, EmployeeDailyModel
+from src.database.rollups import bucket_of
+from src.utils.pagination import encode_cursor
+
+MARK = "bench-pagination"
+PAGE_SIZE = 10
+# Логи в прошлом: в SQLite вставка обновляет агрегаты триггером, их диапазон удаляется целиком
+END = datetime(2000, 1, 1)
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(rows: int):
+    load_dotenv()
+    database = Database(os.getenv('DB_URL'), os.getenv('ROOT_PASSWORD'), os.getenv('ADMIN_PASSWORD'))
+    start_id = 10 ** 9
+    first_day = bucket_of(END - timedelta(seconds=rows), "day")
+    with database.engine.begin() as conn:
+        for chunk in range(0, rows, 10_000):
+            conn.execute(insert(AccessLogModel), [
+                {"id": start_id + i, "employee_id": 0, "timestamp": END - timedelta(seconds=i), "photo_url": MARK}
+                for i in range(chunk, min(chunk + 10_000, rows))
+            ])
+    try:
+        for page in (1, 10_000):
+            if (page - 1) * PAGE_SIZE >= rows:
+                continue
+            offset_ms = timed(lambda: database.get_access_logs(page, PAGE_SIZE))
+            with database.Session() as session:
+                # Курсор, указывающий на конец предыдущей страницы
+                cursor = None
+                if page > 1:
+                    row = session.execute(select(AccessLogModel.timestamp, AccessLogModel.id)
+                                          .order_by(desc(AccessLogModel.timestamp), desc(AccessLogModel.id))
+                                          .offset((page - 1) * PAGE_SIZE - 1).limit(1)).one()
+                    cursor = encode_cursor(row.timestamp.isoformat(), row.id)
+            cursor_ms = timed(lambda: database.get_access_logs(page_size=PAGE_SIZE, cursor=cursor))
+            print(f"page {page:>6}: offset {offset_ms:7.2f} ms, cursor {cursor_ms:7.2f} ms")
+    finally:
+        with database.engine.begin() as conn:
+            conn.execute(delete(AccessLogModel).where(AccessLogModel.photo_url == MARK))
+            conn.execute(delete(AccessLogRollupModel).where(AccessLogRollupModel.bucket >= first_day,
+                                                            AccessLogRollupModel.bucket <= END))
+            conn.execute(delete(EmployeeDailyModel).where(EmployeeDailyModel.day >= first_day,
+                                                          EmployeeDailyModel.day <= END))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
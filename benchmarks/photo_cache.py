@@ -0,0 +1,58 @@
+"""
+Повторные просмотры фото сотрудника: трафик, задержка и обращения к базе
+без валидаторов (полная загрузка) и с If-None-Match (304).
+Работает с базой и ключами из .env, созданного сотрудника удаляет.
+Запуск: python -m benchmarks.photo_cache [views]
+"""
+import io
+import sys
+import time
+import numpy as np
+from PIL import Image
+from fastapi.testclient import TestClient
+
+from src.main import app, database, user_auth
+from benchmarks.query_counts import QueryCounter
+
+BENCH_NAME = "bench-photo-cache"
+
+
+def camera_frame():
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (720, 1280, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def views(client, counter, employee_id, size, count, conditional):
+    etag = client.get("/employees/photo", params={"id": employee_id, "size": size}).headers.get("etag")
+    headers = {"if-none-match": etag} if conditional else {}
+    counter.statements.clear()
+    transferred = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.get("/employees/photo", params={"id": employee_id, "size": size}, headers=headers)
+        transferred += len(response.content)
+    latency = (time.perf_counter() - start) / count * 1000
+    mode = "If-None-Match" if conditional else "full download"
+    print(f"size={size:<8} {mode:<14} status {response.status_code}, {transferred / count / 1024:8.1f} KiB/view, "
+          f"{latency:6.2f} ms, {len(counter.statements) / count:.1f} db round trips")
+
+
+def main(count: int):
+    access, refresh = user_auth.create_tokens(0, "root", 0)
+    with TestClient(app, cookies={"access_token": access, "refresh_token": refresh}) as client:
+        employee_id = client.post("/employees", json={"name": BENCH_NAME, "isAccess": True}).json()["id"]
+        try:
+            client.post("/employees/photo", params={"id": employee_id},
+                        files={"photo": ("frame.png", camera_frame(), "image/png")})
+            counter = QueryCounter(database.engine)
+            for size in ("original", "64"):
+                views(client, counter, employee_id, size, count, False)
+                views(client, counter, employee_id, size, count, True)
+        finally:
+            client.delete("/employee", params={"id": employee_id})
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,100 @@
+"""
+Регрессионная проверка числа обращений к базе (запросы + COMMIT) и задержки эндпоинтов.
+Работает с базой и ключами из .env, как и само приложение.
+Запуск: python -m benchmarks.query_counts
+"""
+import sys
+import time
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+
+from src.main import app, database, user_auth, encoding_queue, access_log_retention
+
+# Эндпоинт -> (параметры, максимум обращений к базе при прогретом кэше пользователей)
+READ_BUDGETS = {
+    "/employees": ({"page": 1}, 1),
+    "/employee": ({"id": 0}, 1),
+    "/accessLog": ({"id": 0}, 1),
+    "/employees/photo": ({"id": 0}, 1),
+}
+
+BENCH_NAME = "bench-query-counts"
+
+
+class QueryCounter:
+
+    def __init__(self, engine):
+        self.statements = []
+        # У AsyncEngine события висят на sync_engine
+        engine = getattr(engine, "sync_engine", engine)
+        event.listen(engine, "before_cursor_execute", self.on_execute)
+        event.listen(engine, "commit", self.on_commit)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def on_commit(self, conn):
+        self.statements.append("COMMIT")
+
+
+def main():
+    access, refresh = user_auth.create_tokens(0, "root", 0)
+    with TestClient(app, cookies={"access_token": access, "refresh_token": refresh}) as client:
+        # Фоновые задачи ходят в ту же базу, их запросы попали бы в счётчик
+        client.portal.call(encoding_queue.stop)
+        client.portal.call(access_log_retention.stop)
+        counter = QueryCounter(database.engine)
+        failed = check_reads(client, counter)
+        failed |= check_writes(client, counter)
+    sys.exit(1 if failed else 0)
+
+
+def report(name, round_trips, budget, latency, extra_ok=True):
+    ok = round_trips <= budget and extra_ok
+    print(f"{'ok  ' if ok else 'FAIL'} {name:<24} {round_trips:.1f} round trips (budget {budget}), {latency:.2f} ms")
+    return not ok
+
+
+def check_reads(client, counter, repeat: int = 20):
+    failed = False
+    for path, (params, budget) in READ_BUDGETS.items():
+        client.get(path, params=params)
+        counter.statements.clear()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            client.get(path, params=params)
+        latency = (time.perf_counter() - start) / repeat * 1000
+        # История логов сотрудника не должна подгружаться нигде, кроме /accessLog
+        loads_history = path != "/accessLog" and any("access_logs" in s for s in counter.statements)
+        failed |= report(f"GET {path}", len(counter.statements) / repeat, budget, latency, not loads_history)
+    return failed
+
+
+def check_writes(client, counter):
+    def measure(method, path, budget, **kwargs):
+        counter.statements.clear()
+        start = time.perf_counter()
+        response = client.request(method, path, **kwargs).json()
+        latency = (time.perf_counter() - start) * 1000
+        return response, report(f"{method} {path}", len(counter.statements), budget, latency)
+
+    failed = False
+    response, bad = measure("POST", "/employees", 2, json={"name": BENCH_NAME, "isAccess": True})
+    failed |= bad
+    employee_id = response.get("id")
+    if employee_id is not None:
+        failed |= measure("PUT", "/employee", 2,
+                          json={"id": employee_id, "name": BENCH_NAME, "info": "-", "isAccess": False})[1]
+        failed |= measure("DELETE", "/employee", 4, params={"id": employee_id})[1]
+
+    failed |= measure("POST", "/users", 2, json={"login": BENCH_NAME, "password": "-", "accessLayerId": 1})[1]
+    user = client.portal.call(database.get_user, BENCH_NAME)
+    if user is not None:
+        failed |= measure("PUT", "/user", 2, json={"id": user.id, "accessLayerId": 1})[1]
+        failed |= measure("POST", "/user", 2, json={"id": user.id, "password": "-"})[1]
+        failed |= measure("DELETE", "/user", 2, params={"id": user.id})[1]
+    return failed
+
+
+if __name__ == "__main__":
+    main()
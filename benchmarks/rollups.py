@@ -0,0 +1,127 @@
+"""
+Статистика проходов из агрегатов (/accessLogs/stats) против того же подсчёта сканированием access_logs:
+почасовые и посуточные счётчики с долей отказов и первый/последний проход сотрудников, p50/p95.
+Плюс время backfill и цена инкрементального обновления агрегатов при записи пачки логов.
+Пишет логи за 2001 год в базу из DB_URL (лучше отдельную) и удаляет их в конце.
+В SQLite агрегаты ведёт триггер, поэтому там и голый INSERT платит за их обновление.
+Запуск: python -m benchmarks.rollups [rows] [employees]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import insert, delete, select, func, case, desc
+
+from src.database.async_database import AsyncDatabase
+from src.database.models import EmployeeModel, AccessLogModel, AccessLogRollupModel, EmployeeDailyModel
+from src.database.rollups import bucket_expr
+
+MARK = "bench-rollups"
+START = datetime(2001, 1, 1)
+DAYS = 90
+REPEAT = 20
+
+
+async def timed(fn, repeat: int = REPEAT):
+    latency = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        latency.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latency, [50, 95])
+
+
+async def main(rows: int, employees: int):
+    load_dotenv()
+    database = AsyncDatabase(os.getenv('DB_URL'), os.getenv('ROOT_PASSWORD'), os.getenv('ADMIN_PASSWORD'))
+    await database.init()
+    dialect = database.engine.dialect.name
+    rng = random.Random(0)
+    end = START + timedelta(days=DAYS)
+    try:
+        async with database.engine.begin() as conn:
+            await conn.execute(insert(EmployeeModel), [
+                {"name": f"{MARK} {i}", "info": "-", "is_access": i % 5 != 0, "photo_url": MARK}
+                for i in range(employees)])
+            ids = (await conn.execute(select(EmployeeModel.id).where(EmployeeModel.photo_url == MARK))).scalars().all()
+            for chunk in range(0, rows, 10_000):
+                await conn.execute(insert(AccessLogModel), [
+                    {"employee_id": rng.choice(ids),
+                     "timestamp": START + timedelta(seconds=rng.randrange(DAYS * 86400))}
+                    for _ in range(min(10_000, rows - chunk))])
+        start = time.perf_counter()
+        await database.backfill_rollups(START, end)
+        print(f"{rows} logs over {DAYS} days, {employees} employees ({dialect}), "
+              f"backfill {time.perf_counter() - start:.2f} s")
+
+        month_end = START + timedelta(days=30)
+        granted = case((EmployeeModel.is_access, 1), else_=0)
+
+        async def raw_buckets(period, until):
+            bucket = bucket_expr(dialect, period, AccessLogModel.timestamp)
+            async with database.Session() as session:
+                await session.execute(
+                    select(bucket, func.count(), func.sum(granted))
+                    .join(EmployeeModel, EmployeeModel.id == AccessLogModel.employee_id)
+                    .where(AccessLogModel.timestamp >= START, AccessLogModel.timestamp < until)
+                    .group_by(bucket).order_by(bucket))
+
+        async def raw_presence():
+            async with database.Session() as session:
+                count = func.count().label("count")
+                await session.execute(
+                    select(AccessLogModel.employee_id, EmployeeModel.name, func.min(AccessLogModel.timestamp),
+                           func.max(AccessLogModel.timestamp), count)
+                    .join(EmployeeModel, EmployeeModel.id == AccessLogModel.employee_id)
+                    .where(AccessLogModel.timestamp >= START, AccessLogModel.timestamp < month_end)
+                    .group_by(AccessLogModel.employee_id, EmployeeModel.name)
+                    .order_by(desc(count), AccessLogModel.employee_id).limit(100))
+
+        cases = [
+            ("hourly, 30 days", lambda: raw_buckets("hour", month_end),
+             lambda: database.get_access_stats("hour", START, month_end)),
+            (f"daily, {DAYS} days", lambda: raw_buckets("day", end),
+             lambda: database.get_access_stats("day", START, end)),
+            ("employees, 30 days", raw_presence,
+             lambda: database.get_employee_presence(START, month_end)),
+        ]
+        for name, raw, rollup in cases:
+            raw_p50, raw_p95 = await timed(raw, max(REPEAT // 4, 3))
+            rollup_p50, rollup_p95 = await timed(rollup)
+            print(f"{name:20} scan p50 {raw_p50:8.2f} ms p95 {raw_p95:8.2f} ms | "
+                  f"rollups p50 {rollup_p50:7.2f} ms p95 {rollup_p95:7.2f} ms")
+
+        # Цена поддержки агрегатов при записи: пачка через add_access_logs против голого INSERT,
+        # события пачки, как у камер, за последний час
+        batch = [(rng.choice(ids), START + timedelta(days=DAYS - 1, seconds=rng.randrange(3600)))
+                 for _ in range(1000)]
+
+        async def plain_insert():
+            async with database.Session() as session:
+                await session.execute(insert(AccessLogModel).values(
+                    [{"employee_id": employee_id, "timestamp": timestamp} for employee_id, timestamp in batch]))
+                await session.commit()
+
+        plain_p50, _ = await timed(plain_insert, 5)
+        rollup_p50, _ = await timed(lambda: database.add_access_logs(batch), 5)
+        print(f"write 1000 logs: INSERT p50 {plain_p50:.2f} ms, with rollups p50 {rollup_p50:.2f} ms")
+    finally:
+        async with database.engine.begin() as conn:
+            await conn.execute(delete(AccessLogModel).where(AccessLogModel.timestamp >= START,
+                                                            AccessLogModel.timestamp < end))
+            await conn.execute(delete(AccessLogRollupModel).where(AccessLogRollupModel.bucket >= START,
+                                                                  AccessLogRollupModel.bucket < end))
+            await conn.execute(delete(EmployeeDailyModel).where(EmployeeDailyModel.day >= START,
+                                                                EmployeeDailyModel.day < end))
+            await conn.execute(delete(EmployeeModel).where(EmployeeModel.photo_url == MARK))
+        await database.close()
+        database.hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+                     int(sys.argv[2]) if len(sys.argv) > 2 else 500))
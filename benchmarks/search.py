@@ -0,0 +1,86 @@
+"""
+Поиск сотрудников по подстроке имени: p50/p95 задержки страницы с общим количеством,
+старый ILIKE '%q%' с COUNT(*) против EmployeeSearch (pg_trgm или индекс в памяти).
+Вставляет сотрудников в базу из DB_URL (лучше отдельную) и удаляет их в конце.
+Запуск: python -m benchmarks.search [rows]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import insert, delete, select, func, desc
+
+from src.database.async_database import AsyncDatabase
+from src.database.models import EmployeeModel
+
+MARK = "bench-search"
+SYLLABLES = ["ан", "ва", "ен", "ко", "ли", "ма", "ни", "ов", "па", "ра", "се", "ти", "ус", "фе", "ха", "ше",
+             "al", "be", "co", "da", "el", "fi", "go", "ha", "in", "jo", "ka", "lu", "mi", "no", "or", "pe"]
+QUERIES = 50
+
+
+def random_name(rng, i):
+    first = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+    last = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 5))).capitalize()
+    return f"{first} {last} {i}"
+
+
+async def timed(fn, queries):
+    latency = []
+    for query in queries:
+        start = time.perf_counter()
+        await fn(query)
+        latency.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latency, [50, 95])
+
+
+async def main(rows: int):
+    load_dotenv()
+    database = AsyncDatabase(os.getenv('DB_URL'), os.getenv('ROOT_PASSWORD'), os.getenv('ADMIN_PASSWORD'))
+    rng = random.Random(0)
+    names = [random_name(rng, i) for i in range(rows)]
+    await database.init()
+    async with database.engine.begin() as conn:
+        for chunk in range(0, rows, 10_000):
+            await conn.execute(insert(EmployeeModel), [
+                {"name": name, "info": "-", "is_access": True, "photo_url": MARK} for name in names[chunk:chunk + 10_000]
+            ])
+    # Повторная инициализация загружает новых сотрудников в индекс в памяти
+    await database.init()
+    print(f"{rows} employees, search via {'pg_trgm' if database.search.use_trgm else 'in-process n-gram index'}")
+
+    async def old_search(query):
+        async with database.Session() as session:
+            condition = EmployeeModel.name.ilike(f"%{query}%")
+            await session.execute(select(EmployeeModel).where(condition)
+                                  .order_by(desc(EmployeeModel.name), desc(EmployeeModel.id)).limit(10))
+            await session.execute(select(func.count()).select_from(EmployeeModel).where(condition))
+
+    async def new_search(query):
+        # Без кэша количества - измеряется сам поиск
+        database.counters.invalidate(EmployeeModel.__tablename__)
+        await database.get_employees(1, 10, query)
+        await database.get_employees_size(query)
+
+    try:
+        for length in (2, 3, 5, 8):
+            queries = []
+            for name in rng.sample(names, QUERIES):
+                start = rng.randrange(max(len(name) - length, 1))
+                queries.append(name[start:start + length].lower())
+            old_p50, old_p95 = await timed(old_search, queries)
+            new_p50, new_p95 = await timed(new_search, queries)
+            print(f"query length {length}: ILIKE p50 {old_p50:7.2f} ms p95 {old_p95:7.2f} ms, "
+                  f"search p50 {new_p50:7.2f} ms p95 {new_p95:7.2f} ms")
+    finally:
+        async with database.engine.begin() as conn:
+            await conn.execute(delete(EmployeeModel).where(EmployeeModel.photo_url == MARK))
+        await database.close()
+        database.hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
@@ -0,0 +1,142 @@
+"""
+Задержка рассылки уведомления по WebSocket на 1000 клиентов: от broadcast до получения каждым клиентом.
+Клиенты имитируются без сети: отправка занимает send_ms, часть клиентов медленные (slow_ms),
+часть уже отключились и падают на отправке. Сравнивается последовательная рассылка
+(прежний WebSocketManager, не больше 5 сообщений) с очередями на клиента.
+Запуск: python -m benchmarks.websocket_fanout [clients] [messages] [slow_share] [dead_share]
+"""
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+
+from datetime import datetime
+from src.schemas.schemas import AccessLogEvent
+from src.utils.websockets import WebSocketManager
+
+SEND_MS = 0.2
+SLOW_MS = 200
+
+
+class FakeWebSocket:
+
+    def __init__(self, delay: float, dead: bool = False):
+        self.delay = delay
+        self.dead = dead
+        self.latencies = []
+        self.sent_at = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.dead:
+            raise RuntimeError("websocket is closed")
+        await asyncio.sleep(self.delay)
+        data = json.loads(message)
+        # Последовательной рассылке уходит само событие, WebSocketManager - {"seq", "data": событие}
+        self.latencies.append(time.perf_counter() - self.sent_at[data.get("data", data)["id"]])
+
+    async def receive_text(self):
+        await asyncio.Event().wait()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class SequentialManager:
+
+    """Прежняя рассылка: клиенты по очереди, каждый send_text ожидается"""
+
+    def __init__(self):
+        self.active_connections = []
+
+    async def connect(self, websocket):
+        await websocket.accept()
+        self.active_connections.append(websocket)
+
+    def disconnect(self, websocket):
+        self.active_connections.remove(websocket)
+
+    async def broadcast(self, message: str):
+        for connection in self.active_connections:
+            try:
+                await connection.send_text(message)
+            except Exception:
+                pass
+
+
+def make_clients(count: int, slow_share: float, dead_share: float):
+    rnd = random.Random(1)
+    clients = []
+    for _ in range(count):
+        r = rnd.random()
+        if r < dead_share:
+            clients.append(FakeWebSocket(0, dead=True))
+        elif r < dead_share + slow_share:
+            clients.append(FakeWebSocket(SLOW_MS / 1000))
+        else:
+            clients.append(FakeWebSocket(SEND_MS / 1000 * rnd.uniform(0.5, 1.5)))
+    return clients
+
+
+async def run(manager, clients, messages: int, interval: float):
+    sent_at = {}
+    if isinstance(manager, WebSocketManager):
+        await manager.start()
+    for client in clients:
+        client.sent_at = sent_at
+        await manager.connect(client)
+    start = time.perf_counter()
+    broadcast_times = []
+    for i in range(messages):
+        sent_at[i] = time.perf_counter()
+        message = AccessLogEvent(id=i, employeeId=i % 100, name=f"employee {i % 100}", access=i % 2 == 0,
+                                 time=str(datetime.now()), photoUrl=f"/accessLog/photo?id={i}").model_dump_json()
+        await manager.broadcast(message)
+        broadcast_times.append(time.perf_counter() - sent_at[i])
+        await asyncio.sleep(interval)
+    # Ждём, пока быстрые клиенты получат всё
+    fast = [client for client in clients if not client.dead and client.delay < SLOW_MS / 1000]
+    deadline = time.perf_counter() + 30
+    while time.perf_counter() < deadline and any(len(client.latencies) < messages for client in fast):
+        await asyncio.sleep(0.01)
+    total = time.perf_counter() - start
+    latencies = sorted(latency for client in fast for latency in client.latencies)
+    delivered = sum(len(client.latencies) for client in fast)
+    if isinstance(manager, WebSocketManager):
+        await manager.stop()
+    return broadcast_times, latencies, delivered, len(fast) * messages, total
+
+
+def report(name, broadcast_times, latencies, delivered, expected, total):
+    def ms(value):
+        return f"{value * 1000:9.2f}"
+    p = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+    print(f"{name:12} broadcast avg {ms(statistics.mean(broadcast_times))} ms | delivery p50 {ms(p[49])} "
+          f"p99 {ms(p[98])} max {ms(latencies[-1] if latencies else 0)} ms | "
+          f"fast clients got {delivered}/{expected} | total {total:.2f} s")
+
+
+async def main(clients: int, messages: int, slow_share: float, dead_share: float):
+    interval = 0.05
+    print(f"{clients} clients, {messages} messages every {interval * 1000:.0f} ms, "
+          f"{slow_share:.0%} slow ({SLOW_MS} ms per send), {dead_share:.0%} disconnected")
+    # Последовательная рассылка на порядки медленнее, ей хватает нескольких сообщений
+    report("sequential", *await run(SequentialManager(), make_clients(clients, slow_share, dead_share),
+                                    min(messages, 5), interval))
+    for policy in ("drop_oldest", "close"):
+        manager = WebSocketManager(max_queue=16, policy=policy, send_timeout=1)
+        result = await run(manager, make_clients(clients, slow_share, dead_share), messages, interval)
+        report(policy, *result)
+        print(f"{'':12} {manager.stats()}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(int(args[0]) if len(args) > 0 else 1000,
+                     int(args[1]) if len(args) > 1 else 20,
+                     float(args[2]) if len(args) > 2 else 0.01,
+                     float(args[3]) if len(args) > 3 else 0.05))
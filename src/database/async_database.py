@@ -0,0 +1,686 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy import select, func, delete, desc, update, insert, tuple_, text, cast, String
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import joinedload, selectinload, load_only
+from src.matcher.matcher import FaceMatcher
+from src.matcher.storage import pack_encoding, unpack_encodings, ENCODING_VERSION
+from src.database.migrations import migrate, migrate_sequences
+from src.database.partitions import drop_range, ensure_partitions, add_months
+from src.database.rollups import rollup_statements, backfill, log_insert
+from src.utils.pagination import encode_cursor, decode_cursor
+from src.database.counters import Counters
+from src.database.search import EmployeeSearch
+from src.utils.principal_cache import PrincipalCache
+from src.utils.hashing import PasswordHasher
+
+from src.database.models import AbstractModel, UserModel, EmployeeModel, AccessLogModel, AccessLayerModel, \
+    EmployeeEncodingsModel, EncodingJobModel, AccessLogRollupModel, EmployeeDailyModel
+from src.database.database import EMPLOYEE_SCHEMA_COLUMNS, enable_foreign_keys
+
+
+def async_url(URL):
+    """Тот же DB_URL, но с асинхронным драйвером"""
+    url = make_url(URL)
+    backend = url.get_backend_name()
+    if backend == 'postgresql':
+        return url.set(drivername='postgresql+asyncpg')
+    if backend == 'sqlite':
+        return url.set(drivername='sqlite+aiosqlite')
+    return url
+
+
+def name_contains(substr):
+    """ILIKE по подстроке, % и _ в запросе - обычные символы. В PostgreSQL идёт через GIN индекс pg_trgm"""
+    substr = substr.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return EmployeeModel.name.ilike(f"%{substr}%", escape='\\')
+
+
+class AsyncDatabase:
+
+    """
+    Асинхронная реализация API Database поверх SQLAlchemy AsyncEngine и asyncpg.
+    Схема, миграции и начальные данные создаются в init(), его нужно вызвать при старте приложения.
+    Все методы принимают session: одна сессия (и одно соединение) на запрос через Depends(get_session).
+    Без session метод открывает свою.
+    """
+
+    def __init__(self, URL, root_password, admin_password, face_matcher=None, count_mode='exact', count_ttl=60,
+                 pool_size=10, max_overflow=20, pool_timeout=30, pool_recycle=1800, statement_cache_size=256,
+                 principal_cache=None, hasher=None):
+        self.URL = async_url(URL)
+        self.root_password = root_password
+        self.admin_password = admin_password
+        self.counters = Counters(count_mode, count_ttl)
+        engine_args = {}
+        if self.URL.get_backend_name() == 'postgresql':
+            engine_args = dict(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout,
+                               pool_recycle=pool_recycle)
+            # Кэш подготовленных выражений asyncpg на каждом соединении
+            self.URL = self.URL.update_query_dict({"prepared_statement_cache_size": str(statement_cache_size)})
+        self.engine = create_async_engine(self.URL, echo=False, pool_pre_ping=True, **engine_args)
+        enable_foreign_keys(self.engine)
+        self.Session = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.face_matcher = face_matcher if face_matcher is not None else FaceMatcher()
+        self.principal_cache = principal_cache if principal_cache is not None else PrincipalCache()
+        self.hasher = hasher if hasher is not None else PasswordHasher()
+        self.search = EmployeeSearch()
+
+    async def init(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(AbstractModel.metadata.create_all)
+            await conn.run_sync(migrate, AbstractModel.metadata)
+            await conn.run_sync(self.search.setup)
+        await self._add_initial_data(self.root_password, self.admin_password)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(migrate_sequences, AbstractModel.metadata)
+        self.face_matcher.load_matrix(*unpack_encodings(await self.get_encodings()))
+        if not self.search.use_trgm:
+            async with self.Session() as session:
+                self.search.load((await session.execute(select(EmployeeModel.id, EmployeeModel.name))).all())
+
+    async def close(self):
+        await self.engine.dispose()
+
+    async def get_session(self):
+        """FastAPI зависимость: сессия на время запроса"""
+        async with self.Session() as session:
+            yield session
+
+    @asynccontextmanager
+    async def _session(self, session=None):
+        if session is not None:
+            yield session
+        else:
+            async with self.Session() as session:
+                yield session
+
+    async def _add_initial_data(self, root_password, admin_password):
+        async with self.Session() as session:
+            res = await session.execute(select(AccessLayerModel.id))
+            if res.first() is None:
+                admin_access_layer = AccessLayerModel(id=0, name="admin")
+                await self.add(session, admin_access_layer)
+                user_access_layer = AccessLayerModel(id=1, name="user")
+                await self.add(session, user_access_layer)
+            res = await session.execute(select(UserModel.id))
+            if res.first() is None:
+                root_user = UserModel(id=0, login='root', password=await self.hasher.hash(root_password),
+                                      access_layer_id=0)
+                admin = UserModel(id=1, login='admin', password=await self.hasher.hash(admin_password),
+                                  access_layer_id=0)
+                await self.add(session, admin)
+                await self.add(session, root_user)
+            res = await session.execute(select(EmployeeModel.id))
+            if res.first() is None:
+                unknown_employee = EmployeeModel(id=0, name="-", info="-", photo_url="/", is_access=False)
+                await self.add(session, unknown_employee)
+
+    async def add(self, session, obj):
+        session.add(obj)
+        await session.commit()
+
+    # Users
+
+    async def add_user(self, login, password, access_layer_id, session=None):
+        """
+        Один INSERT: id выдаёт последовательность, повтор логина и несуществующий уровень доступа
+        отсекают уникальный индекс и внешний ключ.
+        """
+        async with self._session(session) as session:
+            password = await self.hasher.hash(password)
+            try:
+                await session.execute(insert(UserModel)
+                                      .values(login=login, password=password, access_layer_id=access_layer_id))
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                return False
+            self.counters.add(UserModel.__tablename__, 1)
+            return True
+
+    async def get_users(self, page: int = 1, page_size: int = 10, cursor: str = None, session=None):
+        """Возвращает (users, next_cursor), None если курсор повреждён"""
+        async with self._session(session) as session:
+            stmt = select(UserModel).where(UserModel.login != "root").order_by(UserModel.id).limit(page_size)
+            if cursor is not None:
+                values = decode_cursor(cursor, int)
+                if values is None: return None
+                stmt = stmt.where(UserModel.id > values[0])
+            else:
+                stmt = stmt.offset((page - 1) * page_size)
+            res = await session.execute(stmt)
+            users = res.scalars().all()
+            next_cursor = encode_cursor(users[-1].id) if users and len(users) == page_size else None
+            return users, next_cursor
+
+    async def get_users_size(self, session=None):
+        return await self.counters.aget(UserModel.__tablename__,
+                                        lambda estimate: self._count(UserModel, estimate, session=session))
+
+    async def get_user(self, login, session=None):
+        async with self._session(session) as session:
+            res = await session.execute(select(UserModel).where(UserModel.login == login))
+            user = res.scalar()
+            return user
+
+    async def get_user_by_id(self, user_id, session=None):
+        async with self._session(session) as session:
+            return await session.get(UserModel, user_id)
+
+    async def delete_user(self, user_id, session=None):
+        async with self._session(session) as session:
+            res = await session.execute(delete(UserModel).where(UserModel.id == user_id).returning(UserModel.id))
+            deleted = res.scalar() is not None
+            await session.commit()
+            if deleted:
+                self.counters.add(UserModel.__tablename__, -1)
+                await self.principal_cache.invalidate(user_id)
+            return deleted
+
+    async def set_user_password(self, user_id, new_password, session=None):
+        password = await self.hasher.hash(new_password)
+        return await self._update_user(user_id, session, password=password)
+
+    async def set_user_password_hash(self, user_id, password_hash, session=None):
+        """Замена хэша без пересчёта, например после rehash при входе"""
+        return await self._update_user(user_id, session, password=password_hash)
+
+    async def set_user_access(self, user_id, access_layer_id, session=None):
+        return await self._update_user(user_id, session, access_layer_id=access_layer_id)
+
+    async def _update_user(self, user_id, session=None, **values):
+        async with self._session(session) as session:
+            res = await session.execute(update(UserModel).where(UserModel.id == user_id).values(**values)
+                                        .returning(UserModel.id))
+            updated = res.scalar() is not None
+            await session.commit()
+            if updated:
+                await self.principal_cache.invalidate(user_id)
+            return updated
+
+    # AccessLogs
+
+    async def get_access_logs(self, page: int = 1, page_size: int = 10, cursor: str = None, session=None):
+        """Возвращает (logs, next_cursor), None если курсор повреждён"""
+        async with self._session(session) as session:
+            stmt = (select(AccessLogModel)
+                    .options(load_only(AccessLogModel.id, AccessLogModel.timestamp, AccessLogModel.employee_id),
+                             joinedload(AccessLogModel.employee).load_only(EmployeeModel.name, EmployeeModel.is_access))
+                    .order_by(desc(AccessLogModel.timestamp), desc(AccessLogModel.id)).limit(page_size))
+            if cursor is not None:
+                values = decode_cursor(cursor, datetime.fromisoformat, int)
+                if values is None: return None
+                stmt = stmt.where(tuple_(AccessLogModel.timestamp, AccessLogModel.id) < tuple_(*values))
+            else:
+                stmt = stmt.offset((page - 1) * page_size)
+            res = await session.execute(stmt)
+            logs = res.scalars().unique().all()
+            next_cursor = None
+            if logs and len(logs) == page_size:
+                next_cursor = encode_cursor(logs[-1].timestamp.isoformat(), logs[-1].id)
+            logs = list(map(lambda x: x.to_schema(), logs))
+            return logs, next_cursor
+
+    async def get_access_log(self, id, with_employee=True, session=None):
+        async with self._session(session) as session:
+            stmt = select(AccessLogModel).where(AccessLogModel.id == id)
+            if with_employee:
+                stmt = stmt.options(joinedload(AccessLogModel.employee)
+                                    .load_only(EmployeeModel.name, EmployeeModel.is_access))
+            res = await session.execute(stmt)
+            access_log = res.scalar()
+            return access_log
+
+    async def get_access_log_size(self, session=None):
+        return await self.counters.aget(AccessLogModel.__tablename__,
+                                        lambda estimate: self._count(AccessLogModel, estimate, session=session))
+
+    async def add_access_log(self, employee_id, timestamp, session=None):
+        """
+        Один запрос и COMMIT: id выдаёт последовательность access_logs, сотрудник и его is_access берутся
+        в самом INSERT ... SELECT, агрегаты обновляются тем же запросом (log_insert).
+        False, если сотрудника нет.
+        """
+        async with self._session(session) as session:
+            try:
+                log_id = (await session.execute(log_insert(self.engine.dialect.name, employee_id, timestamp))).scalar()
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                return False
+            if log_id is None:
+                return False
+            self.counters.add(AccessLogModel.__tablename__, 1)
+            return True
+
+    async def add_access_logs(self, events, session=None):
+        """
+        Запись пачки (employee_id, timestamp) одним INSERT.
+        События неизвестных сотрудников записываются на сотрудника 0 (неизвестный человек).
+        """
+        async with self._session(session) as session:
+            employee_ids = {employee_id for employee_id, _ in events} | {0}
+            res = await session.execute(select(EmployeeModel.id, EmployeeModel.is_access)
+                                        .where(EmployeeModel.id.in_(employee_ids)))
+            known = dict(res.all())
+            rows = [{"employee_id": employee_id if employee_id in known else 0, "timestamp": timestamp}
+                    for employee_id, timestamp in events]
+            await session.execute(insert(AccessLogModel).values(rows))
+            await self._update_rollups(session, [(row["employee_id"], row["timestamp"], known[row["employee_id"]])
+                                                 for row in rows])
+            await session.commit()
+            self.counters.add(AccessLogModel.__tablename__, len(rows))
+            return len(rows)
+
+    async def _update_rollups(self, session, events):
+        """Агрегаты для /accessLogs/stats в той же транзакции, что и сами логи"""
+        if self.engine.dialect.name == 'sqlite':
+            # В SQLite агрегаты уже обновил триггер на access_logs
+            return
+        for stmt in rollup_statements(self.engine.dialect.name, events):
+            await session.execute(stmt)
+
+    async def get_access_stats(self, period: str, start: datetime, end: datetime, session=None):
+        """Бакеты (bucket, total, granted, denied) за [start, end) только из агрегатов"""
+        async with self._session(session) as session:
+            res = await session.execute(
+                select(AccessLogRollupModel.bucket, AccessLogRollupModel.total, AccessLogRollupModel.granted,
+                       AccessLogRollupModel.denied)
+                .where(AccessLogRollupModel.period == period, AccessLogRollupModel.bucket >= start,
+                       AccessLogRollupModel.bucket < end)
+                .order_by(AccessLogRollupModel.bucket))
+            return res.all()
+
+    async def get_employee_presence(self, start: datetime, end: datetime, employee_id: int = None, limit: int = 100,
+                                    session=None):
+        """(employee_id, name, first_seen, last_seen, count) по дням [start, end), чаще всех проходившие первыми"""
+        async with self._session(session) as session:
+            count = func.sum(EmployeeDailyModel.count).label("count")
+            stmt = (select(EmployeeDailyModel.employee_id, EmployeeModel.name,
+                           func.min(EmployeeDailyModel.first_seen), func.max(EmployeeDailyModel.last_seen), count)
+                    .outerjoin(EmployeeModel, EmployeeModel.id == EmployeeDailyModel.employee_id)
+                    .where(EmployeeDailyModel.day >= start, EmployeeDailyModel.day < end)
+                    .group_by(EmployeeDailyModel.employee_id, EmployeeModel.name)
+                    .order_by(desc(count), EmployeeDailyModel.employee_id).limit(limit))
+            if employee_id is not None:
+                stmt = stmt.where(EmployeeDailyModel.employee_id == employee_id)
+            return (await session.execute(stmt)).all()
+
+    async def backfill_rollups(self, start: datetime = None, end: datetime = None):
+        async with self.engine.begin() as conn:
+            return await conn.run_sync(backfill, start, end)
+
+    async def get_access_log_bounds(self, session=None):
+        """(min, max) timestamp логов, (None, None) если логов нет"""
+        async with self._session(session) as session:
+            res = await session.execute(select(func.min(AccessLogModel.timestamp), func.max(AccessLogModel.timestamp)))
+            return tuple(res.one())
+
+    async def stream_access_log_rows(self, start: datetime, end: datetime, batch_size: int = 1000):
+        """Строки (id, employee_id, timestamp, photo_url) за [start, end) пачками, курсором на стороне сервера"""
+        async with self.Session() as session:
+            stmt = (select(AccessLogModel.id, AccessLogModel.employee_id, AccessLogModel.timestamp,
+                           AccessLogModel.photo_url)
+                    .where(AccessLogModel.timestamp >= start, AccessLogModel.timestamp < end)
+                    .order_by(AccessLogModel.timestamp, AccessLogModel.id)
+                    .execution_options(yield_per=batch_size))
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                yield rows
+
+    async def stream_access_logs(self, start: datetime = None, end: datetime = None, employee_id: int = None,
+                                 batch_size: int = 1000):
+        """
+        Логи для выгрузки пачками по batch_size: (id, timestamp, employee_id, name, is_access, photo_url)
+        по возрастанию времени. Курсор на стороне сервера, в памяти не больше одной пачки.
+        Открывает свою сессию: генератор дочитывается уже после возврата из эндпоинта.
+        """
+        async with self.Session() as session:
+            stmt = (select(AccessLogModel.id, AccessLogModel.timestamp, AccessLogModel.employee_id, EmployeeModel.name,
+                           EmployeeModel.is_access, AccessLogModel.photo_url)
+                    .join(EmployeeModel, EmployeeModel.id == AccessLogModel.employee_id)
+                    .order_by(AccessLogModel.timestamp, AccessLogModel.id)
+                    .execution_options(yield_per=batch_size))
+            if start is not None:
+                stmt = stmt.where(AccessLogModel.timestamp >= start)
+            if end is not None:
+                stmt = stmt.where(AccessLogModel.timestamp < end)
+            if employee_id is not None:
+                stmt = stmt.where(AccessLogModel.employee_id == employee_id)
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                yield rows
+
+    async def drop_access_logs(self, start: datetime, end: datetime):
+        """Удаляет логи за [start, end), секцию PostgreSQL - целиком. Возвращает число строк"""
+        async with self.engine.begin() as conn:
+            count = await conn.run_sync(drop_range, start, end)
+        self.counters.add(AccessLogModel.__tablename__, -count)
+        return count
+
+    async def ensure_access_log_partitions(self, months_ahead: int):
+        now = datetime.now()
+        async with self.engine.begin() as conn:
+            return await conn.run_sync(ensure_partitions, now, add_months(now, months_ahead))
+
+    # Employees
+
+    async def get_employees(self, page=1, page_size=10, substr=None, cursor: str = None, session=None):
+        """Возвращает (employees, next_cursor), None если курсор повреждён"""
+        if substr is not None and substr != '':
+            return await self._search_employees(substr, page, page_size, cursor, session)
+        async with self._session(session) as session:
+            stmt = (select(EmployeeModel).options(load_only(*EMPLOYEE_SCHEMA_COLUMNS))
+                    .order_by(desc(EmployeeModel.name), desc(EmployeeModel.id)).limit(page_size))
+            if cursor is not None:
+                values = decode_cursor(cursor, str, int)
+                if values is None: return None
+                stmt = stmt.where(tuple_(EmployeeModel.name, EmployeeModel.id) < tuple_(*values))
+            else:
+                stmt = stmt.offset((page - 1) * page_size)
+            res = await session.execute(stmt)
+            employees = res.scalars().unique().all()
+            next_cursor = None
+            if employees and len(employees) == page_size:
+                next_cursor = encode_cursor(employees[-1].name, employees[-1].id)
+            employees = list(map(lambda x: x.to_schema(), employees))
+            return employees, next_cursor
+
+    async def _search_employees(self, substr, page, page_size, cursor, session=None):
+        """
+        Поиск по подстроке имени, самые похожие на запрос первыми.
+        Курсор - (score, name, id) последней строки страницы.
+        """
+        after = None
+        if cursor is not None:
+            after = decode_cursor(cursor, float, str, int)
+            if after is None: return None
+        async with self._session(session) as session:
+            if self.search.use_trgm:
+                score = func.similarity(EmployeeModel.name, substr)
+                stmt = (select(EmployeeModel, score).options(load_only(*EMPLOYEE_SCHEMA_COLUMNS))
+                        .where(name_contains(substr))
+                        .order_by(desc(score), desc(EmployeeModel.name), desc(EmployeeModel.id)).limit(page_size))
+                if after is not None:
+                    stmt = stmt.where(tuple_(score, EmployeeModel.name, EmployeeModel.id) < tuple_(*after))
+                else:
+                    stmt = stmt.offset((page - 1) * page_size)
+                found = [(row_score, employee) for employee, row_score in (await session.execute(stmt)).all()]
+            else:
+                results = self.search.index.search(substr)
+                if after is not None:
+                    results = [result for result in results if result < tuple(after)]
+                else:
+                    results = results[(page - 1) * page_size:]
+                results = results[:page_size]
+                employees = {}
+                if results:
+                    res = await session.execute(select(EmployeeModel).options(load_only(*EMPLOYEE_SCHEMA_COLUMNS))
+                                                .where(EmployeeModel.id.in_([result[2] for result in results])))
+                    employees = {employee.id: employee for employee in res.scalars()}
+                found = [(row_score, employees[employee_id]) for row_score, _, employee_id in results
+                         if employee_id in employees]
+            next_cursor = None
+            if found and len(found) == page_size:
+                last_score, last = found[-1]
+                next_cursor = encode_cursor(last_score, last.name, last.id)
+            return [employee.to_schema() for _, employee in found], next_cursor
+
+    async def get_employee(self, employee_id: int, with_logs=False, session=None):
+        async with self._session(session) as session:
+            stmt = select(EmployeeModel).where(EmployeeModel.id == employee_id)
+            if with_logs:
+                stmt = stmt.options(selectinload(EmployeeModel.access_logs))
+            res = await session.execute(stmt)
+            employee = res.scalar()
+            return employee
+
+    async def add_employee(self, name, info, is_access, session=None):
+        """id нового сотрудника, None если имя уже занято"""
+        async with self._session(session) as session:
+            info = info if info != '' else '-'
+            try:
+                res = await session.execute(insert(EmployeeModel)
+                                            .values(name=name, info=info, is_access=is_access)
+                                            .returning(EmployeeModel.id))
+                employee_id = res.scalar()
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                return None
+            self.counters.add(EmployeeModel.__tablename__, 1)
+            self.search.set(employee_id, name)
+            return employee_id
+
+    async def add_employees(self, rows, session=None):
+        """
+        Пачка новых сотрудников: одна проверка занятых имён на всю пачку и один многострочный INSERT.
+        rows - dict(name, info, is_access) с уникальными внутри пачки именами. Возвращает {name: id} созданных,
+        занятые имена пропускаются. None - пачку не удалось вставить и со второй попытки.
+        """
+        async with self._session(session) as session:
+            # Второй проход - если имя заняли параллельно между проверкой и вставкой
+            for _ in range(2):
+                res = await session.execute(select(EmployeeModel.name)
+                                            .where(EmployeeModel.name.in_([row['name'] for row in rows])))
+                taken = set(res.scalars().all())
+                new = [row for row in rows if row['name'] not in taken]
+                if not new:
+                    return {}
+                try:
+                    res = await session.execute(insert(EmployeeModel).values(new)
+                                                .returning(EmployeeModel.id, EmployeeModel.name))
+                    created = {name: employee_id for employee_id, name in res.all()}
+                    await session.commit()
+                    break
+                except IntegrityError:
+                    await session.rollback()
+            else:
+                return None
+            self.counters.add(EmployeeModel.__tablename__, len(created))
+            for name, employee_id in created.items():
+                self.search.set(employee_id, name)
+            return created
+
+    async def set_employee_photo(self, employee_id, session=None):
+        async with self._session(session) as session:
+            res = await session.execute(update(EmployeeModel).where(EmployeeModel.id == employee_id)
+                                        .values(photo_url=str(employee_id)).returning(EmployeeModel.id))
+            if res.scalar() is None:
+                await session.rollback()
+                return False
+            # Удаление энкодинга, новый посчитает задача в той же транзакции
+            await session.execute(delete(EmployeeEncodingsModel)
+                                  .where(EmployeeEncodingsModel.employee_id == employee_id))
+            await session.execute(self._upsert_encoding_jobs([employee_id]))
+            await session.commit()
+            self.face_matcher.remove(employee_id)
+            return True
+
+    async def set_employee_photos(self, employee_ids, session=None):
+        """set_employee_photo для пачки сотрудников одной транзакцией"""
+        async with self._session(session) as session:
+            await session.execute(update(EmployeeModel).where(EmployeeModel.id.in_(employee_ids))
+                                  .values(photo_url=cast(EmployeeModel.id, String)))
+            await session.execute(delete(EmployeeEncodingsModel)
+                                  .where(EmployeeEncodingsModel.employee_id.in_(employee_ids)))
+            await session.execute(self._upsert_encoding_jobs(employee_ids))
+            await session.commit()
+            for employee_id in employee_ids:
+                self.face_matcher.remove(employee_id)
+
+    async def get_employees_size(self, substr=None, session=None):
+        if substr is None or substr == '':
+            return await self.counters.aget(EmployeeModel.__tablename__,
+                                            lambda estimate: self._count(EmployeeModel, estimate, session=session))
+        if self.search.use_trgm:
+            loader = lambda estimate: self._count(EmployeeModel, False, name_contains(substr), session)
+        else:
+            async def loader(estimate):
+                return len(self.search.index.search(substr))
+        return await self.counters.aget(EmployeeModel.__tablename__, loader, key=substr)
+
+    async def delete_employee(self, employee_id: int, session=None):
+        async with self._session(session) as session:
+            # Замена связанных логов
+            await session.execute(update(AccessLogModel)
+                                  .where(AccessLogModel.employee_id == employee_id).values(employee_id=0))
+            # Удаление энкодинга
+            await session.execute(delete(EmployeeEncodingsModel)
+                                  .where(EmployeeEncodingsModel.employee_id == employee_id))
+            res = await session.execute(delete(EmployeeModel).where(EmployeeModel.id == employee_id)
+                                        .returning(EmployeeModel.id))
+            if res.scalar() is None:
+                await session.rollback()
+                return False
+            await session.commit()
+            self.counters.add(EmployeeModel.__tablename__, -1)
+            self.face_matcher.remove(employee_id)
+            self.search.remove(employee_id)
+            return True
+
+    async def set_employee_data(self, employee_id, name, info, is_access, session=None):
+        async with self._session(session) as session:
+            info = "-" if not info else info
+            try:
+                # Уникальность имени проверяет сама база
+                res = await session.execute(update(EmployeeModel).where(EmployeeModel.id == employee_id)
+                                            .values(name=name, info=info, is_access=is_access)
+                                            .returning(EmployeeModel.id))
+                if res.scalar() is None:
+                    await session.rollback()
+                    return False
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                return False
+            # Имя могло измениться - счётчики поиска больше не верны
+            self.counters.add(EmployeeModel.__tablename__, 0)
+            self.search.set(employee_id, name)
+            return True
+
+    async def _count(self, model, estimate=False, condition=None, session=None):
+        async with self._session(session) as session:
+            if estimate and self.engine.dialect.name == 'postgresql':
+                res = await session.execute(
+                    text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                    {"table": model.__tablename__})
+                value = res.scalar()
+                # -1 - таблица ещё ни разу не анализировалась
+                if value is not None and value >= 0:
+                    return value
+            stmt = select(func.count()).select_from(model)
+            if condition is not None:
+                stmt = stmt.where(condition)
+            return (await session.execute(stmt)).scalar()
+
+    # Encodings
+
+    async def get_encodings(self, session=None):
+        async with self._session(session) as session:
+            res = await session.execute(select(EmployeeEncodingsModel.employee_id, EmployeeEncodingsModel.version,
+                                               EmployeeEncodingsModel.encoding))
+            return res.all()
+
+    async def set_employee_encoding(self, employee_id, encoding, session=None):
+        async with self._session(session) as session:
+            employee = await session.get(EmployeeModel, employee_id)
+            if employee is None: return False
+            await session.execute(delete(EmployeeEncodingsModel)
+                                  .where(EmployeeEncodingsModel.employee_id == employee_id))
+            await self.add(session, EmployeeEncodingsModel(employee_id=employee_id, version=ENCODING_VERSION,
+                                                           encoding=pack_encoding(encoding)))
+            self.face_matcher.set(employee_id, encoding)
+            return True
+
+    # Encoding jobs
+
+    def _upsert_encoding_jobs(self, employee_ids):
+        """Постановка задач: новая строка или перезапуск существующей с новым поколением"""
+        dialect_insert = postgresql.insert if self.engine.dialect.name == 'postgresql' else sqlite.insert
+        now = datetime.now()
+        stmt = dialect_insert(EncodingJobModel).values([
+            dict(employee_id=employee_id, status='pending', attempts=0, generation=1, run_at=now, updated_at=now)
+            for employee_id in employee_ids])
+        return stmt.on_conflict_do_update(index_elements=['employee_id'], set_=dict(
+            status='pending', attempts=0, generation=EncodingJobModel.generation + 1, run_at=now, updated_at=now,
+            error=None))
+
+    async def enqueue_encoding_jobs(self, employee_ids, session=None):
+        async with self._session(session) as session:
+            await session.execute(self._upsert_encoding_jobs(employee_ids))
+            await session.commit()
+
+    async def claim_encoding_jobs(self, limit, session=None):
+        """
+        Забирает до limit готовых к запуску задач, возвращает (employee_id, generation, attempts).
+        SKIP LOCKED не даёт нескольким процессам приложения взять одну задачу.
+        """
+        async with self._session(session) as session:
+            now = datetime.now()
+            ready = (select(EncodingJobModel.id)
+                     .where(EncodingJobModel.status == 'pending', EncodingJobModel.run_at <= now)
+                     .order_by(EncodingJobModel.run_at).limit(limit).with_for_update(skip_locked=True))
+            res = await session.execute(update(EncodingJobModel).where(EncodingJobModel.id.in_(ready.scalar_subquery()))
+                                        .values(status='running', attempts=EncodingJobModel.attempts + 1,
+                                                updated_at=now)
+                                        .returning(EncodingJobModel.employee_id, EncodingJobModel.generation,
+                                                   EncodingJobModel.attempts))
+            jobs = res.all()
+            await session.commit()
+            return jobs
+
+    async def finish_encoding_job(self, employee_id, generation, encoding=None, error=None, retry_at=None,
+                                  status=None, session=None):
+        """
+        Результат задачи и новый энкодинг одной транзакцией. status задаёт итог явно (skipped).
+        False, если за время расчёта фото сменилось и задача поставлена заново.
+        """
+        async with self._session(session) as session:
+            if retry_at is not None:
+                values = dict(status='pending', run_at=retry_at, error=error)
+            else:
+                values = dict(status=status or ('done' if encoding is not None else 'failed'), error=error)
+            res = await session.execute(update(EncodingJobModel)
+                                        .where(EncodingJobModel.employee_id == employee_id,
+                                               EncodingJobModel.generation == generation,
+                                               EncodingJobModel.status == 'running')
+                                        .values(updated_at=datetime.now(), **values)
+                                        .returning(EncodingJobModel.id))
+            if res.scalar() is None:
+                await session.rollback()
+                return False
+            if encoding is not None:
+                await session.execute(delete(EmployeeEncodingsModel)
+                                      .where(EmployeeEncodingsModel.employee_id == employee_id))
+                session.add(EmployeeEncodingsModel(employee_id=employee_id, version=ENCODING_VERSION,
+                                                   encoding=pack_encoding(encoding)))
+            await session.commit()
+            if encoding is not None:
+                self.face_matcher.set(employee_id, encoding)
+            return True
+
+    async def requeue_stale_encoding_jobs(self, timeout: float, session=None):
+        """Задачи, зависшие в running дольше timeout секунд (процесс упал или перезапущен), снова ждут запуска"""
+        async with self._session(session) as session:
+            now = datetime.now()
+            await session.execute(update(EncodingJobModel)
+                                  .where(EncodingJobModel.status == 'running',
+                                         EncodingJobModel.updated_at < now - timedelta(seconds=timeout))
+                                  .values(status='pending', run_at=now, updated_at=now))
+            await session.commit()
+
+    async def get_encoding_job(self, employee_id, session=None):
+        async with self._session(session) as session:
+            res = await session.execute(select(EncodingJobModel).where(EncodingJobModel.employee_id == employee_id))
+            return res.scalar()
+
+    async def recognize(self, encoding, session=None):
+        match = self.face_matcher.match(encoding)
+        if match is None: return None
+        employee_id, distance = match
+        return await self.get_employee(employee_id, session=session), distance
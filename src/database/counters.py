@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Counters:
+
+    """
+    Кэш количества строк для списков, ключ - (таблица, фильтр).
+    exact - COUNT(*) выполняется один раз, дальше значение без фильтра поддерживается
+    инкрементально при вставке/удалении, а значения с фильтром сбрасываются.
+    estimate - для значений без фильтра берётся pg_class.reltuples.
+    ttl ограничивает расхождение, когда в базу пишут несколько процессов.
+    """
+
+    def __init__(self, mode: str = 'exact', ttl: float = 60, max_size: int = 1024):
+        self.mode = mode
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.values: OrderedDict[tuple, tuple[int, float]] = OrderedDict()
+
+    def get(self, table: str, loader, key=None):
+        """loader(estimate) вызывается при промахе, estimate=True разрешает приблизительное значение"""
+        value = self.lookup(table, key)
+        if value is None:
+            value = loader(self.use_estimate(key))
+            self.store(table, key, value)
+        return value
+
+    async def aget(self, table: str, loader, key=None):
+        """То же, что get, для асинхронного loader"""
+        value = self.lookup(table, key)
+        if value is None:
+            value = await loader(self.use_estimate(key))
+            self.store(table, key, value)
+        return value
+
+    def use_estimate(self, key=None):
+        return self.mode == 'estimate' and key is None
+
+    def lookup(self, table: str, key=None):
+        with self.lock:
+            cached = self.values.get((table, key))
+            if cached is None or cached[1] <= time.monotonic():
+                return None
+            self.values.move_to_end((table, key))
+            return cached[0]
+
+    def store(self, table: str, key, value: int):
+        with self.lock:
+            self.values[(table, key)] = (value, time.monotonic() + self.ttl)
+            self.values.move_to_end((table, key))
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+
+    def add(self, table: str, delta: int):
+        with self.lock:
+            cached = self.values.get((table, None))
+            if cached is not None:
+                self.values[(table, None)] = (max(cached[0] + delta, 0), cached[1])
+            self._drop_filtered(table)
+
+    def invalidate(self, table: str):
+        with self.lock:
+            self.values.pop((table, None), None)
+            self._drop_filtered(table)
+
+    def _drop_filtered(self, table: str):
+        for key in [key for key in self.values if key[0] == table and key[1] is not None]:
+            del self.values[key]
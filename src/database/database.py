@@ -1,22 +1,56 @@
-from sqlalchemy import create_engine, select, func, delete, desc, select, update
-from sqlalchemy.orm import registry, Session, sessionmaker, joinedload
+from datetime import datetime
+from sqlalchemy import create_engine, select, func, delete, desc, select, update, insert, tuple_, text, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import registry, Session, sessionmaker, joinedload, selectinload, load_only
 from src.utils.utils import hash_password
+from src.matcher.matcher import FaceMatcher
+from src.matcher.storage import pack_encoding, unpack_encodings, ENCODING_VERSION
+from src.database.migrations import migrate, migrate_sequences
+from src.utils.pagination import encode_cursor, decode_cursor
+from src.database.counters import Counters
 
 from src.database.models import AbstractModel, UserModel, EmployeeModel, AccessLogModel, AccessLayerModel, \
     EmployeeEncodingsModel
 
+# Колонки, которые нужны EmployeeModel.to_schema
+EMPLOYEE_SCHEMA_COLUMNS = (EmployeeModel.id, EmployeeModel.name, EmployeeModel.info, EmployeeModel.is_access)
+
+
+def enable_foreign_keys(engine):
+    """
+    SQLite по умолчанию не проверяет внешние ключи, а на них держатся проверки при вставке
+    (уровень доступа пользователя, сотрудник лога). PRAGMA включается на каждом новом соединении.
+    """
+    engine = getattr(engine, "sync_engine", engine)
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 
 class Database:
 
-    def __init__(self, URL, root_password, admin_password):
+    def __init__(self, URL, root_password, admin_password, face_matcher=None, count_mode='exact', count_ttl=60):
         self.URL = URL
+        self.counters = Counters(count_mode, count_ttl)
         self.engine = create_engine(self.URL, echo=False)
+        enable_foreign_keys(self.engine)
         self.mapped_registry = registry()
         self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
         with self.Session().begin():
             AbstractModel.metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            migrate(conn, AbstractModel.metadata)
 
         self._add_initial_data(root_password, admin_password)
+        with self.engine.begin() as conn:
+            migrate_sequences(conn, AbstractModel.metadata)
+        self.face_matcher = face_matcher if face_matcher is not None else FaceMatcher()
+        self.face_matcher.load_matrix(*unpack_encodings(self.get_encodings()))
 
     def _add_initial_data(self, root_password, admin_password):
         with self.Session() as session:
@@ -45,30 +79,33 @@ class Database:
 
     def add_user(self, login, password, access_layer_id):
         with self.Session() as session:
-            res = session.execute(select(AccessLayerModel).where(AccessLayerModel.id == access_layer_id))
-            access_layer = res.scalar()
-            if self.get_user(login) is None and access_layer is not None:
-                res = session.execute(select(UserModel.id).order_by(UserModel.id.desc()))
-                user_id = res.scalar()
-                user_id = user_id + 1 if user_id is not None else 0
-                user = UserModel(id=user_id, login=login, password=hash_password(password), access_layer_id=access_layer_id)
-                self.add(session, user)
-                return True
-            else:
+            try:
+                session.execute(insert(UserModel)
+                                .values(login=login, password=hash_password(password), access_layer_id=access_layer_id))
+                session.commit()
+            except IntegrityError:
+                session.rollback()
                 return False
+            self.counters.add(UserModel.__tablename__, 1)
+            return True
 
-    def get_users(self, page: int, page_size: int = 10):
+    def get_users(self, page: int = 1, page_size: int = 10, cursor: str = None):
+        """Возвращает (users, next_cursor), None если курсор повреждён"""
         with self.Session() as session:
-            stmt = (select(UserModel).where(UserModel.login != "root").order_by(desc(-UserModel.id))
-                    .offset((page - 1) * page_size).limit(page_size))
+            stmt = select(UserModel).where(UserModel.login != "root").order_by(UserModel.id).limit(page_size)
+            if cursor is not None:
+                values = decode_cursor(cursor, int)
+                if values is None: return None
+                stmt = stmt.where(UserModel.id > values[0])
+            else:
+                stmt = stmt.offset((page - 1) * page_size)
             res = session.execute(stmt)
             users = res.scalars().all()
-            return users
+            next_cursor = encode_cursor(users[-1].id) if users and len(users) == page_size else None
+            return users, next_cursor
 
     def get_users_size(self):
-        with self.Session() as session:
-            stmt = select(func.count()).select_from(UserModel)
-            return session.execute(stmt).scalar()
+        return self.counters.get(UserModel.__tablename__, lambda estimate: self._count(UserModel, estimate))
 
     def get_user(self, login):
         with self.Session() as session:
@@ -84,88 +121,108 @@ class Database:
 
     def delete_user(self, user_id):
         with self.Session() as session:
-            user = self.get_user_by_id(user_id)
-            if user is not None:
-                session.execute(delete(UserModel).where(UserModel.id == user_id))
-                session.commit()
-                return True
-            else: return False
+            res = session.execute(delete(UserModel).where(UserModel.id == user_id).returning(UserModel.id))
+            deleted = res.scalar() is not None
+            session.commit()
+            if deleted:
+                self.counters.add(UserModel.__tablename__, -1)
+            return deleted
 
     def set_user_password(self, user_id, new_password):
-        with self.Session() as session:
-            user = self.get_user_by_id(user_id)
-            if user is None:
-                return False
-            user.password = hash_password(new_password)
-            session.commit()
-            return True
+        return self._update_user(user_id, password=hash_password(new_password))
 
     def set_user_access(self, user_id, access_layer_id):
+        return self._update_user(user_id, access_layer_id=access_layer_id)
+
+    def _update_user(self, user_id, **values):
         with self.Session() as session:
-            user = self.get_user_by_id(user_id)
-            if user is None: return False
-            user.access_layer_id = access_layer_id
-            self.add(session, user)
-            return True
+            res = session.execute(update(UserModel).where(UserModel.id == user_id).values(**values)
+                                  .returning(UserModel.id))
+            updated = res.scalar() is not None
+            session.commit()
+            return updated
 
     # AccessLogs
 
-    def get_access_logs(self, page: int, page_size: int = 10):
+    def get_access_logs(self, page: int = 1, page_size: int = 10, cursor: str = None):
+        """Возвращает (logs, next_cursor), None если курсор повреждён"""
         with self.Session() as session:
-            stmt = select(AccessLogModel).options(joinedload(AccessLogModel.employee)).order_by(desc(AccessLogModel.timestamp)).offset((page - 1) * page_size).limit(page_size)
+            stmt = (select(AccessLogModel)
+                    .options(load_only(AccessLogModel.id, AccessLogModel.timestamp, AccessLogModel.employee_id),
+                             joinedload(AccessLogModel.employee).load_only(EmployeeModel.name, EmployeeModel.is_access))
+                    .order_by(desc(AccessLogModel.timestamp), desc(AccessLogModel.id)).limit(page_size))
+            if cursor is not None:
+                values = decode_cursor(cursor, datetime.fromisoformat, int)
+                if values is None: return None
+                stmt = stmt.where(tuple_(AccessLogModel.timestamp, AccessLogModel.id) < tuple_(*values))
+            else:
+                stmt = stmt.offset((page - 1) * page_size)
             res = session.execute(stmt)
-            logs = res.scalars().unique()
+            logs = res.scalars().unique().all()
+            next_cursor = None
+            if logs and len(logs) == page_size:
+                next_cursor = encode_cursor(logs[-1].timestamp.isoformat(), logs[-1].id)
             logs = list(map(lambda x: x.to_schema(), logs))
-            return logs
+            return logs, next_cursor
 
-    def get_access_log(self, id):
+    def get_access_log(self, id, with_employee=True):
         with self.Session() as session:
-            res = session.execute(select(AccessLogModel).where(AccessLogModel.id == id))
+            stmt = select(AccessLogModel).where(AccessLogModel.id == id)
+            if with_employee:
+                stmt = stmt.options(joinedload(AccessLogModel.employee)
+                                    .load_only(EmployeeModel.name, EmployeeModel.is_access))
+            res = session.execute(stmt)
             access_log = res.scalar()
             return access_log
 
     def get_access_log_size(self):
-        with self.Session() as session:
-            stmt = select(func.count()).select_from(AccessLogModel)
-            return session.execute(stmt).scalar()
+        return self.counters.get(AccessLogModel.__tablename__, lambda estimate: self._count(AccessLogModel, estimate))
 
     def add_access_log(self, employee_id, timestamp):
         with self.Session() as session:
-            employee = self.get_employee(employee_id)
-            if employee is None: return False
-            res = session.execute(select(AccessLogModel.id).order_by(AccessLogModel.id.desc()))
-            log_id = res.scalar()
-            log_id = log_id + 1 if log_id is not None else 0
-            access_log = AccessLogModel(id=log_id, employee_id=employee_id, timestamp=timestamp)
-            self.add(session, access_log)
+            try:
+                session.execute(insert(AccessLogModel).values(employee_id=employee_id, timestamp=timestamp))
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                return False
+            self.counters.add(AccessLogModel.__tablename__, 1)
             return True
 
     # Employees
 
-    def get_employees(self, page, page_size, substr):
+    def get_employees(self, page=1, page_size=10, substr=None, cursor: str = None):
+        """Возвращает (employees, next_cursor), None если курсор повреждён"""
         with self.Session() as session:
             try:
+                stmt = (select(EmployeeModel).options(load_only(*EMPLOYEE_SCHEMA_COLUMNS))
+                        .order_by(desc(EmployeeModel.name), desc(EmployeeModel.id)).limit(page_size))
                 if substr is not None and substr != '':
                     substr = f"%{substr}%"
-                    stmt = (select(EmployeeModel).where(EmployeeModel.name.ilike(substr))
-                            .order_by(desc(EmployeeModel.name))
-                            .offset((page - 1) * page_size).limit(page_size))
-                    res = session.execute(stmt)
-                    employees = res.scalars().unique()
+                    stmt = stmt.where(EmployeeModel.name.ilike(substr))
+                if cursor is not None:
+                    values = decode_cursor(cursor, str, int)
+                    if values is None: return None
+                    stmt = stmt.where(tuple_(EmployeeModel.name, EmployeeModel.id) < tuple_(*values))
                 else:
-                    stmt = (select(EmployeeModel).order_by(desc(EmployeeModel.name))
-                            .offset((page - 1) * page_size).limit(page_size))
-                    res = session.execute(stmt)
-                    employees = res.scalars().unique()
+                    stmt = stmt.offset((page - 1) * page_size)
+                res = session.execute(stmt)
+                employees = res.scalars().unique().all()
+                next_cursor = None
+                if employees and len(employees) == page_size:
+                    next_cursor = encode_cursor(employees[-1].name, employees[-1].id)
                 employees = list(map(lambda x: x.to_schema(), employees))
-                return employees
+                return employees, next_cursor
             except:
                 session.rollback()
 
-    def get_employee(self, employee_id: int):
+    def get_employee(self, employee_id: int, with_logs=False):
         with self.Session() as session:
             try:
-                res = session.execute(select(EmployeeModel).where(EmployeeModel.id == employee_id))
+                stmt = select(EmployeeModel).where(EmployeeModel.id == employee_id)
+                if with_logs:
+                    stmt = stmt.options(selectinload(EmployeeModel.access_logs))
+                res = session.execute(stmt)
                 employee = res.scalar()
                 return employee
             except:
@@ -173,58 +230,110 @@ class Database:
 
     def add_employee(self, name, info, is_access):
         with self.Session() as session:
-            res = session.execute(select(EmployeeModel).where(EmployeeModel.name == name))
-            employee = res.scalar()
-            if employee is not None: return None
-            res = session.execute(select(EmployeeModel).order_by(EmployeeModel.id.desc()))
-            employee_id = res.scalar().id
             info = info if info != '' else '-'
-            employee = EmployeeModel(id=(employee_id+1), name=name, info=info, is_access=is_access)
-            self.add(session, employee)
-            return employee_id+1
+            try:
+                res = session.execute(insert(EmployeeModel).values(name=name, info=info, is_access=is_access)
+                                      .returning(EmployeeModel.id))
+                employee_id = res.scalar()
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                return None
+            self.counters.add(EmployeeModel.__tablename__, 1)
+            return employee_id
 
     def set_employee_photo(self, employee_id):
         with self.Session() as session:
-            employee = self.get_employee(employee_id)
-            if employee is None: return False
+            res = session.execute(update(EmployeeModel).where(EmployeeModel.id == employee_id)
+                                  .values(photo_url=str(employee_id)).returning(EmployeeModel.id))
+            if res.scalar() is None:
+                session.rollback()
+                return False
             # Удаление энкодинга
             session.execute(delete(EmployeeEncodingsModel).where(EmployeeEncodingsModel.employee_id == employee_id))
-            employee.photo_url = employee_id
-            self.add(session, employee)
+            session.commit()
+            self.face_matcher.remove(employee_id)
             return True
 
-    def get_employees_size(self):
-        with self.Session() as session:
-            stmt = select(func.count()).select_from(EmployeeModel)
-            return session.execute(stmt).scalar()
+    def get_employees_size(self, substr=None):
+        if substr is None or substr == '':
+            return self.counters.get(EmployeeModel.__tablename__,
+                                     lambda estimate: self._count(EmployeeModel, estimate))
+        condition = EmployeeModel.name.ilike(f"%{substr}%")
+        return self.counters.get(EmployeeModel.__tablename__,
+                                 lambda estimate: self._count(EmployeeModel, False, condition), key=substr)
 
     def delete_employee(self, employee_id: int):
         with self.Session() as session:
-            employee = self.get_employee(employee_id)
-            if employee is not None:
-                # Замена связанных логов
-                _res = session.execute(update(AccessLogModel)
-                                       .where(AccessLogModel.employee_id == employee.id).values(employee_id=0))
-                # Удаление энкодинга
-                session.execute(delete(EmployeeEncodingsModel)
-                                .where(EmployeeEncodingsModel.employee_id == employee.id))
-                session.execute(delete(EmployeeModel).where(EmployeeModel.id == employee_id))
-                session.commit()
-                return True
-            else:
+            # Замена связанных логов
+            session.execute(update(AccessLogModel)
+                            .where(AccessLogModel.employee_id == employee_id).values(employee_id=0))
+            # Удаление энкодинга
+            session.execute(delete(EmployeeEncodingsModel)
+                            .where(EmployeeEncodingsModel.employee_id == employee_id))
+            res = session.execute(delete(EmployeeModel).where(EmployeeModel.id == employee_id)
+                                  .returning(EmployeeModel.id))
+            if res.scalar() is None:
+                session.rollback()
                 return False
+            session.commit()
+            self.counters.add(EmployeeModel.__tablename__, -1)
+            self.face_matcher.remove(employee_id)
+            return True
 
     def set_employee_data(self, employee_id, name, info, is_access):
         with self.Session() as session:
-            employee = self.get_employee(employee_id)
-            if employee is None: return False
-            res = session.execute(select(EmployeeModel.id).where(EmployeeModel.name == name))
-            employee_name = res.scalar()
-            if employee_name is not None and employee_name != employee_id: return False
-            employee.name = name
             info = "-" if not info else info
-            employee.info = info
-            employee.is_access = is_access
-            self.add(session, employee)
+            try:
+                # Уникальность имени проверяет сама база
+                res = session.execute(update(EmployeeModel).where(EmployeeModel.id == employee_id)
+                                      .values(name=name, info=info, is_access=is_access)
+                                      .returning(EmployeeModel.id))
+                if res.scalar() is None:
+                    session.rollback()
+                    return False
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                return False
+            # Имя могло измениться - счётчики поиска больше не верны
+            self.counters.add(EmployeeModel.__tablename__, 0)
+            return True
+
+    def _count(self, model, estimate=False, condition=None):
+        with self.Session() as session:
+            if estimate and self.engine.dialect.name == 'postgresql':
+                res = session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                                      {"table": model.__tablename__})
+                value = res.scalar()
+                # -1 - таблица ещё ни разу не анализировалась
+                if value is not None and value >= 0:
+                    return value
+            stmt = select(func.count()).select_from(model)
+            if condition is not None:
+                stmt = stmt.where(condition)
+            return session.execute(stmt).scalar()
+
+    # Encodings
+
+    def get_encodings(self):
+        with self.Session() as session:
+            res = session.execute(select(EmployeeEncodingsModel.employee_id, EmployeeEncodingsModel.version,
+                                         EmployeeEncodingsModel.encoding))
+            return res.all()
+
+    def set_employee_encoding(self, employee_id, encoding):
+        with self.Session() as session:
+            employee = session.get(EmployeeModel, employee_id)
+            if employee is None: return False
+            session.execute(delete(EmployeeEncodingsModel).where(EmployeeEncodingsModel.employee_id == employee_id))
+            self.add(session, EmployeeEncodingsModel(employee_id=employee_id, version=ENCODING_VERSION,
+                                                     encoding=pack_encoding(encoding)))
+            self.face_matcher.set(employee_id, encoding)
             return True
 
+    def recognize(self, encoding):
+        match = self.face_matcher.match(encoding)
+        if match is None: return None
+        employee_id, distance = match
+        return self.get_employee(employee_id), distance
@@ -0,0 +1,147 @@
+import asyncio
+import csv
+import time
+import zipfile
+import zlib
+from pathlib import Path
+from src.schemas.schemas import ImportRowResult
+from src.utils.uploads import copy_image, UploadError
+
+NAME_LENGTH = 30
+INFO_LENGTH = 200
+TRUE_VALUES = {"1", "true", "yes", "y", "да"}
+FALSE_VALUES = {"0", "false", "no", "n", "нет", ""}
+
+
+class EmployeeImporter:
+
+    """
+    Массовое добавление сотрудников из CSV (name, info, isAccess, photo) и ZIP с фотографиями.
+    CSV читается пачками по batch_size строк, из ZIP извлекаются только нужные файлы -
+    ни один из файлов целиком в память не загружается. Чтение и распаковка идут в пуле потоков.
+    Каждая пачка - одна проверка имён и один INSERT, затем фото пачки и задачи энкодинга одной транзакцией.
+    """
+
+    def __init__(self, database, encoding_queue, photo_dir: Path, batch_size: int = 500,
+                 max_photo_bytes: int = 10 * 2 ** 20):
+        self.database = database
+        self.encoding_queue = encoding_queue
+        self.photo_dir = Path(photo_dir)
+        self.batch_size = batch_size
+        self.max_photo_bytes = max_photo_bytes
+
+    async def run(self, csv_file, zip_file=None) -> tuple[list[ImportRowResult], float]:
+        """Отчёт по каждой строке и время импорта в секундах"""
+        start = time.perf_counter()
+        reader = csv.DictReader(self._decode_lines(csv_file))
+        archive = await asyncio.to_thread(zipfile.ZipFile, zip_file) if zip_file is not None else None
+        photos = {Path(info.filename).name: info for info in archive.infolist() if not info.is_dir()} \
+            if archive is not None else {}
+        results = []
+        seen = set()
+        try:
+            while True:
+                batch, error = await asyncio.to_thread(self._read_batch, reader, len(results))
+                if batch:
+                    results.extend(await self._import_batch(batch, seen, archive, photos))
+                if error is not None:
+                    # Предыдущие пачки уже сохранены - чтение останавливается, в отчёт идёт строка с ошибкой
+                    results.append(ImportRowResult(row=len(results) + 2, name="", status="invalid", error=error))
+                    break
+                if len(batch) < self.batch_size:
+                    break
+        finally:
+            if archive is not None:
+                archive.close()
+        return results, time.perf_counter() - start
+
+    @staticmethod
+    def _decode_lines(csv_file):
+        """Построчное декодирование: ошибка кодировки приходится на свою строку, а не на блок из нескольких"""
+        for number, line in enumerate(csv_file):
+            yield line.decode("utf-8-sig" if number == 0 else "utf-8")
+
+    def _read_batch(self, reader, offset):
+        """Строки пачки и ошибка чтения, если файл дальше не читается (битый CSV или не UTF-8)"""
+        batch = []
+        try:
+            for row in reader:
+                # Номер строки файла с учётом заголовка
+                batch.append((offset + len(batch) + 2, row))
+                if len(batch) == self.batch_size:
+                    break
+        except csv.Error as e:
+            return batch, f"malformed CSV: {e}"
+        except UnicodeDecodeError:
+            return batch, "file is not valid UTF-8"
+        return batch, None
+
+    async def _import_batch(self, batch, seen, archive, photos):
+        results = {}
+        rows = {}
+        photo_names = {}
+        for line, row in batch:
+            name = (row.get("name") or "").strip()
+            result = ImportRowResult(row=line, name=name, status="invalid")
+            results[line] = result
+            error = self._validate(row, name)
+            if error is not None:
+                result.error = error
+            elif name in seen:
+                result.status = "duplicate"
+            else:
+                seen.add(name)
+                rows[line] = dict(name=name, info=(row.get("info") or "").strip() or "-",
+                                  is_access=(row.get("isAccess") or "").strip().lower() in TRUE_VALUES)
+                photo_names[line] = (row.get("photo") or "").strip()
+        created = await self.database.add_employees(list(rows.values())) if rows else {}
+        with_photo = []
+        for line, values in rows.items():
+            result = results[line]
+            if created is None:
+                result.status = "error"
+                result.error = "batch insert failed, retry the import"
+                continue
+            employee_id = created.get(values["name"])
+            if employee_id is None:
+                result.status = "duplicate"
+                continue
+            result.status = "created"
+            result.id = employee_id
+            photo = photo_names[line]
+            if photo and photo not in photos:
+                result.photo = "missing"
+            elif photo:
+                with_photo.append((result, photos[photo]))
+        if with_photo:
+            await asyncio.to_thread(self._extract_photos, archive, with_photo)
+            employee_ids = [result.id for result, _ in with_photo if result.photo == "queued"]
+            if employee_ids:
+                await self.database.set_employee_photos(employee_ids)
+                self.encoding_queue.notify()
+        return list(results.values())
+
+    def _validate(self, row, name):
+        if not name:
+            return "name is empty"
+        if len(name) > NAME_LENGTH:
+            return f"name is longer than {NAME_LENGTH}"
+        if len((row.get("info") or "").strip()) > INFO_LENGTH:
+            return f"info is longer than {INFO_LENGTH}"
+        if (row.get("isAccess") or "").strip().lower() not in TRUE_VALUES | FALSE_VALUES:
+            return "isAccess must be true or false"
+        return None
+
+    def _extract_photos(self, archive, with_photo):
+        for result, info in with_photo:
+            if info.file_size > self.max_photo_bytes:
+                result.photo = "invalid"
+                result.error = "photo is too large"
+                continue
+            try:
+                with archive.open(info) as source:
+                    copy_image(source, self.photo_dir / f"{result.id}.png", self.max_photo_bytes)
+                result.photo = "queued"
+            except (UploadError, zipfile.BadZipFile, zlib.error, OSError) as e:
+                result.photo = "invalid"
+                result.error = str(e)
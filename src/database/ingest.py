@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class AccessLogBuffer:
+
+    """
+    Буфер входящих событий проходов. События копятся в памяти и пишутся в базу
+    одним многострочным INSERT, когда набралось batch_size штук или прошло flush_interval секунд.
+    Если в буфере больше max_size событий, новые не принимаются - клиент должен повторить позже.
+    """
+
+    def __init__(self, database, max_size: int = 50000, batch_size: int = 1000, flush_interval: float = 0.5):
+        self.database = database
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.events: deque[tuple[int, datetime]] = deque()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.stopping = False
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+
+    def put_many(self, events: list[tuple[int, datetime]]) -> bool:
+        """Принимает пачку (employee_id, timestamp) целиком или не принимает совсем"""
+        if len(self.events) + len(events) > self.max_size:
+            self.rejected += len(events)
+            return False
+        self.events.extend(events)
+        self.accepted += len(events)
+        if len(self.events) >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    def start(self):
+        self.stopping = False
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновую запись и дописывает всё, что осталось в буфере"""
+        if self.task is not None:
+            # Не отменяем задачу посреди INSERT, а просим её завершиться после текущей пачки
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        while self.events:
+            if not await self.flush():
+                break
+
+    async def _run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            while self.events:
+                if not await self.flush():
+                    # База недоступна - события остаются в буфере до следующей попытки
+                    break
+                if len(self.events) < self.batch_size:
+                    break
+
+    async def flush(self) -> bool:
+        batch = [self.events.popleft() for _ in range(min(self.batch_size, len(self.events)))]
+        if not batch:
+            return True
+        start = time.perf_counter()
+        try:
+            await self.database.add_access_logs(batch)
+        except Exception:
+            logger.exception("access log batch of %d events failed", len(batch))
+            self.events.extendleft(reversed(batch))
+            self.errors += 1
+            return False
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        self.written += len(batch)
+        self.batches += 1
+        return True
+
+    def stats(self):
+        return {
+            "buffered": len(self.events),
+            "maxSize": self.max_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+            "lastFlushMs": round(self.last_flush_ms, 2),
+        }
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from src.matcher.encoder import process_photo, EncoderUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class EncodingQueue:
+
+    """
+    Расчёт энкодингов лиц по загруженным фото в пуле процессов.
+    Задачи хранятся в таблице encoding_jobs, поэтому переживают перезапуск. Одна строка на сотрудника,
+    повторная постановка перезапускает её, а результат устаревшей попытки отбрасывается.
+    Диспетчер забирает из базы столько задач, сколько свободно процессов, и будится при постановке.
+    Упавшая задача повторяется с растущей задержкой, после max_attempts попыток становится failed.
+    Без face_recognition задача становится skipped: фото нормализовано, энкодинга нет, но это не "лицо не найдено".
+    """
+
+    def __init__(self, database, photo_dir: Path, workers: int = None, max_attempts: int = 3,
+                 retry_delay: float = 5, poll_interval: float = 2, timeout: float = 300, max_side: int = 1600):
+        self.database = database
+        self.photo_dir = Path(photo_dir)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_side = max_side
+        self.pool = None
+        self.task = None
+        self.stopping = False
+        self.wakeup = asyncio.Event()
+        self.running: set[asyncio.Task] = set()
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.superseded = 0
+        self.skipped = 0
+
+    def start(self):
+        self.pool = self._create_pool()
+        self.stopping = False
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Новые задачи больше не забираются, начатые дорабатывают и записываются"""
+        if self.task is None:
+            return
+        self.stopping = True
+        self.wakeup.set()
+        await self.task
+        self.task = None
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+        self.pool.shutdown(cancel_futures=True)
+
+    def _create_pool(self):
+        # spawn: дочерние процессы не наследуют event loop и потоки приложения
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def notify(self):
+        """Задачи поставлены в этом процессе - не ждать poll_interval"""
+        self.wakeup.set()
+
+    async def _run(self):
+        while not self.stopping:
+            try:
+                await self.database.requeue_stale_encoding_jobs(self.timeout)
+                free = self.workers - len(self.running)
+                if free > 0:
+                    for employee_id, generation, attempts in await self.database.claim_encoding_jobs(free):
+                        task = asyncio.create_task(self._process(employee_id, generation, attempts))
+                        self.running.add(task)
+                        task.add_done_callback(self.running.discard)
+            except Exception:
+                logger.exception("encoding job dispatch failed")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    async def _process(self, employee_id, generation, attempts):
+        path = self.photo_dir / f"{employee_id}.png"
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            try:
+                encoding = await loop.run_in_executor(pool, process_photo, path, self.max_side, generation)
+            except EncoderUnavailable as e:
+                # Повторять бессмысленно, пока не установлен face_recognition
+                await self.database.finish_encoding_job(employee_id, generation, error=f"encoder unavailable: {e}",
+                                                        status='skipped')
+                self.skipped += 1
+                return
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool) and pool is self.pool:
+                    # Процесс пула убит (например, OOM) - пул больше не принимает задачи, нужен новый
+                    self.pool = self._create_pool()
+                    pool.shutdown(wait=False)
+                error = f"{type(e).__name__}: {e}"[:500]
+                if attempts < self.max_attempts:
+                    retry_at = datetime.now() + timedelta(seconds=self.retry_delay * 2 ** (attempts - 1))
+                    await self.database.finish_encoding_job(employee_id, generation, error=error, retry_at=retry_at)
+                    self.retried += 1
+                else:
+                    await self.database.finish_encoding_job(employee_id, generation, error=error)
+                    self.failed += 1
+                return
+            error = None if encoding is not None else "face not found"
+            if await self.database.finish_encoding_job(employee_id, generation, encoding, error):
+                self.completed += 1
+            else:
+                self.superseded += 1
+        except Exception:
+            # Задача останется running и вернётся в очередь по timeout
+            logger.exception("encoding job for employee %d failed to finish", employee_id)
+        finally:
+            # Освободился процесс - можно забрать следующую задачу
+            self.running.discard(asyncio.current_task())
+            self.wakeup.set()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "running": len(self.running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "superseded": self.superseded,
+            "skipped": self.skipped,
+        }
@@ -0,0 +1,75 @@
+from datetime import datetime
+from sqlalchemy import inspect, text, bindparam, LargeBinary, create_engine
+
+from src.matcher.storage import pack_encoding, ENCODING_VERSION
+from src.database.partitions import partition_access_logs, ensure_partitions, add_months
+from src.database.rollups import create_rollup_trigger
+
+
+def migrate(conn, metadata):
+    """Все миграции по порядку, каждая сама проверяет, нужна ли она"""
+    migrate_encodings(conn)
+    partition_access_logs(conn)
+    # Секции на текущий и следующие месяцы, дальше их создаёт задача хранения логов
+    ensure_partitions(conn, datetime.now(), add_months(datetime.now(), 2))
+    migrate_indexes(conn, metadata)
+    migrate_sequences(conn, metadata)
+    create_rollup_trigger(conn)
+
+
+def migrate_encodings(conn):
+    """
+    Перевод employee_encodings.encoding из numeric[] в bytea с float32.
+    Выполняется один раз: после миграции в таблице появляется колонка version.
+    Все миграции принимают Connection, чтобы их можно было вызвать и через AsyncConnection.run_sync.
+    """
+    columns = [column['name'] for column in inspect(conn).get_columns('employee_encodings')]
+    if 'version' in columns:
+        return False
+    conn.execute(text("ALTER TABLE employee_encodings RENAME COLUMN encoding TO encoding_legacy"))
+    conn.execute(text("ALTER TABLE employee_encodings ADD COLUMN encoding BYTEA"))
+    conn.execute(text("ALTER TABLE employee_encodings ADD COLUMN version INTEGER"))
+    rows = conn.execute(text("SELECT id, encoding_legacy FROM employee_encodings")).all()
+    if rows:
+        stmt = (text("UPDATE employee_encodings SET encoding = :encoding, version = :version WHERE id = :id")
+                .bindparams(bindparam("encoding", type_=LargeBinary)))
+        conn.execute(stmt, [{"id": row_id, "encoding": pack_encoding(legacy), "version": ENCODING_VERSION}
+                            for row_id, legacy in rows])
+    conn.execute(text("ALTER TABLE employee_encodings DROP COLUMN encoding_legacy"))
+    conn.execute(text("ALTER TABLE employee_encodings ALTER COLUMN encoding SET NOT NULL"))
+    conn.execute(text("ALTER TABLE employee_encodings ALTER COLUMN version SET NOT NULL"))
+    return True
+
+
+def migrate_indexes(conn, metadata):
+    """create_all не добавляет индексы в уже существующие таблицы"""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def migrate_sequences(conn, metadata):
+    """
+    Строки вставлялись с явным id (MAX(id)+1), поэтому последовательности SERIAL отстают от данных.
+    Переводит каждую за текущий максимум, после этого id выдаёт только база.
+    Зарезервированные id 0 (root, неизвестный сотрудник) последовательность не выдаёт, она начинается с 1.
+    Вызывается и после вставки начальных данных, у которых id явные.
+    """
+    if conn.dialect.name != 'postgresql':
+        return
+    for table in metadata.sorted_tables:
+        if table.autoincrement_column is None:
+            continue
+        column = table.autoincrement_column.name
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', '{column}'), "
+                          f"COALESCE((SELECT MAX({column}) FROM {table.name}), 0) + 1, false)"))
+
+if __name__ == "__main__":
+    import os
+    from dotenv import load_dotenv
+
+    from src.database.models import AbstractModel
+
+    load_dotenv()
+    with create_engine(os.getenv('DB_URL')).begin() as conn:
+        migrate(conn, AbstractModel.metadata)
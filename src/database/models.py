@@ -1,11 +1,12 @@
 from sqlalchemy.orm import DeclarativeBase, relationship
-from sqlalchemy import Integer, String, DateTime, ARRAY, Numeric
+from sqlalchemy import Integer, String, DateTime, LargeBinary, Index
 from datetime import datetime
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import mapped_column, Mapped
 from starlette.responses import FileResponse
 
 from src.schemas.schemas import LogResponse, UserResponse, Employee
+from src.matcher.storage import ENCODING_VERSION
 
 
 class AbstractModel(DeclarativeBase):
@@ -19,8 +20,11 @@ class EmployeeModel(AbstractModel):
     photo_url: Mapped[str] = mapped_column(String, nullable=True)
     is_access: Mapped[bool] = mapped_column()
 
-    encoding: Mapped["EmployeeEncodingsModel"] = relationship(back_populates="employee", lazy=False)
-    access_logs: Mapped[list["AccessLogModel"]] = relationship(back_populates="employee", lazy=False)
+    __table_args__ = (Index('ix_employees_name_id', 'name', 'id'),)
+
+    encoding: Mapped["EmployeeEncodingsModel"] = relationship(back_populates="employee", lazy="raise")
+    # История логов загружается только явно: get_employee(..., with_logs=True)
+    access_logs: Mapped[list["AccessLogModel"]] = relationship(back_populates="employee", lazy="raise")
 
     def to_schema(self):
         return Employee(id=self.id, name=self.name, info=self.info,
@@ -30,9 +34,27 @@ class EmployeeEncodingsModel(AbstractModel):
     __tablename__ = 'employee_encodings'
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     employee_id: Mapped[int] = mapped_column(ForeignKey('employees.id'), unique=True)
-    encoding: Mapped[list[str]] = mapped_column(ARRAY(Numeric))
+    # Сырые float32 байты, формат определяется version (см. src/matcher/storage.py)
+    version: Mapped[int] = mapped_column(default=ENCODING_VERSION)
+    encoding: Mapped[bytes] = mapped_column(LargeBinary)
+
+    employee: Mapped["EmployeeModel"] = relationship(back_populates="encoding", lazy="raise")
 
-    employee: Mapped["EmployeeModel"] = relationship(back_populates="encoding", lazy=False)
+class EncodingJobModel(AbstractModel):
+    """Задача пересчёта энкодинга по фото, одна строка на сотрудника - повторная загрузка фото переиспользует её"""
+    __tablename__ = "encoding_jobs"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    employee_id: Mapped[int] = mapped_column(ForeignKey('employees.id', ondelete='CASCADE'), unique=True)
+    # pending, running, done, failed, skipped (face_recognition не установлен)
+    status: Mapped[str] = mapped_column(String(10))
+    attempts: Mapped[int] = mapped_column(default=0)
+    # Растёт при каждой постановке, результат устаревшей попытки не записывается
+    generation: Mapped[int] = mapped_column(default=1)
+    run_at: Mapped[datetime] = mapped_column()
+    updated_at: Mapped[datetime] = mapped_column()
+    error: Mapped[str] = mapped_column(String, nullable=True)
+
+    __table_args__ = (Index('ix_encoding_jobs_status_run_at', 'status', 'run_at'),)
 
 class AccessLogModel(AbstractModel):
     __tablename__ = "access_logs"
@@ -41,11 +63,36 @@ class AccessLogModel(AbstractModel):
     timestamp: Mapped[datetime] = mapped_column()
     photo_url: Mapped[str] = mapped_column(String, nullable=True)
 
-    employee: Mapped["EmployeeModel"] = relationship(back_populates="access_logs", lazy=False)
+    # В PostgreSQL таблица секционирована по месяцам timestamp (src/database/partitions.py),
+    # первичный ключ там (id, timestamp)
+    __table_args__ = (Index('ix_access_logs_timestamp_id', 'timestamp', 'id'),
+                      Index('ix_access_logs_employee_id', 'employee_id'))
+
+    employee: Mapped["EmployeeModel"] = relationship(back_populates="access_logs", lazy="raise")
 
     def to_schema(self):
         return LogResponse(id=self.id, name=self.employee.name, access=self.employee.is_access, time=str(self.timestamp))
 
+class AccessLogRollupModel(AbstractModel):
+    """Число проходов за час (period=hour) или день (period=day), обновляется вместе со вставкой логов"""
+    __tablename__ = "access_log_rollups"
+    period: Mapped[str] = mapped_column(String(4), primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(primary_key=True)
+    total: Mapped[int] = mapped_column()
+    granted: Mapped[int] = mapped_column()
+    denied: Mapped[int] = mapped_column()
+
+class EmployeeDailyModel(AbstractModel):
+    """Первый и последний проход сотрудника за день. Без внешнего ключа: статистика удалённых сотрудников остаётся"""
+    __tablename__ = "employee_daily"
+    day: Mapped[datetime] = mapped_column(primary_key=True)
+    employee_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    first_seen: Mapped[datetime] = mapped_column()
+    last_seen: Mapped[datetime] = mapped_column()
+    count: Mapped[int] = mapped_column()
+
+    __table_args__ = (Index('ix_employee_daily_employee_id_day', 'employee_id', 'day'),)
+
 class AccessLayerModel(AbstractModel):
     __tablename__ = "access_layers"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -58,5 +105,7 @@ class UserModel(AbstractModel):
     password: Mapped[str] = mapped_column()
     access_layer_id: Mapped[int] = mapped_column(ForeignKey('access_layers.id'))
 
+    __table_args__ = (Index('ix_users_login', 'login', unique=True),)
+
     def to_schema(self):
         return UserResponse(id=self.id, login=self.login, accessLayer=self.access_layer_id)
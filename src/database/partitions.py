@@ -0,0 +1,120 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TABLE = "access_logs"
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month = value.year * 12 + value.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{TABLE}_{start:%Y_%m}"
+
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c "
+                             "ON c.oid = p.partrelid WHERE c.relname = :table AND pg_table_is_visible(c.oid))"),
+                        {"table": TABLE}).scalar()
+
+
+def partition_access_logs(conn, months_ahead: int = 2):
+    """
+    Переводит access_logs в PostgreSQL на помесячное секционирование по timestamp. Выполняется один раз.
+    Первичный ключ секционированной таблицы обязан включать timestamp, поэтому он (id, timestamp),
+    последовательность id остаётся прежней. Строки вне созданных секций попадают в access_logs_default.
+    В SQLite и других базах таблица остаётся обычной, месяцы - это диапазоны по индексу (timestamp, id).
+    """
+    if conn.dialect.name != 'postgresql' or is_partitioned(conn):
+        return False
+    bounds = conn.execute(text(f"SELECT MIN(timestamp), MAX(timestamp) FROM {TABLE}")).one()
+    conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_unpartitioned"))
+    conn.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE"))
+    conn.execute(text(f"""
+        CREATE TABLE {TABLE} (
+            id INTEGER NOT NULL DEFAULT nextval('{TABLE}_id_seq'),
+            employee_id INTEGER NOT NULL REFERENCES employees (id),
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            photo_url VARCHAR
+        ) PARTITION BY RANGE (timestamp)"""))
+    conn.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id"))
+    conn.execute(text(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT"))
+    now = datetime.now()
+    first = month_start(bounds[0]) if bounds[0] is not None else month_start(now)
+    last = max(month_start(bounds[1]), month_start(now)) if bounds[1] is not None else month_start(now)
+    ensure_partitions(conn, first, add_months(last, months_ahead))
+    conn.execute(text(f"INSERT INTO {TABLE} (id, employee_id, timestamp, photo_url) "
+                      f"SELECT id, employee_id, timestamp, photo_url FROM {TABLE}_unpartitioned"))
+    # Старая таблица удаляется вместе с её ограничениями и индексами, их имена освобождаются
+    conn.execute(text(f"DROP TABLE {TABLE}_unpartitioned"))
+    conn.execute(text(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, timestamp)"))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{TABLE}_timestamp_id ON {TABLE} (timestamp, id)"))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{TABLE}_employee_id ON {TABLE} (employee_id)"))
+    return True
+
+
+def ensure_partitions(conn, first: datetime, last: datetime):
+    """Секции с месяца first по месяц last включительно, уже существующие пропускаются"""
+    if not is_partitioned(conn):
+        return []
+    existing = {name for name, _, _ in list_partitions(conn)}
+    created = []
+    start = month_start(first)
+    while start <= last:
+        name = partition_name(start)
+        if name not in existing:
+            end = add_months(start, 1)
+            try:
+                # Савепоинт: если в default уже есть строки этого месяца, создание откатится, а не вся транзакция
+                with conn.begin_nested():
+                    conn.execute(text(f"CREATE TABLE {name} PARTITION OF {TABLE} "
+                                      f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"))
+                created.append(name)
+            except Exception:
+                logger.exception("partition %s was not created", name)
+        start = add_months(start, 1)
+    return created
+
+
+def list_partitions(conn) -> list[tuple[str, datetime, datetime]]:
+    """Помесячные секции (name, start, end) по возрастанию, без default"""
+    if not is_partitioned(conn):
+        return []
+    names = conn.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                              "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"),
+                         {"table": TABLE}).scalars().all()
+    partitions = []
+    for name in names:
+        suffix = name.removeprefix(f"{TABLE}_")
+        try:
+            start = datetime.strptime(suffix, "%Y_%m")
+        except ValueError:
+            continue
+        partitions.append((name, start, add_months(start, 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def drop_range(conn, start: datetime, end: datetime) -> int:
+    """
+    Удаляет логи за [start, end). Если это ровно одна секция - она отсоединяется и удаляется целиком,
+    без построчного DELETE. Возвращает число удалённых строк.
+    """
+    for name, partition_start, partition_end in list_partitions(conn):
+        if partition_start == start and partition_end == end:
+            count = conn.execute(text(f"SELECT COUNT(*) FROM {name}")).scalar()
+            conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+            return count
+    return conn.execute(text(f"DELETE FROM {TABLE} WHERE timestamp >= :start AND timestamp < :end"),
+                        {"start": start, "end": end}).rowcount
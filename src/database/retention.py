@@ -0,0 +1,173 @@
+import asyncio
+import csv
+import logging
+import os
+import tarfile
+from datetime import datetime
+from pathlib import Path
+
+from src.database.partitions import month_start, add_months
+
+logger = logging.getLogger(__name__)
+
+MODES = ("archive", "drop")
+
+
+class AccessLogRetention:
+
+    """
+    Хранение логов проходов по месяцам. Раз в interval секунд месяцы, закончившиеся раньше чем retention_months
+    месяцев назад, целиком убираются из базы: в PostgreSQL удаляется секция, в остальных базах - строки диапазона.
+    mode=archive: перед удалением строки месяца и их фото упаковываются в archive_dir/access_logs-YYYY-MM.tar.gz
+    (access_logs.csv и photos/), mode=drop: удаляются без архива. Фото из static/accessLogs удаляются после
+    удаления строк. Заодно создаются секции на months_ahead месяцев вперёд. retention_months=0 - хранить всё.
+    Строки читаются курсором и пишутся во временный CSV, поэтому память не зависит от размера месяца.
+    """
+
+    def __init__(self, database, photo_dir: Path, archive_dir: Path, retention_months: int = 0,
+                 mode: str = "archive", interval: float = 86400, months_ahead: int = 2, thumbnails=None,
+                 batch_size: int = 5000):
+        if mode not in MODES:
+            raise ValueError(f"unknown retention mode {mode!r}, expected one of {MODES}")
+        self.database = database
+        self.photo_dir = Path(photo_dir)
+        self.archive_dir = Path(archive_dir)
+        self.retention_months = retention_months
+        self.mode = mode
+        self.interval = interval
+        self.months_ahead = months_ahead
+        self.thumbnails = thumbnails
+        self.batch_size = batch_size
+        self.task = None
+        self.removed_months = 0
+        self.removed_rows = 0
+        self.removed_photos = 0
+        self.errors = 0
+        self.last_run = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("access log retention failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: datetime = None) -> list[str]:
+        """Один проход, возвращает убранные месяцы YYYY-MM"""
+        now = now or datetime.now()
+        self.last_run = now
+        await self.database.ensure_access_log_partitions(self.months_ahead)
+        if self.retention_months <= 0:
+            return []
+        cutoff = add_months(month_start(now), -self.retention_months)
+        first, _ = await self.database.get_access_log_bounds()
+        removed = []
+        start = month_start(first) if first is not None else cutoff
+        while start < cutoff:
+            end = add_months(start, 1)
+            await self.remove_month(start, end)
+            removed.append(f"{start:%Y-%m}")
+            start = end
+        return removed
+
+    async def remove_month(self, start: datetime, end: datetime):
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        name = f"access_logs-{start:%Y-%m}"
+        rows_path = self.archive_dir / f".{name}.csv"
+        try:
+            dumped = await self._dump_rows(start, end, rows_path)
+            if self.mode == "archive" and dumped:
+                await asyncio.to_thread(self._pack, rows_path, self.archive_dir / f"{name}.tar.gz")
+            # Архив уже на диске (os.replace), только после этого строки удаляются из базы
+            rows = await self.database.drop_access_logs(start, end)
+            photos = await asyncio.to_thread(self._remove_photos, rows_path)
+        finally:
+            rows_path.unlink(missing_ok=True)
+        self.removed_months += 1
+        self.removed_rows += rows
+        self.removed_photos += photos
+        logger.info("access logs %s: %d rows, %d photos %s", f"{start:%Y-%m}", rows, photos,
+                    "archived" if self.mode == "archive" else "dropped")
+
+    async def _dump_rows(self, start, end, path: Path):
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(("id", "employee_id", "timestamp", "photo_url"))
+            count = 0
+            async for rows in self.database.stream_access_log_rows(start, end, self.batch_size):
+                await asyncio.to_thread(writer.writerows, rows)
+                count += len(rows)
+        return count
+
+    def _photo_names(self, rows_path: Path):
+        with open(rows_path, newline="", encoding="utf-8") as file:
+            for row in csv.DictReader(file):
+                if row["photo_url"]:
+                    yield f"{row['photo_url']}.png"
+
+    def _pack(self, rows_path: Path, target: Path):
+        tmp = target.with_name(f".{target.name}.tmp")
+        try:
+            with tarfile.open(tmp, "w:gz") as archive:
+                archive.add(rows_path, arcname="access_logs.csv")
+                for name in self._photo_names(rows_path):
+                    photo = self.photo_dir / name
+                    if photo.is_file():
+                        archive.add(photo, arcname=f"photos/{name}")
+            os.replace(tmp, target)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def _remove_photos(self, rows_path: Path) -> int:
+        removed = 0
+        for name in self._photo_names(rows_path):
+            photo = self.photo_dir / name
+            try:
+                photo.unlink()
+                removed += 1
+            except FileNotFoundError:
+                continue
+            if self.thumbnails is not None:
+                self.thumbnails.discard(photo)
+        return removed
+
+    def stats(self):
+        return {
+            "retentionMonths": self.retention_months,
+            "mode": self.mode,
+            "removedMonths": self.removed_months,
+            "removedRows": self.removed_rows,
+            "removedPhotos": self.removed_photos,
+            "errors": self.errors,
+            "lastRun": self.last_run.isoformat() if self.last_run is not None else None,
+        }
+
+
+if __name__ == "__main__":
+    # Разовый проход по настройкам из .env: python -m src.database.retention
+    from src.main import database, access_log_retention
+
+    async def main():
+        await database.init()
+        try:
+            print(await access_log_retention.run_once())
+        finally:
+            await database.close()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
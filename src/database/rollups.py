@@ -0,0 +1,183 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, insert, func, literal, case, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.database.models import AccessLogModel, EmployeeModel, AccessLogRollupModel, EmployeeDailyModel
+
+PERIODS = ("hour", "day")
+# Формат DateTime в SQLite, в котором SQLAlchemy хранит значения - ключи бакетов должны совпадать побайтно
+SQLITE_FORMATS = {"hour": "%Y-%m-%d %H:00:00.000000", "day": "%Y-%m-%d 00:00:00.000000"}
+
+
+def bucket_of(timestamp: datetime, period: str) -> datetime:
+    if period == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_expr(dialect: str, period: str, column):
+    if dialect == 'postgresql':
+        return func.date_trunc(period, column)
+    return func.strftime(SQLITE_FORMATS[period], column)
+
+
+def dialect_insert(dialect: str):
+    return postgresql.insert if dialect == 'postgresql' else sqlite.insert
+
+
+def rollup_statements(dialect: str, events) -> list:
+    """
+    Инкрементальное обновление агрегатов пачкой событий (employee_id, timestamp, granted).
+    События сначала сворачиваются в памяти, на каждую таблицу - один многострочный upsert.
+    Не для SQLite: там агрегаты уже обновил триггер (create_rollup_trigger).
+    """
+    buckets = defaultdict(lambda: [0, 0])
+    days = {}
+    for employee_id, timestamp, granted in events:
+        for period in PERIODS:
+            counts = buckets[(period, bucket_of(timestamp, period))]
+            counts[0 if granted else 1] += 1
+        key = (bucket_of(timestamp, "day"), employee_id)
+        seen = days.get(key)
+        days[key] = (timestamp, timestamp, 1) if seen is None else \
+            (min(seen[0], timestamp), max(seen[1], timestamp), seen[2] + 1)
+    if not buckets:
+        return []
+    make_insert = dialect_insert(dialect)
+    least, greatest = (func.least, func.greatest) if dialect == 'postgresql' else (func.min, func.max)
+    rollups = make_insert(AccessLogRollupModel).values([
+        dict(period=period, bucket=bucket, total=granted + denied, granted=granted, denied=denied)
+        for (period, bucket), (granted, denied) in sorted(buckets.items())])
+    rollups = rollups.on_conflict_do_update(index_elements=['period', 'bucket'], set_=dict(
+        total=AccessLogRollupModel.total + rollups.excluded.total,
+        granted=AccessLogRollupModel.granted + rollups.excluded.granted,
+        denied=AccessLogRollupModel.denied + rollups.excluded.denied))
+    daily = make_insert(EmployeeDailyModel).values([
+        dict(day=day, employee_id=employee_id, first_seen=first, last_seen=last, count=count)
+        for (day, employee_id), (first, last, count) in sorted(days.items())])
+    daily = daily.on_conflict_do_update(index_elements=['day', 'employee_id'], set_=dict(
+        first_seen=least(EmployeeDailyModel.first_seen, daily.excluded.first_seen),
+        last_seen=greatest(EmployeeDailyModel.last_seen, daily.excluded.last_seen),
+        count=EmployeeDailyModel.count + daily.excluded.count))
+    # Строки в порядке ключей - конкурентные вставки блокируют их в одном порядке, без взаимных блокировок
+    return [rollups, daily]
+
+
+def log_insert(dialect: str, employee_id: int, timestamp: datetime):
+    """
+    Запись одного лога одним запросом: INSERT ... SELECT из employees (нет сотрудника - нет строки) RETURNING id.
+    В PostgreSQL агрегаты обновляются в том же запросе: upsert-ы в CTE берут результат прохода
+    из вставленной строки и is_access сотрудника. В SQLite изменяющих CTE нет, агрегаты ведёт триггер.
+    """
+    log = (insert(AccessLogModel)
+           .from_select(["employee_id", "timestamp"],
+                        select(EmployeeModel.id, literal(timestamp, AccessLogModel.timestamp.type))
+                        .where(EmployeeModel.id == employee_id))
+           .returning(AccessLogModel.id, AccessLogModel.employee_id, AccessLogModel.timestamp))
+    if dialect != 'postgresql':
+        return log
+    log = log.cte("log")
+    granted = case((EmployeeModel.is_access, 1), else_=0)
+    buckets = union_all(*(
+        select(literal(period).label("period"),
+               literal(bucket_of(timestamp, period), AccessLogRollupModel.bucket.type).label("bucket"),
+               literal(1).label("total"), granted.label("granted"), (1 - granted).label("denied"))
+        .select_from(log.join(EmployeeModel, EmployeeModel.id == log.c.employee_id))
+        for period in PERIODS))
+    rollups = postgresql.insert(AccessLogRollupModel).from_select(
+        ["period", "bucket", "total", "granted", "denied"], buckets)
+    rollups = rollups.on_conflict_do_update(index_elements=['period', 'bucket'], set_=dict(
+        total=AccessLogRollupModel.total + rollups.excluded.total,
+        granted=AccessLogRollupModel.granted + rollups.excluded.granted,
+        denied=AccessLogRollupModel.denied + rollups.excluded.denied))
+    daily = postgresql.insert(EmployeeDailyModel).from_select(
+        ["day", "employee_id", "first_seen", "last_seen", "count"],
+        select(literal(bucket_of(timestamp, "day"), EmployeeDailyModel.day.type), log.c.employee_id,
+               log.c.timestamp, log.c.timestamp, literal(1)))
+    daily = daily.on_conflict_do_update(index_elements=['day', 'employee_id'], set_=dict(
+        first_seen=func.least(EmployeeDailyModel.first_seen, daily.excluded.first_seen),
+        last_seen=func.greatest(EmployeeDailyModel.last_seen, daily.excluded.last_seen),
+        count=EmployeeDailyModel.count + daily.excluded.count))
+    return select(log.c.id).add_cte(rollups.cte("rollups"), daily.cte("daily"))
+
+
+def create_rollup_trigger(conn):
+    """
+    SQLite: агрегаты обновляет триггер на каждую вставленную строку access_logs, так одиночная запись лога
+    остаётся одним запросом. Для PostgreSQL ничего не делает - там агрегаты пишет сам запрос вставки.
+    """
+    if conn.dialect.name != 'sqlite':
+        return
+    # exec_driver_sql: в форматах strftime двоеточия, text() принял бы их за параметры
+    conn.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS access_logs_rollups AFTER INSERT ON access_logs
+        BEGIN
+            INSERT INTO access_log_rollups (period, bucket, total, granted, denied)
+            SELECT periods.period, strftime(periods.format, NEW.timestamp), 1,
+                   employees.is_access != 0, employees.is_access = 0
+            FROM employees, (SELECT 'hour' AS period, '{SQLITE_FORMATS["hour"]}' AS format
+                             UNION ALL SELECT 'day', '{SQLITE_FORMATS["day"]}') AS periods
+            WHERE employees.id = NEW.employee_id
+            ON CONFLICT (period, bucket) DO UPDATE SET total = total + excluded.total,
+                granted = granted + excluded.granted, denied = denied + excluded.denied;
+            INSERT INTO employee_daily (day, employee_id, first_seen, last_seen, count)
+            VALUES (strftime('{SQLITE_FORMATS["day"]}', NEW.timestamp), NEW.employee_id,
+                    NEW.timestamp, NEW.timestamp, 1)
+            ON CONFLICT (day, employee_id) DO UPDATE SET first_seen = min(first_seen, excluded.first_seen),
+                last_seen = max(last_seen, excluded.last_seen), count = count + 1;
+        END""")
+
+
+def backfill(conn, start: datetime = None, end: datetime = None) -> tuple[datetime, datetime] | None:
+    """
+    Пересчёт агрегатов за дни [start, end) из access_logs одной транзакцией: старые агрегаты диапазона
+    удаляются, новые считает сама база GROUP BY. Результат прохода берётся по текущему is_access сотрудника.
+    Начало не раньше самого старого лога: агрегаты месяцев, убранных в архив, не обнуляются.
+    Возвращает пересчитанный диапазон, None если логов нет.
+    """
+    dialect = conn.dialect.name
+    first, last = conn.execute(select(func.min(AccessLogModel.timestamp), func.max(AccessLogModel.timestamp))).one()
+    if first is None:
+        return None
+    start = bucket_of(max(start, first) if start is not None else first, "day")
+    end = bucket_of(end, "day") if end is not None else bucket_of(last, "day") + timedelta(days=1)
+    if start >= end:
+        return None
+    in_range = (AccessLogModel.timestamp >= start, AccessLogModel.timestamp < end)
+    conn.execute(delete(AccessLogRollupModel).where(AccessLogRollupModel.bucket >= start,
+                                                    AccessLogRollupModel.bucket < end))
+    conn.execute(delete(EmployeeDailyModel).where(EmployeeDailyModel.day >= start, EmployeeDailyModel.day < end))
+    granted = case((EmployeeModel.is_access, 1), else_=0)
+    for period in PERIODS:
+        bucket = bucket_expr(dialect, period, AccessLogModel.timestamp).label("bucket")
+        rows = (select(literal(period).label("period"), bucket, func.count().label("total"),
+                       func.sum(granted).label("granted"), (func.count() - func.sum(granted)).label("denied"))
+                .select_from(AccessLogModel).join(EmployeeModel, EmployeeModel.id == AccessLogModel.employee_id)
+                .where(*in_range).group_by(bucket))
+        conn.execute(insert(AccessLogRollupModel)
+                     .from_select(["period", "bucket", "total", "granted", "denied"], rows))
+    day = bucket_expr(dialect, "day", AccessLogModel.timestamp).label("day")
+    rows = (select(day, AccessLogModel.employee_id, func.min(AccessLogModel.timestamp),
+                   func.max(AccessLogModel.timestamp), func.count())
+            .where(*in_range).group_by(day, AccessLogModel.employee_id))
+    conn.execute(insert(EmployeeDailyModel)
+                 .from_select(["day", "employee_id", "first_seen", "last_seen", "count"], rows))
+    return start, end
+
+
+if __name__ == "__main__":
+    # Пересчёт агрегатов по уже записанным логам: python -m src.database.rollups [start] [end], даты в ISO
+    import asyncio
+    import sys
+    from src.main import database
+
+    async def main(args):
+        await database.init()
+        try:
+            print(await database.backfill_rollups(*(datetime.fromisoformat(arg) for arg in args)))
+        finally:
+            await database.close()
+
+    asyncio.run(main(sys.argv[1:3]))
@@ -0,0 +1,159 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TRGM_INDEX = "ix_employees_name_trgm"
+WORD_SPLIT = re.compile(r"[^\w]+")
+
+
+def padded_words(value: str) -> list[str]:
+    """Слова в нижнем регистре, дополненные как в pg_trgm: два пробела в начале и один в конце"""
+    return [f"  {word} " for word in WORD_SPLIT.split(value.lower()) if word]
+
+
+def trigrams(value: str) -> set[str]:
+    """Триграммы как в pg_trgm"""
+    return {word[i:i + 3] for word in padded_words(value) for i in range(len(word) - 2)}
+
+
+def substring_grams(value: str) -> set[str]:
+    """Все подстроки длины 3 - каждая из них есть в любой строке, содержащей value"""
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class NgramIndex:
+
+    """
+    Индекс имён сотрудников в памяти процесса для баз без pg_trgm.
+    Кандидаты на подстроку - пересечение списков по триграммам запроса, затем точная проверка `in`.
+    Запросы короче трёх символов проверяются перебором всех имён.
+    Похожесть считается как similarity() в pg_trgm: доля общих триграмм запроса и имени.
+    """
+
+    def __init__(self, cache_size: int = 64):
+        self.lock = threading.Lock()
+        # id -> (name, name.lower(), слова дополненные пробелами, число триграмм имени)
+        self.entries: dict[int, tuple[str, str, str, int]] = {}
+        self.postings: dict[str, set[int]] = {}
+        # Страница и общее количество ищут одно и то же - результат переиспользуется
+        self.cache: OrderedDict[str, list] = OrderedDict()
+        self.cache_size = cache_size
+
+    def load(self, rows):
+        """rows - (employee_id, name)"""
+        with self.lock:
+            self.entries.clear()
+            self.postings.clear()
+            self.cache.clear()
+            for employee_id, name in rows:
+                self._add(employee_id, name)
+
+    def set(self, employee_id: int, name: str):
+        with self.lock:
+            self._remove(employee_id)
+            self._add(employee_id, name)
+            self.cache.clear()
+
+    def remove(self, employee_id: int):
+        with self.lock:
+            self._remove(employee_id)
+            self.cache.clear()
+
+    def search(self, query: str) -> list[tuple[float, str, int]]:
+        """Все совпадения (score, name, id) по убыванию, как ORDER BY score, name, id DESC"""
+        query = query.lower()
+        with self.lock:
+            results = self.cache.get(query)
+            if results is not None:
+                self.cache.move_to_end(query)
+                return results
+            grams = substring_grams(query)
+            if grams:
+                lists = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set(lists[0])
+                for ids in lists[1:]:
+                    if not candidates: break
+                    candidates &= ids
+            else:
+                candidates = self.entries.keys()
+            entries = self.entries
+            matches = [entries[employee_id] + (employee_id,) for employee_id in candidates
+                       if query in entries[employee_id][1]]
+            query_grams = trigrams(query)
+            results = []
+            for name, _, padded, size, employee_id in matches:
+                # Триграмма слова запроса не может пересечь границу слов имени, поэтому хватает поиска подстроки
+                common = sum(gram in padded for gram in query_grams)
+                total = size + len(query_grams) - common
+                results.append((common / total if total else 0.0, name, employee_id))
+            results.sort(reverse=True)
+            self.cache[query] = results
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return results
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add(self, employee_id, name):
+        lower = name.lower()
+        self.entries[employee_id] = (name, lower, "".join(padded_words(name)), len(trigrams(name)))
+        for gram in substring_grams(lower):
+            self.postings.setdefault(gram, set()).add(employee_id)
+
+    def _remove(self, employee_id):
+        entry = self.entries.pop(employee_id, None)
+        if entry is None:
+            return
+        for gram in substring_grams(entry[1]):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(employee_id)
+                if not ids:
+                    del self.postings[gram]
+
+
+class EmployeeSearch:
+
+    """
+    Поиск сотрудников по подстроке имени с ранжированием по похожести.
+    В PostgreSQL создаёт расширение pg_trgm и GIN индекс по name, ILIKE и similarity() считает база.
+    Если pg_trgm недоступен (другая база или нет прав на расширение), используется NgramIndex в памяти,
+    который нужно поддерживать через set/remove при изменении сотрудников.
+    """
+
+    def __init__(self):
+        self.use_trgm = False
+        self.index = NgramIndex()
+
+    def setup(self, conn) -> bool:
+        """Вызывается в транзакции при старте, True если поиск идёт через pg_trgm"""
+        self.use_trgm = False
+        if conn.dialect.name == 'postgresql':
+            try:
+                with conn.begin_nested():
+                    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {TRGM_INDEX} "
+                                      f"ON employees USING gin (name gin_trgm_ops)"))
+                self.use_trgm = True
+            except Exception:
+                logger.warning("pg_trgm is not available, employee search uses the in-process index",
+                               exc_info=True)
+        return self.use_trgm
+
+    def load(self, rows):
+        if not self.use_trgm:
+            self.index.load(rows)
+
+    def set(self, employee_id: int, name: str):
+        if not self.use_trgm:
+            self.index.set(employee_id, name)
+
+    def remove(self, employee_id: int):
+        if not self.use_trgm:
+            self.index.remove(employee_id)
@@ -1,50 +1,184 @@
 from http.client import responses
 from pydantic import BaseModel
-from fastapi import FastAPI, UploadFile, File, WebSocket
+from fastapi import FastAPI, UploadFile, File, WebSocket, Request, Query
 from fastapi.params import Depends
 from pydantic.v1 import ValidationError
-from starlette.responses import JSONResponse, FileResponse
+from starlette.responses import JSONResponse, FileResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
 from src.utils.utils import init_dirs
-from src.utils.websockets import WebSocketManager
-
-from src.database.database import Database
+from src.utils.websockets import WebSocketManager, Subscription
+from src.utils.pubsub import create_backend
+from src.utils.principal_cache import PrincipalCache, MemoryBackend, InvalidatingBackend, Principal
+from src.utils.hashing import PasswordHasher, LoginLimiter
+from src.utils.thumbnails import ThumbnailCache
+from src.utils.http_cache import MemoryFile, file_etag, is_conditional, not_modified, not_modified_response, \
+    cache_headers
+from src.utils.uploads import save_upload, UploadError, BodySizeLimit
+from src.utils.export import export_access_logs, MEDIA_TYPES
+from src.matcher.matcher import FaceMatcher, ENCODING_SIZE
+from src.matcher.ivf import IVFMatcher
+
+from src.database.async_database import AsyncDatabase
+from src.database.ingest import AccessLogBuffer
+from src.database.jobs import EncodingQueue
+from src.database.importer import EmployeeImporter
+from src.database.retention import AccessLogRetention
+from src.database.rollups import PERIODS, bucket_of
 import uvicorn
 from src.schemas.schemas import User, BadResponse, GoodResponse, UserLoginResponse, AccessLogsResponse, \
     UsersResponse, AddUserRequest, GetUserResponse, SetUserPasswordRequest, SetUserAccessLayerRequest, \
     EmployeesResponse, EmployeePostRequest, EmployeePostResponse, EmployeeResponse, Employee, AccessLogResponse, \
-    PostAccessLogNotify
-from src.utils import utils, auth
+    PostAccessLogNotify, RecognizeRequest, RecognizeResponse, MetricsResponse, AccessLogBatchRequest, \
+    AccessLogBatchResponse, EncodingJobResponse, EmployeesImportResponse, AccessLogEvent, AccessStatsResponse, \
+    AccessStatsBucket, EmployeePresenceResponse, EmployeePresence
+from src.utils import auth
 from dotenv import load_dotenv
 import os
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+import zipfile
 
 load_dotenv()
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await database.init()
+    await principal_cache.start()
+    access_log_buffer.start()
+    encoding_queue.start()
+    await websocket_manager.start()
+    access_log_retention.start()
+    yield
+    await access_log_retention.stop()
+    await websocket_manager.stop()
+    await encoding_queue.stop()
+    await access_log_buffer.stop()
+    await principal_cache.stop()
+    await database.close()
+    password_hasher.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 init_dirs()
 HOST = os.getenv('HOST')
 PORT = os.getenv('PORT')
 FRONTEND_HOST = os.getenv('FRONTEND_HOST')
 FRONTEND_WEBSOCKET = os.getenv('FRONTEND_WEBSOCKET')
 USE_HTTPS = os.getenv("USE_HTTPS", "false").lower() == "true"
-websocket_manager = WebSocketManager()
 
 ROOT_DIR = Path(os.getenv('ROOT_DIR'))
 IMAGES_DIR = ROOT_DIR / "static"
 DEFAULT_IMAGE = ROOT_DIR / 'static/default.svg'
+THUMBNAIL_DIR = Path(os.getenv('THUMBNAIL_DIR', IMAGES_DIR / 'thumbnails'))
+THUMBNAIL_CACHE_MB = float(os.getenv('THUMBNAIL_CACHE_MB', 256))
+THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'webp')
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+PHOTO_SIZES = (64, 256)
+# Фото доступны только после входа - кэш браузера, не общих прокси
+PHOTO_CACHE_CONTROL = f"private, max-age={int(os.getenv('PHOTO_MAX_AGE', 60))}"
+default_image = MemoryFile(DEFAULT_IMAGE, PHOTO_CACHE_CONTROL)
+PHOTO_MAX_BYTES = int(float(os.getenv('PHOTO_MAX_MB', 10)) * 2 ** 20)
+PHOTO_MAX_SIDE = int(os.getenv('PHOTO_MAX_SIDE', 1600))
+thumbnails = ThumbnailCache(THUMBNAIL_DIR, int(THUMBNAIL_CACHE_MB * 2 ** 20), PHOTO_SIZES, THUMBNAIL_FORMAT,
+                            THUMBNAIL_QUALITY)
 
 DB_ROOT_PASSWORD = os.getenv('ROOT_PASSWORD')
 DB_ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
 URL = os.getenv('DB_URL')
-database = Database(URL, DB_ROOT_PASSWORD, DB_ADMIN_PASSWORD)
-user_auth = auth.UserAuth("./src/certs/private_key.pem", "./src/certs/public_key.pem")
+MATCH_TOLERANCE = float(os.getenv('MATCH_TOLERANCE', 0.6))
+MATCHER_INDEX = os.getenv('MATCHER_INDEX', 'exact')
+MATCHER_INDEX_PATH = Path(os.getenv('MATCHER_INDEX_PATH', ROOT_DIR / 'static/index/ivf.npz'))
+MATCHER_NPROBE = int(os.getenv('MATCHER_NPROBE', 8))
+if MATCHER_INDEX == 'ivf':
+    face_matcher = IVFMatcher(MATCH_TOLERANCE, MATCHER_INDEX_PATH, MATCHER_NPROBE)
+else:
+    face_matcher = FaceMatcher(MATCH_TOLERANCE)
+COUNT_MODE = os.getenv('COUNT_MODE', 'exact')
+COUNT_TTL = float(os.getenv('COUNT_TTL', 60))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 256))
+PRINCIPAL_CACHE_TTL = float(os.getenv('PRINCIPAL_CACHE_TTL', 60))
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', 10000))
+principal_cache = PrincipalCache(MemoryBackend(PRINCIPAL_CACHE_SIZE), PRINCIPAL_CACHE_TTL)
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', 2))
+LOGIN_CONCURRENCY = int(os.getenv('LOGIN_CONCURRENCY', 8))
+LOGIN_TIMEOUT = float(os.getenv('LOGIN_TIMEOUT', 2))
+password_hasher = PasswordHasher(BCRYPT_ROUNDS, HASH_WORKERS)
+login_limiter = LoginLimiter(LOGIN_CONCURRENCY, LOGIN_TIMEOUT)
+database = AsyncDatabase(URL, DB_ROOT_PASSWORD, DB_ADMIN_PASSWORD, face_matcher, COUNT_MODE, COUNT_TTL,
+                         pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE,
+                         statement_cache_size=DB_STATEMENT_CACHE_SIZE, principal_cache=principal_cache,
+                         hasher=password_hasher)
+INGEST_BUFFER_SIZE = int(os.getenv('INGEST_BUFFER_SIZE', 50000))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 1000))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', 0.5))
+INGEST_MAX_REQUEST_EVENTS = int(os.getenv('INGEST_MAX_REQUEST_EVENTS', 5000))
+access_log_buffer = AccessLogBuffer(database, INGEST_BUFFER_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL)
+ENCODING_WORKERS = int(os.getenv('ENCODING_WORKERS', 0)) or None
+ENCODING_MAX_ATTEMPTS = int(os.getenv('ENCODING_MAX_ATTEMPTS', 3))
+ENCODING_JOB_TIMEOUT = float(os.getenv('ENCODING_JOB_TIMEOUT', 300))
+encoding_queue = EncodingQueue(database, IMAGES_DIR / "employees", ENCODING_WORKERS, ENCODING_MAX_ATTEMPTS,
+                               timeout=ENCODING_JOB_TIMEOUT, max_side=PHOTO_MAX_SIDE)
+IMPORT_MAX_BYTES = int(float(os.getenv('IMPORT_MAX_MB', 4096)) * 2 ** 20)
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 500))
+employee_importer = EmployeeImporter(database, encoding_queue, IMAGES_DIR / "employees", IMPORT_BATCH_SIZE,
+                                     PHOTO_MAX_BYTES)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 2000))
+STATS_MAX_BUCKETS = int(os.getenv('STATS_MAX_BUCKETS', 10000))
+# 0 - хранить логи проходов бессрочно
+RETENTION_MONTHS = int(os.getenv('RETENTION_MONTHS', 0))
+RETENTION_MODE = os.getenv('RETENTION_MODE', 'archive')
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 86400))
+ARCHIVE_DIR = Path(os.getenv('ARCHIVE_DIR', ROOT_DIR / 'archive'))
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 2))
+access_log_retention = AccessLogRetention(database, IMAGES_DIR / "accessLogs", ARCHIVE_DIR, RETENTION_MONTHS,
+                                          RETENTION_MODE, RETENTION_INTERVAL, PARTITION_MONTHS_AHEAD, thumbnails)
+WS_QUEUE_SIZE = int(os.getenv('WS_QUEUE_SIZE', 100))
+WS_SLOW_POLICY = os.getenv('WS_SLOW_POLICY', 'drop_oldest')
+WS_SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT', 5))
+WS_HEARTBEAT_INTERVAL = float(os.getenv('WS_HEARTBEAT_INTERVAL', 30))
+WS_HEARTBEAT_TIMEOUT = float(os.getenv('WS_HEARTBEAT_TIMEOUT', 0))
+WS_PING_MESSAGE = os.getenv('WS_PING_MESSAGE') or None
+# Ping/pong на уровне протокола WebSocket, обрабатывает uvicorn
+WS_PING_INTERVAL = float(os.getenv('WS_PING_INTERVAL', 20))
+WS_PING_TIMEOUT = float(os.getenv('WS_PING_TIMEOUT', 20))
+# memory - один воркер, postgres - LISTEN/NOTIFY в базе DB_URL, socket - брокер src.utils.pubsub по адресу WS_BROKER
+WS_BROADCAST = os.getenv('WS_BROADCAST', 'memory')
+WS_BROKER = os.getenv('WS_BROKER')
+WS_HISTORY_SIZE = int(os.getenv('WS_HISTORY_SIZE', 1000))
+# memory - кэш пользователей сбрасывается только на своём воркере; postgres/socket - сброс рассылается всем воркерам
+# тем же транспортом, что и WS_BROADCAST (канал principals)
+PRINCIPAL_CACHE_BROADCAST = os.getenv('PRINCIPAL_CACHE_BROADCAST', 'memory')
+if PRINCIPAL_CACHE_BROADCAST != 'memory':
+    principal_cache.backend = InvalidatingBackend(
+        create_backend(PRINCIPAL_CACHE_BROADCAST, database.engine, WS_BROKER, "principals"), PRINCIPAL_CACHE_SIZE)
+websocket_manager = WebSocketManager(WS_QUEUE_SIZE, WS_SLOW_POLICY, WS_SEND_TIMEOUT, WS_HEARTBEAT_INTERVAL,
+                                     WS_HEARTBEAT_TIMEOUT, WS_PING_MESSAGE,
+                                     create_backend(WS_BROADCAST, database.engine, WS_BROKER), WS_HISTORY_SIZE)
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+user_auth = auth.UserAuth("./src/certs/private_key.pem", "./src/certs/public_key.pem", TOKEN_CACHE_SIZE)
 
 
 @app.post("/auth/login")
-def login(user: User):
-    user_db = database.get_user(user.login)
+async def login(user: User, session: AsyncSession = Depends(database.get_session)):
+    async with login_limiter.slot(user.login) as allowed:
+        if not allowed:
+            return BadResponse(6)
+        return await check_login(user, session)
+
+async def check_login(user: User, session: AsyncSession):
+    user_db = await database.get_user(user.login, session=session)
     if user_db is not None:
-        if utils.validate_password(user.password, user_db.password):
+        valid, new_hash = await password_hasher.verify_and_update(user.password, user_db.password)
+        if valid:
+            if new_hash is not None:
+                # BCRYPT_ROUNDS изменился - хэш пересчитывается при входе
+                await database.set_user_password_hash(user_db.id, new_hash, session=session)
             access, refresh = user_auth.create_tokens(user_db.id, user_db.login, user_db.access_layer_id)
             content = {
                 "login": user_db.login,
@@ -60,15 +194,16 @@ def login(user: User):
 
 
 @app.get("/auth")
-def auth(access_token: dict = Depends(user_auth.check_access_jwt),
-         refresh_token: dict = Depends(user_auth.check_refresh_jwt)):
+async def auth(access_token: dict = Depends(user_auth.check_access_jwt),
+               refresh_token: dict = Depends(user_auth.check_refresh_jwt),
+               session: AsyncSession = Depends(database.get_session)):
     if access_token is not None:
-        user_db = database.get_user(access_token["login"])
+        user_db = await database.get_user(access_token["login"], session=session)
         if user_db is None:
             return BadResponse(1)
         return UserLoginResponse(login=user_db.login, accessLayerId=user_db.access_layer_id, resultCode=1000)
     elif refresh_token is not None:
-        user_db = database.get_user(refresh_token["login"])
+        user_db = await database.get_user(refresh_token["login"], session=session)
         if user_db is None:
             return BadResponse(1)
         new_access_token = user_auth.create_jwt(user_db.id, user_db.login, user_db.access_layer_id)
@@ -79,23 +214,29 @@ def auth(access_token: dict = Depends(user_auth.check_access_jwt),
         return BadResponse(3)
 
 @app.delete('/auth/logout')
-def logout():
+async def logout():
     response = add_cookie({"resultCode": 0}, "", "")
     return response
 
 @app.get("/accessLogs")
-def access_logs(page: int, page_size: int = 10, access_token: dict = Depends(user_auth.check_access_jwt)):
-    if check_access(access_token) is not None:
-        logs = database.get_access_logs(page)
-        count = database.get_access_log_size()
-        return AccessLogsResponse(logs=list(logs), count=count)
+async def access_logs(page: int = 1, page_size: int = 10, cursor: str = None, with_count: bool = True,
+                      access_token: dict = Depends(user_auth.check_access_jwt),
+                      session: AsyncSession = Depends(database.get_session)):
+    if await check_access(access_token, session) is not None:
+        if page < 1 or page_size < 1: return BadResponse(5)
+        result = await database.get_access_logs(page, page_size, cursor, session=session)
+        if result is None: return BadResponse(5)
+        logs, next_cursor = result
+        count = await database.get_access_log_size(session=session) if with_count else None
+        return AccessLogsResponse(logs=list(logs), count=count, nextCursor=next_cursor)
     else:
         return BadResponse(3)
 
 @app.get("/accessLog")
-def get_access_log(id: int, access_token: dict = Depends(user_auth.check_access_jwt)):
-    if check_access(access_token) is not None:
-        access_log = database.get_access_log(id)
+async def get_access_log(id: int, access_token: dict = Depends(user_auth.check_access_jwt),
+                         session: AsyncSession = Depends(database.get_session)):
+    if await check_access(access_token, session) is not None:
+        access_log = await database.get_access_log(id, session=session)
         if access_log is None: return BadResponse(1)
         return AccessLogResponse(id=access_log.id, name=access_log.employee.name,
                                  access=access_log.employee.is_access, time=str(access_log.timestamp))
@@ -103,71 +244,169 @@ def get_access_log(id: int, access_token: dict = Depends(user_auth.check_access_
         return BadResponse(3)
 
 @app.get('/accessLog/photo')
-def get_access_log_photo(id: int, access_token: dict = Depends(user_auth.check_access_jwt)):
-    if check_access(access_token) is not None:
-        access_log = database.get_access_log(id)
+async def get_access_log_photo(request: Request, id: int, size: str = 'original',
+                               access_token: dict = Depends(user_auth.check_access_jwt),
+                               session: AsyncSession = Depends(database.get_session)):
+    if not valid_photo_size(size): return BadResponse(5)
+    if await check_access(access_token, session) is not None:
+        access_log = await database.get_access_log(id, with_employee=False, session=session)
         if access_log is None: return BadResponse(1)
-        if not access_log.photo_url: return FileResponse(DEFAULT_IMAGE)
-        if access_log is None: return BadResponse(1)
-        path = IMAGES_DIR / f'accessLogs/{access_log.photo_url}.png'
-        if path.exists():
-            response = FileResponse(path)
-        else:
-            response = FileResponse(DEFAULT_IMAGE)
-        return response
+        if not access_log.photo_url: return default_image.response(request)
+        return await photo_response(request, IMAGES_DIR / f'accessLogs/{access_log.photo_url}.png', size)
     else:
         return BadResponse(3)
 
 @app.post("/accessLog")
-async def post_access_log(notify: PostAccessLogNotify, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def post_access_log(notify: PostAccessLogNotify, access_token: dict = Depends(user_auth.check_access_jwt),
+                          session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            data = notify.isAccess
-            data = 1 if data else 0
-            await websocket_manager.broadcast(f"{data}")
+            event = await access_log_event(notify, session)
+            if event is None: return BadResponse(1)
+            # Сериализуется один раз на событие, клиентам уходит готовая строка
+            await websocket_manager.broadcast(event.model_dump_json())
             return GoodResponse(0)
         else:
             return BadResponse(4)
     else:
         return BadResponse(3)
 
+async def access_log_event(notify: PostAccessLogNotify, session: AsyncSession) -> AccessLogEvent | None:
+    """Событие для /ws со всем, что нужно панели, чтобы не перезапрашивать /accessLogs"""
+    if notify.id is not None:
+        access_log = await database.get_access_log(notify.id, session=session)
+        if access_log is None: return None
+        return AccessLogEvent(id=access_log.id, employeeId=access_log.employee_id, name=access_log.employee.name,
+                              access=notify.isAccess, time=str(access_log.timestamp),
+                              photoUrl=f"/accessLog/photo?id={access_log.id}" if access_log.photo_url else None)
+    employee = None
+    if notify.employeeId is not None:
+        employee = await database.get_employee(notify.employeeId, session=session)
+        if employee is None: return None
+    timestamp = naive_local(notify.timestamp) if notify.timestamp is not None else datetime.now()
+    return AccessLogEvent(employeeId=notify.employeeId, name=employee.name if employee is not None else None,
+                          access=notify.isAccess, time=str(timestamp))
+
+@app.post("/accessLogs/batch")
+async def post_access_logs_batch(request: AccessLogBatchRequest,
+                                 access_token: dict = Depends(user_auth.check_access_jwt),
+                                 session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
+    if user_access_layer is not None:
+        if user_access_layer == 0:
+            if len(request.events) > INGEST_MAX_REQUEST_EVENTS: return BadResponse(5)
+            events = [(event.employeeId, naive_local(event.timestamp)) for event in request.events]
+            # Буфер переполнен - база не успевает, камера должна повторить пачку позже
+            if not access_log_buffer.put_many(events): return BadResponse(6)
+            return AccessLogBatchResponse(accepted=len(events))
+        else:
+            return BadResponse(4)
+    else:
+        return BadResponse(3)
+
+@app.get("/accessLogs/export")
+async def export_logs(format: str = 'csv', start: datetime = None, end: datetime = None, employeeId: int = None,
+                      gzip: bool = False, access_token: dict = Depends(user_auth.check_access_jwt),
+                      session: AsyncSession = Depends(database.get_session)):
+    if await check_access(access_token, session) is not None:
+        if format not in MEDIA_TYPES: return BadResponse(5)
+        start = naive_local(start) if start is not None else None
+        end = naive_local(end) if end is not None else None
+        if start is not None and end is not None and start >= end: return BadResponse(5)
+        # Строки читаются курсором по мере отправки, размер выгрузки не влияет на память
+        rows = database.stream_access_logs(start, end, employeeId, EXPORT_BATCH_SIZE)
+        filename = f"access_logs.{format}" + (".gz" if gzip else "")
+        return StreamingResponse(export_access_logs(rows, format, gzip),
+                                 media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+                                 headers={"content-disposition": f'attachment; filename="{filename}"'})
+    else:
+        return BadResponse(3)
+
+@app.get("/accessLogs/stats")
+async def access_stats(period: str = 'hour', start: datetime = None, end: datetime = None,
+                       access_token: dict = Depends(user_auth.check_access_jwt),
+                       session: AsyncSession = Depends(database.get_session)):
+    if await check_access(access_token, session) is not None:
+        if period not in PERIODS: return BadResponse(5)
+        start, end = stats_range(start, end, timedelta(days=1) if period == 'hour' else timedelta(days=30))
+        step = timedelta(hours=1) if period == 'hour' else timedelta(days=1)
+        if start >= end or (end - start) / step > STATS_MAX_BUCKETS: return BadResponse(5)
+        rows = await database.get_access_stats(period, bucket_of(start, period), end, session=session)
+        return AccessStatsResponse(period=period, buckets=[
+            AccessStatsBucket(time=str(bucket), total=total, granted=granted, denied=denied,
+                              deniedRate=denied / total if total else 0.0)
+            for bucket, total, granted, denied in rows])
+    else:
+        return BadResponse(3)
+
+@app.get("/accessLogs/stats/employees")
+async def access_stats_employees(start: datetime = None, end: datetime = None, employeeId: int = None,
+                                 limit: int = 100, access_token: dict = Depends(user_auth.check_access_jwt),
+                                 session: AsyncSession = Depends(database.get_session)):
+    if await check_access(access_token, session) is not None:
+        start, end = stats_range(start, end, timedelta(days=30))
+        if start >= end or not 0 < limit <= 1000: return BadResponse(5)
+        rows = await database.get_employee_presence(bucket_of(start, 'day'), end, employeeId, limit,
+                                                    session=session)
+        return EmployeePresenceResponse(employees=[
+            EmployeePresence(id=employee_id, name=name, firstSeen=str(first), lastSeen=str(last), count=count)
+            for employee_id, name, first, last, count in rows])
+    else:
+        return BadResponse(3)
+
+def stats_range(start, end, default):
+    """Статистика только из агрегатов, по умолчанию - последние default до текущего момента"""
+    end = naive_local(end) if end is not None else datetime.now()
+    start = naive_local(start) if start is not None else end - default
+    return start, end
+
+def naive_local(timestamp):
+    """В access_logs.timestamp время без часового пояса, как datetime.now()"""
+    if timestamp.tzinfo is None: return timestamp
+    return timestamp.astimezone().replace(tzinfo=None)
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def websocket_endpoint(websocket: WebSocket, since: int = None, employeeId: list[int] = Query(None),
+                             access: bool = None, format: str = 'json',
+                             access_token: dict = Depends(user_auth.check_access_jwt)):
+    user_access_layer = await check_access(access_token)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            await websocket_manager.connect(websocket)
-            try:
-                while True:
-                    await websocket.receive_text()
-            except:
-                websocket_manager.disconnect(websocket)
+            connection = await websocket_manager.connect(websocket, since, Subscription(employeeId, access),
+                                                         legacy=format == 'legacy')
+            await websocket_manager.listen(connection)
         else:
             return BadResponse(4)
     else:
         return BadResponse(3)
 
 @app.get("/users")
-def users(page: int, page_size: int = 10, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def users(page: int = 1, page_size: int = 10, cursor: str = None, with_count: bool = True,
+                access_token: dict = Depends(user_auth.check_access_jwt),
+                session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            users_db = database.get_users(page, page_size)
+            if page < 1 or page_size < 1: return BadResponse(5)
+            result = await database.get_users(page, page_size, cursor, session=session)
+            if result is None: return BadResponse(5)
+            users_db, next_cursor = result
             users_db = list(map(lambda x: x.to_schema(), users_db))
-            count = database.get_users_size()
-            return UsersResponse(users=users_db, count=count)
+            count = await database.get_users_size(session=session) if with_count else None
+            return UsersResponse(users=users_db, count=count, nextCursor=next_cursor)
         else:
             return BadResponse(4)
     else:
         return BadResponse(3)
 
 @app.post("/users")
-def add_user(user: AddUserRequest, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def add_user(user: AddUserRequest, access_token: dict = Depends(user_auth.check_access_jwt),
+                   session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            res = database.add_user(user.login, user.password, user.accessLayerId)
+            res = await database.add_user(user.login, user.password, user.accessLayerId, session=session)
             return GoodResponse(100) if res else BadResponse(5)
         else:
             return BadResponse(4)
@@ -175,11 +414,12 @@ def add_user(user: AddUserRequest, access_token: dict = Depends(user_auth.check_
         return BadResponse(3)
 
 @app.get("/user")
-def get_user(id: int, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def get_user(id: int, access_token: dict = Depends(user_auth.check_access_jwt),
+                   session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            user_db = database.get_user_by_id(id)
+            user_db = await database.get_user_by_id(id, session=session)
             if user_db is not None:
                 return GetUserResponse(id=id, login=user_db.login, accessLayer=user_db.access_layer_id)
             return BadResponse(1)
@@ -189,11 +429,12 @@ def get_user(id: int, access_token: dict = Depends(user_auth.check_access_jwt)):
         return BadResponse(3)
 
 @app.delete("/user")
-def delete_user(id: int, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def delete_user(id: int, access_token: dict = Depends(user_auth.check_access_jwt),
+                      session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            if database.delete_user(id):
+            if await database.delete_user(id, session=session):
                 return GoodResponse(101)
             else:
                 return BadResponse(1)
@@ -203,11 +444,12 @@ def delete_user(id: int, access_token: dict = Depends(user_auth.check_access_jwt
         return BadResponse(3)
 
 @app.post("/user")
-def set_user_password(user: SetUserPasswordRequest, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def set_user_password(user: SetUserPasswordRequest, access_token: dict = Depends(user_auth.check_access_jwt),
+                            session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            if database.set_user_password(user.id, user.password):
+            if await database.set_user_password(user.id, user.password, session=session):
                 return GoodResponse(102)
             else: return BadResponse(1)
         else:
@@ -216,11 +458,12 @@ def set_user_password(user: SetUserPasswordRequest, access_token: dict = Depends
         return BadResponse(3)
 
 @app.put("/user")
-def change_user_access_layer(user: SetUserAccessLayerRequest, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def change_user_access_layer(user: SetUserAccessLayerRequest, access_token: dict = Depends(user_auth.check_access_jwt),
+                                   session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            if database.set_user_access(user.id, user.accessLayerId):
+            if await database.set_user_access(user.id, user.accessLayerId, session=session):
                 return GoodResponse(102)
             else:
                 return BadResponse(1)
@@ -230,14 +473,18 @@ def change_user_access_layer(user: SetUserAccessLayerRequest, access_token: dict
         return BadResponse(3)
 
 @app.get("/employees")
-def get_employees(page: int, page_size: int = 10, substr: str = None, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def get_employees(page: int = 1, page_size: int = 10, substr: str = None, cursor: str = None,
+                        with_count: bool = True, access_token: dict = Depends(user_auth.check_access_jwt),
+                        session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            employees = database.get_employees(page, page_size, substr)
-            # employees = list(map(lambda x: x.to_schema(), employees))
-            count = database.get_employees_size()
-            response = EmployeesResponse(employees=employees, count=count)
+            if page < 1 or page_size < 1: return BadResponse(5)
+            result = await database.get_employees(page, page_size, substr, cursor, session=session)
+            if result is None: return BadResponse(5)
+            employees, next_cursor = result
+            count = await database.get_employees_size(substr, session=session) if with_count else None
+            response = EmployeesResponse(employees=employees, count=count, nextCursor=next_cursor)
             return response
         else:
             return BadResponse(4)
@@ -245,11 +492,12 @@ def get_employees(page: int, page_size: int = 10, substr: str = None, access_tok
         return BadResponse(3)
 
 @app.get('/employee')
-def get_employee(id: int, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def get_employee(id: int, access_token: dict = Depends(user_auth.check_access_jwt),
+                       session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            employee = database.get_employee(id)
+            employee = await database.get_employee(id, session=session)
             if employee is None: return BadResponse(1)
             return EmployeeResponse(id=employee.id, name=employee.name,
                                     info=employee.info, isAccess=employee.is_access)
@@ -259,31 +507,53 @@ def get_employee(id: int, access_token: dict = Depends(user_auth.check_access_jw
         return BadResponse(3)
 
 @app.get("/employees/photo")
-def get_employee_photo(id: int, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def get_employee_photo(request: Request, id: int, size: str = 'original',
+                             access_token: dict = Depends(user_auth.check_access_jwt),
+                             session: AsyncSession = Depends(database.get_session)):
+    if not valid_photo_size(size): return BadResponse(5)
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            employee = database.get_employee(id)
-            if employee is None: return BadResponse(1)
-            if not employee.photo_url: return FileResponse(DEFAULT_IMAGE)
+            # Фото сотрудника всегда лежит под его id, повторный запрос проверяется без обращения к базе
+            path = IMAGES_DIR / f'employees/{id}.png'
+            if is_conditional(request):
+                validators = file_etag(path, photo_variant(size))
+                if validators is not None and not_modified(request, *validators):
+                    return not_modified_response(*validators, PHOTO_CACHE_CONTROL)
+            employee = await database.get_employee(id, session=session)
             if employee is None: return BadResponse(1)
-            path = IMAGES_DIR / f'employees/{employee.photo_url}.png'
-            if path.exists():
-                response = FileResponse(path)
-            else:
-                response = FileResponse(DEFAULT_IMAGE)
-            return response
+            if not employee.photo_url: return default_image.response(request)
+            return await photo_response(request, path, size)
         else:
             return BadResponse(4)
     else:
         return BadResponse(3)
 
+def valid_photo_size(size: str):
+    """size - original или сторона уменьшенной копии из PHOTO_SIZES"""
+    return size == 'original' or (size.isdigit() and int(size) in PHOTO_SIZES)
+
+def photo_variant(size: str):
+    """Часть ETag: уменьшенные копии зависят ещё и от формата"""
+    return size if size == 'original' else f"{size}-{thumbnails.format}"
+
+async def photo_response(request: Request, path: Path, size: str):
+    validators = file_etag(path, photo_variant(size))
+    if validators is None: return default_image.response(request)
+    etag, mtime = validators
+    if not_modified(request, etag, mtime): return not_modified_response(etag, mtime, PHOTO_CACHE_CONTROL)
+    headers = cache_headers(etag, mtime, PHOTO_CACHE_CONTROL)
+    if size == 'original': return FileResponse(path, headers=headers)
+    return FileResponse(await thumbnails.get(path, int(size)), media_type=thumbnails.media_type, headers=headers)
+
 @app.post("/employees")
-def post_employee(employee: EmployeePostRequest, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def post_employee(employee: EmployeePostRequest, access_token: dict = Depends(user_auth.check_access_jwt),
+                        session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            employee_id = database.add_employee(employee.name, employee.info, employee.isAccess)
+            employee_id = await database.add_employee(employee.name, employee.info, employee.isAccess,
+                                                      session=session)
             if employee_id is not None:
                 return EmployeePostResponse(id=employee_id)
             else:
@@ -294,28 +564,76 @@ def post_employee(employee: EmployeePostRequest, access_token: dict = Depends(us
         return BadResponse(3)
 
 @app.post("/employees/photo")
-async def post_employee_photo(id: int, photo: UploadFile = File(...), access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def post_employee_photo(id: int, photo: UploadFile = File(...),
+                              access_token: dict = Depends(user_auth.check_access_jwt),
+                              session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
             photo_path = IMAGES_DIR / "employees" / f"{id}.png"
-            with open(photo_path, "wb") as buffer:
-                buffer.write(await photo.read())
-            if database.set_employee_photo(id):
+            try:
+                await save_upload(photo, photo_path, PHOTO_MAX_BYTES)
+            except UploadError:
+                return BadResponse(5)
+            thumbnails.discard(photo_path)
+            # Вместе с фото ставится задача перекодирования и расчёта энкодинга
+            if await database.set_employee_photo(id, session=session):
+                encoding_queue.notify()
                 return GoodResponse(102)
             else:
+                photo_path.unlink(missing_ok=True)
                 return BadResponse(1)
         else:
             return BadResponse(4)
     else:
         return BadResponse(3)
 
+@app.post("/employees/import")
+async def import_employees(employees: UploadFile = File(...), photos: UploadFile | None = File(None),
+                           access_token: dict = Depends(user_auth.check_access_jwt),
+                           session: AsyncSession = Depends(database.get_session)):
+    """CSV с колонками name, info, isAccess, photo и необязательный ZIP, photo - имя файла в архиве"""
+    user_access_layer = await check_access(access_token, session)
+    if user_access_layer is not None:
+        if user_access_layer == 0:
+            try:
+                rows, seconds = await employee_importer.run(employees.file, photos.file if photos else None)
+            except zipfile.BadZipFile:
+                return BadResponse(5)
+            created = sum(row.status == "created" for row in rows)
+            return EmployeesImportResponse(created=created, failed=len(rows) - created, seconds=round(seconds, 3),
+                                           rows=rows)
+        else:
+            return BadResponse(4)
+    else:
+        return BadResponse(3)
+
+@app.get("/employees/encoding")
+async def get_employee_encoding_job(id: int, access_token: dict = Depends(user_auth.check_access_jwt),
+                                    session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
+    if user_access_layer is not None:
+        if user_access_layer == 0:
+            job = await database.get_encoding_job(id, session=session)
+            if job is None: return BadResponse(1)
+            return EncodingJobResponse(employeeId=job.employee_id, status=job.status, attempts=job.attempts,
+                                       error=job.error, updatedAt=str(job.updated_at))
+        else:
+            return BadResponse(4)
+    else:
+        return BadResponse(3)
+
 @app.delete("/employee")
-def delete_employee(id: int, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def delete_employee(id: int, access_token: dict = Depends(user_auth.check_access_jwt),
+                          session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            if database.delete_employee(id):
+            if await database.delete_employee(id, session=session):
+                # Иначе фото удалённого сотрудника продолжало бы отвечать 304 на условные запросы
+                photo_path = IMAGES_DIR / "employees" / f"{id}.png"
+                photo_path.unlink(missing_ok=True)
+                thumbnails.discard(photo_path)
                 return GoodResponse(101)
             else:
                 return BadResponse(1)
@@ -325,11 +643,13 @@ def delete_employee(id: int, access_token: dict = Depends(user_auth.check_access
         return BadResponse(3)
 
 @app.put("/employee")
-def edit_employee(employee: Employee, access_token: dict = Depends(user_auth.check_access_jwt)):
-    user_access_layer = check_access(access_token)
+async def edit_employee(employee: Employee, access_token: dict = Depends(user_auth.check_access_jwt),
+                        session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
     if user_access_layer is not None:
         if user_access_layer == 0:
-            if database.set_employee_data(employee.id, employee.name, employee.info, employee.isAccess):
+            if await database.set_employee_data(employee.id, employee.name, employee.info, employee.isAccess,
+                                                session=session):
                 return GoodResponse(102)
             else:
                 return BadResponse(5)
@@ -338,12 +658,52 @@ def edit_employee(employee: Employee, access_token: dict = Depends(user_auth.che
     else:
         return BadResponse(3)
 
-def check_access(access_token: dict):
+@app.post("/recognize")
+async def recognize(request: RecognizeRequest, access_token: dict = Depends(user_auth.check_access_jwt),
+                    session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
+    if user_access_layer is not None:
+        if user_access_layer == 0:
+            if len(request.encoding) != ENCODING_SIZE: return BadResponse(5)
+            match = await database.recognize(request.encoding, session=session)
+            if match is None: return BadResponse(1)
+            employee, distance = match
+            if employee is None: return BadResponse(1)
+            return RecognizeResponse(id=employee.id, name=employee.name,
+                                     isAccess=employee.is_access, distance=distance)
+        else:
+            return BadResponse(4)
+    else:
+        return BadResponse(3)
+
+@app.get("/metrics")
+async def metrics(access_token: dict = Depends(user_auth.check_access_jwt),
+                  session: AsyncSession = Depends(database.get_session)):
+    user_access_layer = await check_access(access_token, session)
+    if user_access_layer is not None:
+        if user_access_layer == 0:
+            return MetricsResponse(principalCache=principal_cache.stats(), passwordHasher=password_hasher.stats(),
+                                   login=login_limiter.stats(), accessLogBuffer=access_log_buffer.stats(),
+                                   thumbnails=thumbnails.stats(), encodingJobs=encoding_queue.stats(),
+                                   websockets=websocket_manager.stats(),
+                                   retention=access_log_retention.stats())
+        else:
+            return BadResponse(4)
+    else:
+        return BadResponse(3)
+
+async def check_access(access_token: dict, session: AsyncSession = None):
     if access_token is not None:
-        user_db = database.get_user(access_token["login"])
-        if user_db is None:
+        principal = await principal_cache.get(access_token["id"])
+        if principal is None:
+            user_db = await database.get_user_by_id(access_token["id"], session=session)
+            if user_db is None:
+                return None
+            principal = Principal(user_db.login, user_db.access_layer_id)
+            await principal_cache.set(user_db.id, principal)
+        if principal.login != access_token["login"]:
             return None
-        return user_db.access_layer_id
+        return principal.access_layer_id
     else:
         return None
 
@@ -373,6 +733,10 @@ origins = [
     FRONTEND_WEBSOCKET
 ]
 
+# Добавлен раньше CORS, поэтому ответ 413 тоже получает CORS заголовки.
+# Запас на заголовки multipart поверх самого файла
+app.add_middleware(BodySizeLimit, max_bytes=PHOTO_MAX_BYTES + 64 * 1024, paths=("/employees/photo",))
+app.add_middleware(BodySizeLimit, max_bytes=IMPORT_MAX_BYTES, paths=("/employees/import",))
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -380,7 +744,6 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
 if __name__ == "__main__":
     if USE_HTTPS:
         ssl_keyfile = ROOT_DIR / "src/certs/key.pem"
@@ -388,6 +751,8 @@ if __name__ == "__main__":
         uvicorn.run("main:app",
                     host=HOST, port=int(PORT),
                     ssl_keyfile=ssl_keyfile,
-                    ssl_certfile=ssl_cert)
+                    ssl_certfile=ssl_cert,
+                    ws_ping_interval=WS_PING_INTERVAL, ws_ping_timeout=WS_PING_TIMEOUT)
     else:
-        uvicorn.run("main:app", host=HOST, port=int(PORT))
\ No newline at end of file
+        uvicorn.run("main:app", host=HOST, port=int(PORT),
+                    ws_ping_interval=WS_PING_INTERVAL, ws_ping_timeout=WS_PING_TIMEOUT)
\ No newline at end of file
@@ -0,0 +1,71 @@
+import functools
+import logging
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+from PIL import Image, ImageOps
+
+try:
+    import face_recognition
+except ImportError:
+    face_recognition = None
+
+from src.matcher.matcher import ENCODING_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class EncoderUnavailable(RuntimeError):
+    """face_recognition не установлен - энкодинг посчитать нельзя, но лицо на фото может быть"""
+
+
+def normalize_photo(path: Path, max_side: int = 1600, generation: int = 0) -> Image.Image:
+    """
+    Перекодирует загруженное фото в PNG на месте: поворот по EXIF, RGB, длинная сторона не больше max_side.
+    Метаданные камеры при этом отбрасываются. Возвращает получившуюся картинку.
+    Если пока шла обработка фото заменили (новая загрузка), оригинал не перезаписывается:
+    результат этой задачи всё равно будет отброшен по generation.
+    """
+    path = Path(path)
+    before = os.stat(path)
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    # Своё временное имя у каждой задачи: параллельные задачи сотрудника не пишут в один файл
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}-{generation}-", suffix=".normalized")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            image.save(file, "PNG")
+        if same_file(before, os.stat(path)):
+            os.replace(tmp, path)
+    finally:
+        Path(tmp).unlink(missing_ok=True)
+    return image
+
+
+def same_file(before: os.stat_result, after: os.stat_result) -> bool:
+    """Загрузка пишет новый файл и переименовывает его, поэтому замена видна по inode и mtime"""
+    return (before.st_ino, before.st_mtime_ns, before.st_size) == (after.st_ino, after.st_mtime_ns, after.st_size)
+
+
+@functools.cache
+def warn_no_encoder():
+    logger.warning("face_recognition is not installed, face encodings are not computed")
+
+
+def encode_face(image: Image.Image) -> np.ndarray | None:
+    """128-мерный дескриптор единственного/первого лица, None если лица нет"""
+    if face_recognition is None:
+        warn_no_encoder()
+        raise EncoderUnavailable("face_recognition is not installed")
+    encodings = face_recognition.face_encodings(np.asarray(image))
+    if not encodings:
+        return None
+    encoding = np.asarray(encodings[0], dtype=np.float32)
+    return encoding if encoding.shape == (ENCODING_SIZE,) else None
+
+
+def process_photo(path: Path, max_side: int = 1600, generation: int = 0) -> np.ndarray | None:
+    """Вся тяжёлая обработка фото после загрузки, выполняется вне event loop"""
+    return encode_face(normalize_photo(path, max_side, generation))
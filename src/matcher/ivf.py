@@ -0,0 +1,240 @@
+import logging
+import threading
+from pathlib import Path
+import numpy as np
+
+from src.matcher.matcher import FaceMatcher, ENCODING_SIZE, to_queries, filter_matches
+
+logger = logging.getLogger(__name__)
+
+
+class IVFMatcher:
+
+    """
+    Приближённый поиск (inverted file index) с тем же API, что и FaceMatcher.
+    Энкодинги разбиты k-means на nlist кластеров, запрос проверяет только nprobe ближайших.
+    Центроиды сохраняются на диск, после перезапуска обучение не повторяется.
+    Переобучение при росте индекса идёт в фоновом потоке: пока оно считается, поиск работает по старым спискам,
+    а изменения за это время повторяются на новых списках перед заменой.
+    """
+
+    def __init__(self, tolerance: float = 0.6, path: Path = None, nprobe: int = 8,
+                 min_train_size: int = 4096, iterations: int = 10):
+        self.tolerance = tolerance
+        self.path = Path(path) if path is not None else None
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.iterations = iterations
+        self.lock = threading.RLock()
+        self.trained_size = 0
+        self.centroids = np.zeros((1, ENCODING_SIZE), dtype=np.float32)
+        self.lists = [FaceMatcher(tolerance, capacity=16)]
+        self.owners: dict[int, int] = {}
+        # Изменения во время переобучения: employee_id -> вектор или None (удалён)
+        self.pending: dict[int, np.ndarray | None] | None = None
+        self.generation = 0
+        self.rebuild_thread: threading.Thread | None = None
+
+    def load(self, rows):
+        ids, vectors = [], []
+        for employee_id, encoding in rows:
+            ids.append(employee_id)
+            vectors.append(encoding)
+        self.load_matrix(np.asarray(ids, dtype=np.int64), to_queries(vectors))
+
+    def load_matrix(self, ids: np.ndarray, matrix: np.ndarray):
+        with self.lock:
+            # Результат идущего переобучения устарел
+            self.generation += 1
+            if not self._restore() or self._needs_rebuild(len(matrix)):
+                self.centroids, self.trained_size = self._train(matrix), len(matrix)
+                self.save()
+            self.lists, self.owners = self._fill(self.centroids, ids, matrix)
+
+    def rebuild(self):
+        """
+        Переобучение на текущих данных, при сильном росте/уменьшении индекса вызывается в фоне из set.
+        Блокировка берётся только на снимок данных и на замену списков. False - переобучение уже идёт.
+        """
+        with self.lock:
+            if self.pending is not None:
+                return False
+            self.pending = {}
+        return self._rebuild()
+
+    def set(self, employee_id: int, encoding):
+        vector = FaceMatcher._vector(encoding)
+        with self.lock:
+            self._remove(employee_id)
+            self._set(employee_id, vector)
+            if self.pending is not None:
+                self.pending[employee_id] = vector
+            elif self._needs_rebuild(len(self.owners)):
+                self.pending = {}
+                self.rebuild_thread = threading.Thread(target=self._rebuild_in_background, daemon=True)
+                self.rebuild_thread.start()
+
+    def remove(self, employee_id: int):
+        with self.lock:
+            if self.pending is not None:
+                self.pending[employee_id] = None
+            return self._remove(employee_id)
+
+    def wait_rebuild(self, timeout: float = None):
+        """Ожидание фонового переобучения, для тестов и завершения работы"""
+        thread = self.rebuild_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def match(self, encoding, tolerance: float = None):
+        return self.match_many([encoding], tolerance)[0]
+
+    def match_many(self, encodings, tolerance: float = None):
+        tolerance = self.tolerance if tolerance is None else tolerance
+        ids, distances = self.nearest(to_queries(encodings))
+        return filter_matches(ids, distances, tolerance)
+
+    def nearest(self, queries: np.ndarray):
+        ids = np.full(len(queries), -1, dtype=np.int64)
+        distances = np.full(len(queries), np.inf, dtype=np.float32)
+        with self.lock:
+            nprobe = min(self.nprobe, len(self.lists))
+            probes = np.argsort(self._centroid_distances(queries), axis=1)[:, :nprobe]
+            for i, query in enumerate(queries):
+                for list_id in probes[i]:
+                    list_ids, list_distances = self.lists[list_id].nearest(query[None, :])
+                    if list_distances[0] < distances[i]:
+                        ids[i], distances[i] = list_ids[0], list_distances[0]
+        return ids, distances
+
+    def save(self):
+        self._save(self.centroids, self.trained_size)
+
+    def __len__(self):
+        return len(self.owners)
+
+    def _restore(self):
+        if self.path is None or not self.path.exists():
+            return False
+        with np.load(self.path) as data:
+            centroids = data['centroids']
+            if centroids.ndim != 2 or centroids.shape[1] != ENCODING_SIZE:
+                return False
+            self.centroids = centroids.astype(np.float32)
+            self.trained_size = int(data['trained_size'])
+        return True
+
+    def _save(self, centroids: np.ndarray, trained_size: int):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp.npz')
+        np.savez(tmp_path, centroids=centroids, trained_size=trained_size)
+        tmp_path.replace(self.path)
+
+    def _rebuild(self):
+        # pending уже выставлен: изменения до снимка попадут и в него, и в pending - повтор безвреден
+        with self.lock:
+            generation = self.generation
+            ids, matrix = self._export()
+        try:
+            centroids = self._train(matrix)
+            lists, owners = self._fill(centroids, ids, matrix)
+        except BaseException:
+            with self.lock:
+                self.pending = None
+            raise
+        with self.lock:
+            pending, self.pending = self.pending, None
+            if generation != self.generation:
+                return False
+            self.centroids, self.trained_size = centroids, len(matrix)
+            self.lists, self.owners = lists, owners
+            for employee_id, vector in pending.items():
+                self._remove(employee_id)
+                if vector is not None:
+                    self._set(employee_id, vector)
+        self._save(centroids, len(matrix))
+        return True
+
+    def _rebuild_in_background(self):
+        try:
+            self._rebuild()
+        except Exception:
+            logger.exception("IVF rebuild failed")
+
+    def _set(self, employee_id: int, vector: np.ndarray):
+        owner = int(self._assign(vector[None, :])[0])
+        self.lists[owner].set(employee_id, vector)
+        self.owners[employee_id] = owner
+
+    def _remove(self, employee_id: int):
+        owner = self.owners.pop(employee_id, None)
+        if owner is None:
+            return False
+        self.lists[owner].remove(employee_id)
+        return True
+
+    def _train(self, matrix: np.ndarray):
+        if len(matrix) < self.min_train_size:
+            # На маленьких галереях один список - это точный поиск
+            return np.zeros((1, ENCODING_SIZE), dtype=np.float32)
+        nlist = int(np.sqrt(len(matrix)))
+        return kmeans(matrix, nlist, self.iterations)
+
+    def _fill(self, centroids: np.ndarray, ids: np.ndarray, matrix: np.ndarray):
+        lists = [FaceMatcher(self.tolerance, capacity=16) for _ in range(len(centroids))]
+        if len(ids) == 0:
+            return lists, {}
+        owners = self._assign(matrix, centroids)
+        order = np.argsort(owners, kind='stable')
+        bounds = np.searchsorted(owners[order], np.arange(len(centroids) + 1))
+        for list_id in range(len(centroids)):
+            rows = order[bounds[list_id]:bounds[list_id + 1]]
+            lists[list_id].load_matrix(ids[rows], matrix[rows])
+        return lists, {int(employee_id): int(owner) for employee_id, owner in zip(ids, owners)}
+
+    def _export(self):
+        ids, matrices = [], []
+        for block in self.lists:
+            ids.append(block.ids[:block.size].copy())
+            matrices.append(block.matrix[:block.size].copy())
+        return np.concatenate(ids), np.concatenate(matrices)
+
+    def _needs_rebuild(self, size: int):
+        if self.trained_size < self.min_train_size:
+            return size >= self.min_train_size
+        return size > self.trained_size * 4 or size < self.trained_size // 4
+
+    def _centroid_distances(self, queries: np.ndarray, centroids: np.ndarray = None):
+        centroids = self.centroids if centroids is None else centroids
+        return np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2 * queries @ centroids.T
+
+    def _assign(self, matrix: np.ndarray, centroids: np.ndarray = None):
+        result = np.empty(len(matrix), dtype=np.int64)
+        # Кусками, чтобы матрица расстояний не занимала лишнюю память
+        for start in range(0, len(matrix), 8192):
+            chunk = matrix[start:start + 8192]
+            result[start:start + len(chunk)] = np.argmin(self._centroid_distances(chunk, centroids), axis=1)
+        return result
+
+
+def kmeans(matrix: np.ndarray, k: int, iterations: int = 10, sample_per_centroid: int = 64, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    if len(matrix) > k * sample_per_centroid:
+        matrix = matrix[rng.choice(len(matrix), k * sample_per_centroid, replace=False)]
+    centroids = matrix[rng.choice(len(matrix), k, replace=False)].astype(np.float32)
+    sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+    for _ in range(iterations):
+        distances = sq_norms[:, None] - 2 * matrix @ centroids.T + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+        labels = np.argmin(distances, axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, matrix)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Пустые кластеры переезжают на самые далёкие от своих центроидов точки
+        if empty.any():
+            farthest = np.argsort(distances[np.arange(len(matrix)), labels])[-empty.sum():]
+            centroids[empty] = matrix[farthest]
+    return centroids
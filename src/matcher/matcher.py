@@ -0,0 +1,130 @@
+import threading
+import numpy as np
+
+ENCODING_SIZE = 128
+
+
+class FaceMatcher:
+
+    """
+    Индекс энкодингов сотрудников в памяти.
+    Все энкодинги лежат в одной непрерывной float32 матрице, поиск ближайшего
+    сотрудника делается одним матрично-векторным умножением.
+    """
+
+    def __init__(self, tolerance: float = 0.6, capacity: int = 1024):
+        self.tolerance = tolerance
+        self.min_capacity = capacity
+        self.lock = threading.Lock()
+        self.size = 0
+        self.matrix = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+        self.sq_norms = np.empty(capacity, dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.positions: dict[int, int] = {}
+
+    def load(self, rows):
+        """rows - итерируемое из пар (employee_id, encoding)"""
+        ids, vectors = [], []
+        for employee_id, encoding in rows:
+            ids.append(employee_id)
+            vectors.append(encoding)
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        self.load_matrix(np.asarray(ids, dtype=np.int64), matrix)
+
+    def load_matrix(self, ids: np.ndarray, matrix: np.ndarray):
+        capacity = max(len(ids) * 2, self.min_capacity, 1)
+        with self.lock:
+            self.matrix = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+            self.sq_norms = np.empty(capacity, dtype=np.float32)
+            self.ids = np.empty(capacity, dtype=np.int64)
+            self.size = len(ids)
+            self.matrix[:self.size] = matrix
+            self.sq_norms[:self.size] = np.einsum('ij,ij->i', matrix, matrix)
+            self.ids[:self.size] = ids
+            self.positions = {int(employee_id): i for i, employee_id in enumerate(ids)}
+
+    def set(self, employee_id: int, encoding):
+        vector = self._vector(encoding)
+        with self.lock:
+            pos = self.positions.get(employee_id)
+            if pos is None:
+                if self.size == len(self.ids):
+                    self._grow()
+                pos = self.size
+                self.size += 1
+                self.positions[employee_id] = pos
+                self.ids[pos] = employee_id
+            self.matrix[pos] = vector
+            self.sq_norms[pos] = vector @ vector
+
+    def remove(self, employee_id: int):
+        with self.lock:
+            pos = self.positions.pop(employee_id, None)
+            if pos is None:
+                return False
+            last = self.size - 1
+            if pos != last:
+                # Последняя строка переезжает на место удалённой
+                self.matrix[pos] = self.matrix[last]
+                self.sq_norms[pos] = self.sq_norms[last]
+                self.ids[pos] = self.ids[last]
+                self.positions[int(self.ids[pos])] = pos
+            self.size = last
+            return True
+
+    def match(self, encoding, tolerance: float = None):
+        """Возвращает (employee_id, distance) ближайшего сотрудника или None"""
+        return self.match_many([encoding], tolerance)[0]
+
+    def match_many(self, encodings, tolerance: float = None):
+        tolerance = self.tolerance if tolerance is None else tolerance
+        ids, distances = self.nearest(to_queries(encodings))
+        return filter_matches(ids, distances, tolerance)
+
+    def nearest(self, queries: np.ndarray):
+        """Ближайшая строка для каждого запроса: (ids, distances), -1 и inf если индекс пуст"""
+        with self.lock:
+            if self.size == 0:
+                return np.full(len(queries), -1, dtype=np.int64), np.full(len(queries), np.inf, dtype=np.float32)
+            # |a - b|^2 = |a|^2 - 2ab + |b|^2
+            distances = queries @ self.matrix[:self.size].T
+            distances *= -2
+            distances += self.sq_norms[:self.size]
+            distances += np.einsum('ij,ij->i', queries, queries)[:, None]
+            best = np.argmin(distances, axis=1)
+            # Для найденных строк расстояние считается напрямую, без потери точности в float32
+            return self.ids[best], np.linalg.norm(self.matrix[best] - queries, axis=1)
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        capacity = max(len(self.ids) * 2, 1)
+        matrix = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+        matrix[:self.size] = self.matrix[:self.size]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:self.size] = self.sq_norms[:self.size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        self.matrix, self.sq_norms, self.ids = matrix, sq_norms, ids
+
+    @staticmethod
+    def _vector(encoding):
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != ENCODING_SIZE:
+            raise ValueError(f"encoding must have {ENCODING_SIZE} values")
+        return vector
+
+
+def to_queries(encodings) -> np.ndarray:
+    return np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+
+
+def filter_matches(ids, distances, tolerance: float):
+    result = []
+    for employee_id, distance in zip(ids, distances):
+        if employee_id >= 0 and distance <= tolerance:
+            result.append((int(employee_id), float(distance)))
+        else:
+            result.append(None)
+    return result
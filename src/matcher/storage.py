@@ -0,0 +1,33 @@
+import numpy as np
+
+from src.matcher.matcher import ENCODING_SIZE
+
+# 1 - 128 значений float32 little-endian подряд
+ENCODING_VERSION = 1
+ENCODING_DTYPE = np.dtype('<f4')
+
+
+def pack_encoding(encoding) -> bytes:
+    vector = np.asarray(encoding, dtype=ENCODING_DTYPE).reshape(-1)
+    if vector.shape[0] != ENCODING_SIZE:
+        raise ValueError(f"encoding must have {ENCODING_SIZE} values")
+    return vector.tobytes()
+
+
+def unpack_encoding(data: bytes, version: int = ENCODING_VERSION) -> np.ndarray:
+    if version != ENCODING_VERSION:
+        raise ValueError(f"unknown encoding version {version}")
+    # Без копирования: массив смотрит прямо в буфер bytes
+    return np.frombuffer(data, dtype=ENCODING_DTYPE)
+
+
+def unpack_encodings(rows):
+    """rows - итерируемое из (employee_id, version, data), результат - (ids, matrix)"""
+    ids, blobs = [], []
+    for employee_id, version, data in rows:
+        if version != ENCODING_VERSION:
+            raise ValueError(f"unknown encoding version {version}")
+        ids.append(employee_id)
+        blobs.append(data)
+    matrix = np.frombuffer(b"".join(blobs), dtype=ENCODING_DTYPE).reshape(-1, ENCODING_SIZE)
+    return np.asarray(ids, dtype=np.int64), matrix
@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 from starlette.responses import FileResponse
 
@@ -28,11 +29,62 @@ class AccessLogResponse(BaseModel):
 
 class AccessLogsResponse(BaseModel):
     logs: list[LogResponse]
-    count: int
+    count: int | None = None
+    nextCursor: str | None = None
     resultCode: int = 0
 
 class PostAccessLogNotify(BaseModel):
     isAccess: bool
+    # Запись access_logs, если она уже создана, иначе сотрудник и время прохода
+    id: int | None = None
+    employeeId: int | None = None
+    timestamp: datetime | None = None
+
+class AccessLogEvent(BaseModel):
+
+    """Событие прохода, рассылаемое по /ws"""
+
+    type: str = "access"
+    id: int | None = None
+    employeeId: int | None = None
+    name: str | None = None
+    access: bool
+    time: str
+    photoUrl: str | None = None
+
+class AccessEvent(BaseModel):
+    employeeId: int
+    timestamp: datetime
+
+class AccessLogBatchRequest(BaseModel):
+    events: list[AccessEvent]
+
+class AccessLogBatchResponse(BaseModel):
+    accepted: int
+    resultCode: int = 0
+
+class AccessStatsBucket(BaseModel):
+    time: str
+    total: int
+    granted: int
+    denied: int
+    deniedRate: float
+
+class AccessStatsResponse(BaseModel):
+    period: str
+    buckets: list[AccessStatsBucket]
+    resultCode: int = 0
+
+class EmployeePresence(BaseModel):
+    id: int
+    name: str | None = None
+    firstSeen: str
+    lastSeen: str
+    count: int
+
+class EmployeePresenceResponse(BaseModel):
+    employees: list[EmployeePresence]
+    resultCode: int = 0
 
 # Users Models
 class UserResponse(BaseModel):
@@ -42,7 +94,8 @@ class UserResponse(BaseModel):
 
 class UsersResponse(BaseModel):
     users: list[UserResponse]
-    count: int
+    count: int | None = None
+    nextCursor: str | None = None
     resultCode: int = 0
 
 class AddUserRequest(BaseModel):
@@ -80,7 +133,8 @@ class EmployeeResponse(BaseModel):
 
 class EmployeesResponse(BaseModel):
     employees: list[Employee]
-    count: int
+    count: int | None = None
+    nextCursor: str | None = None
     resultCode: int = 0
 
 class EmployeePostRequest(BaseModel):
@@ -92,6 +146,54 @@ class EmployeePostResponse(BaseModel):
     id: int
     resultCode: int = 100
 
+# Recognition models
+class RecognizeRequest(BaseModel):
+    encoding: list[float]
+
+class RecognizeResponse(BaseModel):
+    id: int
+    name: str
+    isAccess: bool
+    distance: float
+    resultCode: int = 0
+
+class ImportRowResult(BaseModel):
+    row: int
+    name: str
+    # created, duplicate, invalid; error - строку не удалось сохранить, её можно импортировать повторно
+    status: str
+    id: int | None = None
+    # queued, missing, invalid; None - фото не указано
+    photo: str | None = None
+    error: str | None = None
+
+class EmployeesImportResponse(BaseModel):
+    created: int
+    failed: int
+    seconds: float
+    rows: list[ImportRowResult]
+    resultCode: int = 0
+
+class EncodingJobResponse(BaseModel):
+    employeeId: int
+    status: str
+    attempts: int
+    error: str | None = None
+    updatedAt: str
+    resultCode: int = 0
+
+# Metrics models
+class MetricsResponse(BaseModel):
+    principalCache: dict
+    passwordHasher: dict
+    login: dict
+    accessLogBuffer: dict
+    thumbnails: dict
+    encodingJobs: dict
+    websockets: dict
+    retention: dict
+    resultCode: int = 0
+
 
 # Results models
 class GoodResponse(BaseModel):
@@ -120,6 +222,7 @@ class BadResponse(BaseModel):
     3 - access and refresh tokens expired
     4 - access denied
     5 - invalid request
+    6 - too many requests
     """
 
     resultCode: int = 1
@@ -1,16 +1,59 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import timedelta, datetime
 import jwt
+from cryptography.hazmat.primitives import serialization
 from fastapi import Cookie
 
+
+class TokenCache:
+
+    """Уже проверенные токены, ключ - sha256 токена. Запись живёт до exp токена"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.tokens: OrderedDict[bytes, dict] = OrderedDict()
+
+    def get(self, token: str):
+        digest = hashlib.sha256(token.encode()).digest()
+        with self.lock:
+            payload = self.tokens.get(digest)
+            if payload is None:
+                return None
+            if payload['exp'] <= time.time():
+                del self.tokens[digest]
+                return None
+            self.tokens.move_to_end(digest)
+            return dict(payload)
+
+    def set(self, token: str, payload: dict):
+        if self.max_size <= 0 or not isinstance(payload.get('exp'), (int, float)):
+            return
+        digest = hashlib.sha256(token.encode()).digest()
+        with self.lock:
+            self.tokens[digest] = dict(payload)
+            self.tokens.move_to_end(digest)
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+
+
+def load_keys(private_key_path, public_key_path):
+    """PEM разбирается один раз, jwt дальше работает с готовыми объектами ключей"""
+    with open(private_key_path, 'rb') as f:
+        private_key = serialization.load_pem_private_key(f.read(), password=None)
+    with open(public_key_path, 'rb') as f:
+        public_key = serialization.load_pem_public_key(f.read())
+    return private_key, public_key
+
+
 class UserAuth:
 
-    def __init__(self, private_key_path, public_key_path):
-        with open(private_key_path) as f:
-            key = f.read()
-            self.private_key = key
-        with open(public_key_path) as f:
-            key = f.read()
-            self.public_key = key
+    def __init__(self, private_key_path, public_key_path, token_cache_size: int = 10000):
+        self.private_key, self.public_key = load_keys(private_key_path, public_key_path)
+        self.token_cache = TokenCache(token_cache_size)
 
     def create_tokens(self, user_id: int, login: str,
                       access_layer: int, access_ttl: int = 15,
@@ -35,23 +78,20 @@ class UserAuth:
         return token
 
     def check_access_jwt(self, access_token: str = Cookie(None)):
-        try:
-            if type(access_token) is str:
-                decoded = jwt.decode(jwt=access_token.encode(), key=self.public_key, algorithms=['RS256'])
-                if access_token != jwt.encode(payload=decoded, algorithm="RS256", key=self.private_key):
-                    return None
-                else:
-                    return decoded
-        except:
-            return None
+        return self.verify(access_token)
 
     def check_refresh_jwt(self, refresh_token: str = Cookie(None)):
+        return self.verify(refresh_token)
+
+    def verify(self, token):
         try:
-            if type(refresh_token) is str:
-                decoded = jwt.decode(jwt=refresh_token.encode(), key=self.public_key, algorithms=['RS256'])
-                if refresh_token != jwt.encode(payload=decoded, algorithm="RS256", key=self.private_key):
-                    return None
-                else:
-                    return decoded
+            if type(token) is str:
+                decoded = self.token_cache.get(token)
+                if decoded is None:
+                    # Подпись и exp проверяет jwt.decode, повторно подписывать токен не нужно
+                    decoded = jwt.decode(jwt=token, key=self.public_key, algorithms=['RS256'],
+                                         options={"require": ["exp"]})
+                    self.token_cache.set(token, decoded)
+                return decoded
         except:
-            return None
\ No newline at end of file
+            return None
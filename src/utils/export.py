@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+COLUMNS = ("id", "time", "employeeId", "name", "access", "photoUrl")
+
+
+def photo_url(log_id: int, photo: str | None) -> str | None:
+    return f"/accessLog/photo?id={log_id}" if photo else None
+
+
+def csv_chunk(rows, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    writer.writerows((log_id, str(timestamp), employee_id, name, int(access), photo_url(log_id, photo) or "")
+                     for log_id, timestamp, employee_id, name, access, photo in rows)
+    return buffer.getvalue().encode()
+
+
+def ndjson_chunk(rows) -> bytes:
+    return "".join(json.dumps(dict(zip(COLUMNS, (log_id, str(timestamp), employee_id, name, access,
+                                                  photo_url(log_id, photo)))), ensure_ascii=False) + "\n"
+                   for log_id, timestamp, employee_id, name, access, photo in rows).encode()
+
+
+async def export_access_logs(batches: AsyncIterator, fmt: str, gzip: bool = False,
+                             level: int = 6) -> AsyncIterator[bytes]:
+    """
+    Тело выгрузки логов: пачки строк из курсора превращаются в CSV или NDJSON и сразу отдаются клиенту.
+    gzip сжимает поток на лету (zlib с заголовком gzip), в памяти одновременно только одна пачка.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) if gzip else None
+    first = True
+    async for rows in batches:
+        data = csv_chunk(rows, header=first) if fmt == "csv" else ndjson_chunk(rows)
+        first = False
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if fmt == "csv" and first:
+        # Пустая выгрузка - только заголовок
+        data = csv_chunk([], header=True)
+        yield compressor.compress(data) if compressor is not None else data
+    if compressor is not None:
+        yield compressor.flush()
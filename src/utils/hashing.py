@@ -0,0 +1,88 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from passlib.context import CryptContext
+
+
+class PasswordHasher:
+
+    """
+    bcrypt в отдельном пуле потоков ограниченного размера, чтобы вход пользователей
+    не занимал общий threadpool эндпоинтов. bcrypt отпускает GIL, поэтому хватает потоков.
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int = 2):
+        self.context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="bcrypt")
+        self.max_workers = max_workers
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(self.context.verify, password, password_hash)
+
+    async def verify_and_update(self, password: str, password_hash: str):
+        """(valid, new_hash), new_hash не None, если хэш сделан с другим числом раундов"""
+        return await self._run(self.context.verify_and_update, password, password_hash)
+
+    async def _run(self, fn, *args):
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "queueDepth": max(self.pending - self.max_workers, 0),
+            "pending": self.pending,
+            "peakPending": self.peak_pending,
+            "completed": self.completed,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LoginLimiter:
+
+    """
+    Ограничение одновременных входов: не больше max_concurrent всего и один на логин.
+    Если слот не освободился за timeout секунд, вход отклоняется.
+    """
+
+    def __init__(self, max_concurrent: int = 8, timeout: float = 2.0):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.timeout = timeout
+        self.active_logins: set[str] = set()
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, login: str):
+        if login in self.active_logins:
+            self.rejected += 1
+            yield False
+            return
+        self.active_logins.add(login)
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.active_logins.discard(login)
+            self.rejected += 1
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.semaphore.release()
+            self.active_logins.discard(login)
+
+    def stats(self):
+        return {"active": len(self.active_logins), "rejected": self.rejected}
@@ -0,0 +1,65 @@
+import hashlib
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+def file_etag(path: Path, variant: str = "original") -> tuple[str, float] | None:
+    """
+    Сильный ETag файла по mtime и размеру, variant различает уменьшенные копии одного исходника.
+    Возвращает (etag, mtime), None если файла нет.
+    """
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return f'"{path.stem}-{variant}-{stat.st_mtime_ns:x}-{stat.st_size:x}"', stat.st_mtime
+
+
+def is_conditional(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def not_modified(request: Request, etag: str, mtime: float | None = None) -> bool:
+    """Проверка If-None-Match, а без него If-Modified-Since (RFC 9110, 13.2.2)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag: str, mtime: float | None, cache_control: str) -> dict:
+    headers = {"etag": etag, "cache-control": cache_control}
+    if mtime is not None:
+        headers["last-modified"] = formatdate(mtime, usegmt=True)
+    return headers
+
+
+def not_modified_response(etag: str, mtime: float | None, cache_control: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, mtime, cache_control))
+
+
+class MemoryFile:
+
+    """Небольшой статический файл (картинка по умолчанию), прочитанный в память один раз"""
+
+    def __init__(self, path: Path, cache_control: str):
+        self.content = Path(path).read_bytes()
+        self.media_type = mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+        self.etag = f'"{hashlib.sha256(self.content).hexdigest()[:32]}"'
+        self.cache_control = cache_control
+
+    def response(self, request: Request = None) -> Response:
+        if request is not None and not_modified(request, self.etag):
+            return not_modified_response(self.etag, None, self.cache_control)
+        return Response(self.content, media_type=self.media_type,
+                        headers={"etag": self.etag, "cache-control": self.cache_control})
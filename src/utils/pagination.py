@@ -0,0 +1,19 @@
+import base64
+import json
+
+
+def encode_cursor(*values) -> str:
+    data = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, *types):
+    """Разбор курсора, types - конструкторы значений. None если курсор повреждён"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+        if not isinstance(values, list) or len(values) != len(types):
+            return None
+        return [value_type(value) for value_type, value in zip(types, values)]
+    except (ValueError, TypeError):
+        return None
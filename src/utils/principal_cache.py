@@ -0,0 +1,164 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from src.utils.pubsub import BroadcastBackend
+
+logger = logging.getLogger(__name__)
+
+
+class Principal(NamedTuple):
+    login: str
+    access_layer_id: int
+
+
+class CacheBackend:
+
+    """
+    Хранилище PrincipalCache. Методы асинхронные, чтобы хранилище можно было вынести
+    в общий для всех воркеров сервис, реализовав этот же интерфейс.
+    """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def set(self, key, value, ttl: float):
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+
+    """TTL + LRU кэш внутри одного процесса"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.values: OrderedDict = OrderedDict()
+
+    async def get(self, key):
+        item = self.values.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires <= time.monotonic():
+            del self.values[key]
+            return None
+        self.values.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl: float):
+        self.values[key] = (value, time.monotonic() + ttl)
+        self.values.move_to_end(key)
+        while len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+    async def clear(self):
+        self.values.clear()
+
+    def __len__(self):
+        return len(self.values)
+
+
+class InvalidatingBackend(MemoryBackend):
+
+    """
+    Кэш в памяти каждого воркера, удаления рассылаются всем воркерам через BroadcastBackend
+    (тот же транспорт, что у WebSocket, свой канал). Отозванный или понижённый пользователь
+    перестаёт приниматься всеми воркерами сразу после рассылки, а не через TTL.
+    Сообщение, потерянное при обрыве транспорта, ограничено тем же TTL.
+    """
+
+    def __init__(self, broadcast: BroadcastBackend, max_size: int = 10000):
+        super().__init__(max_size)
+        self.broadcast = broadcast
+        self.received = 0
+
+    async def start(self):
+        await self.broadcast.start(self._on_message)
+
+    async def stop(self):
+        await self.broadcast.stop()
+
+    async def delete(self, key):
+        await super().delete(key)
+        await self.broadcast.publish(json.dumps(key))
+
+    async def clear(self):
+        await super().clear()
+        await self.broadcast.publish(json.dumps(None))
+
+    def _on_message(self, seq: int, message: str):
+        self.received += 1
+        try:
+            key = json.loads(message)
+        except ValueError:
+            logger.warning("bad principal cache invalidation %r", message)
+            return
+        # Свои же сообщения тоже приходят обратно - повторное удаление безвредно
+        if key is None:
+            self.values.clear()
+        else:
+            self.values.pop(key, None)
+
+
+class PrincipalCache:
+
+    """Кэш пользователей для check_access, ключ - id пользователя из JWT"""
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = 60):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def start(self):
+        await self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+    async def get(self, user_id: int):
+        principal = await self.backend.get(user_id)
+        if principal is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Principal(*principal)
+
+    async def set(self, user_id: int, principal: Principal):
+        await self.backend.set(user_id, tuple(principal), self.ttl)
+
+    async def invalidate(self, user_id: int):
+        self.invalidations += 1
+        await self.backend.delete(user_id)
+
+    def stats(self):
+        total = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hitRate": self.hits / total if total else 0.0,
+        }
+        if isinstance(self.backend, MemoryBackend):
+            stats["size"] = len(self.backend)
+        if isinstance(self.backend, InvalidatingBackend):
+            stats["remoteInvalidations"] = self.backend.received
+        return stats
@@ -0,0 +1,250 @@
+import asyncio
+import contextlib
+import json
+import logging
+import sys
+from typing import Callable
+import asyncpg
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+Deliver = Callable[[int, str], None]
+
+
+class BroadcastBackend:
+
+    """
+    Транспорт уведомлений WebSocketManager между воркерами.
+    publish отправляет сообщение всем воркерам, включая текущий. Каждый воркер получает сообщения
+    через deliver(seq, message) в одном и том же порядке, seq - сквозной возрастающий номер сообщения.
+    shared_seq: номера общие для всех воркеров и не начинаются заново при перезапуске воркера.
+    """
+
+    shared_seq = True
+
+    async def start(self, deliver: Deliver):
+        raise NotImplementedError
+
+    async def publish(self, message: str):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class MemoryBroadcast(BroadcastBackend):
+
+    """Внутри одного процесса, для запуска с одним воркером. Номера начинаются заново с процессом"""
+
+    shared_seq = False
+
+    def __init__(self):
+        self.deliver = None
+        self.seq = 0
+
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+
+    async def publish(self, message: str):
+        self.seq += 1
+        self.deliver(self.seq, message)
+
+
+class PostgresBroadcast(BroadcastBackend):
+
+    """
+    LISTEN/NOTIFY в базе приложения. Номер берётся из последовательности ws_events_seq под advisory lock
+    в той же транзакции, что и NOTIFY: уведомления доставляются в порядке коммита, значит и в порядке номеров.
+    Слушает отдельное соединение asyncpg вне пула, при обрыве переподключается.
+    Сообщение вместе с номером должно помещаться в лимит NOTIFY (8000 байт).
+    У каждого канала своя последовательность номеров (sequence).
+    """
+
+    LOCK_KEY = 0x66616365
+
+    def __init__(self, engine, channel: str = "faceai_ws", reconnect_delay: float = 1,
+                 sequence: str = "ws_events_seq"):
+        self.engine = engine
+        self.channel = channel
+        self.sequence = sequence
+        self.reconnect_delay = reconnect_delay
+        self.dsn = engine.url.set(drivername="postgresql", query={}).render_as_string(hide_password=False)
+        self.deliver = None
+        self.listener = None
+        self.task = None
+
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {self.sequence}"))
+        connected = asyncio.Event()
+        self.task = asyncio.create_task(self._listen(connected))
+        await connected.wait()
+
+    async def publish(self, message: str):
+        async with self.engine.begin() as conn:
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": self.LOCK_KEY})
+            seq = (await conn.execute(text(f"SELECT nextval('{self.sequence}')"))).scalar_one()
+            await conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                               {"channel": self.channel, "payload": f"{seq}:{message}"})
+
+    def _on_notify(self, connection, pid, channel, payload):
+        seq, _, message = payload.partition(":")
+        self.deliver(int(seq), message)
+
+    async def _listen(self, connected: asyncio.Event):
+        while True:
+            closed = asyncio.Event()
+            try:
+                self.listener = await asyncpg.connect(self.dsn)
+                self.listener.add_termination_listener(lambda connection: closed.set())
+                await self.listener.add_listener(self.channel, self._on_notify)
+                connected.set()
+                await closed.wait()
+                logger.warning("LISTEN connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN %s failed", self.channel)
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        if self.listener is not None:
+            await self.listener.close()
+            self.listener = None
+
+
+async def open_socket(address: str):
+    """address - путь unix сокета или tcp://host:port"""
+    if address.startswith("tcp://"):
+        host, _, port = address.removeprefix("tcp://").rpartition(":")
+        return await asyncio.open_connection(host, int(port))
+    return await asyncio.open_unix_connection(address)
+
+
+class SocketBroker:
+
+    """
+    Простой брокер на локальном сокете для тестов и запуска нескольких воркеров без PostgreSQL.
+    Каждая строка от клиента - сообщение в JSON, брокер нумерует их и рассылает всем клиентам строками
+    "<seq> <json>". Номера назначает брокер, поэтому порядок у всех подписчиков общий.
+    Первая строка клиента - имя канала: сообщения и номера у каждого канала свои.
+    Подключившемуся клиенту сначала отправляется "<seq>\n" - номер последнего сообщения: клиент зарегистрирован.
+    Запуск: python -m src.utils.pubsub <address>
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.clients: dict[str, set[asyncio.StreamWriter]] = {}
+        self.seq: dict[str, int] = {}
+        self.server = None
+
+    async def start(self):
+        if self.address.startswith("tcp://"):
+            host, _, port = self.address.removeprefix("tcp://").rpartition(":")
+            self.server = await asyncio.start_server(self._client, host, int(port))
+        else:
+            self.server = await asyncio.start_unix_server(self._client, self.address)
+
+    async def stop(self):
+        self.server.close()
+        for clients in self.clients.values():
+            for writer in list(clients):
+                writer.close()
+        await self.server.wait_closed()
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channel = (await reader.readline()).decode().strip()
+        clients = self.clients.setdefault(channel, set())
+        clients.add(writer)
+        writer.write(f"{self.seq.get(channel, 0)}\n".encode())
+        try:
+            while line := await reader.readline():
+                self.seq[channel] = seq = self.seq.get(channel, 0) + 1
+                data = f"{seq} ".encode() + line
+                for client in list(clients):
+                    if client.is_closing():
+                        clients.discard(client)
+                    else:
+                        client.write(data)
+        except ConnectionError:
+            pass
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+
+class SocketBroadcast(BroadcastBackend):
+
+    """Клиент SocketBroker, подписан на один канал"""
+
+    def __init__(self, address: str, channel: str = "ws"):
+        self.address = address
+        self.channel = channel
+        self.deliver = None
+        self.writer = None
+        self.task = None
+
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+        reader, self.writer = await open_socket(self.address)
+        self.writer.write(f"{self.channel}\n".encode())
+        # Ответ брокера о регистрации: сообщения, опубликованные после start(), уже дойдут и сюда
+        await reader.readline()
+        self.task = asyncio.create_task(self._read(reader))
+
+    async def publish(self, message: str):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        await self.writer.drain()
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while line := await reader.readline():
+            seq, _, message = line.partition(b" ")
+            self.deliver(int(seq), json.loads(message))
+        logger.warning("broadcast broker %s closed the connection", self.address)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def create_backend(kind: str, engine=None, address: str = None, channel: str = "ws") -> BroadcastBackend:
+    """
+    WS_BROADCAST, PRINCIPAL_CACHE_BROADCAST: memory, postgres или socket (адрес брокера в WS_BROKER).
+    channel разделяет потоки сообщений (и их номера) в одном транспорте.
+    """
+    if kind == "memory":
+        return MemoryBroadcast()
+    if kind == "postgres":
+        if engine is None or engine.url.get_backend_name() != "postgresql":
+            raise ValueError("postgres broadcast backend requires a PostgreSQL DB_URL")
+        return PostgresBroadcast(engine, f"faceai_{channel}", sequence=f"{channel}_events_seq")
+    if kind == "socket":
+        if not address:
+            raise ValueError("socket broadcast backend requires WS_BROKER address")
+        return SocketBroadcast(address, channel)
+    raise ValueError(f"unknown broadcast backend {kind!r}")
+
+
+async def run_broker(address: str):
+    broker = SocketBroker(address)
+    await broker.start()
+    logger.warning("broadcast broker listening on %s", address)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    asyncio.run(run_broker(sys.argv[1] if len(sys.argv) > 1 else "tcp://127.0.0.1:8765"))
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from PIL import Image, ImageOps, features
+
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+class ThumbnailCache:
+
+    """
+    Уменьшенные копии фотографий на диске. Копия создаётся при первом запросе в пуле потоков
+    и лежит в root, пока общий размер каталога не превысит max_bytes - тогда удаляются
+    давно не запрошенные. В имени копии mtime исходника, поэтому замена фото не отдаёт старую копию.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 256 * 2 ** 20, sizes=(64, 256), image_format: str = 'webp',
+                 quality: int = 80):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.sizes = tuple(sizes)
+        if image_format == 'webp' and not features.check('webp'):
+            image_format = 'jpeg'
+        self.format = image_format
+        self.media_type = MEDIA_TYPES[image_format]
+        self.quality = quality
+        self.lock = threading.Lock()
+        # Путь копии -> размер в байтах, от давно не запрошенных к недавним
+        self.files: OrderedDict[Path, int] = OrderedDict()
+        self.total = 0
+        self.pending: dict[Path, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._scan()
+
+    async def get(self, source: Path, size: int) -> Path:
+        """Путь к копии source, вписанной в квадрат size, создаёт её при необходимости"""
+        target = self._target(source, size)
+        with self.lock:
+            if target in self.files:
+                self.files.move_to_end(target)
+                self.hits += 1
+                return target
+        # Одновременные запросы одной копии ждут одну генерацию
+        future = self.pending.get(target)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[target] = future
+        try:
+            self.misses += 1
+            await asyncio.to_thread(self._render, source, target, size)
+            future.set_result(target)
+            return target
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже отдано вызвавшему, ожидающих может и не быть
+            future.exception()
+            raise
+        finally:
+            del self.pending[target]
+
+    def discard(self, source: Path):
+        """Удаляет все копии source, например после загрузки нового фото"""
+        prefix = self._prefix(source)
+        with self.lock:
+            for path in [path for path in self.files if path.name.startswith(prefix)]:
+                self._unlink(path)
+
+    def stats(self):
+        return {
+            "files": len(self.files),
+            "bytes": self.total,
+            "maxBytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _prefix(self, source: Path):
+        return f"{source.parent.name}-{source.stem}-"
+
+    def _target(self, source: Path, size: int):
+        return self.root / f"{self._prefix(source)}{size}-{source.stat().st_mtime_ns}.{self.format}"
+
+    def _render(self, source: Path, target: Path, size: int):
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            if self.format == 'jpeg' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            tmp = target.with_suffix('.tmp')
+            image.save(tmp, self.format, quality=self.quality)
+        os.replace(tmp, target)
+        with self.lock:
+            self._remember(target, target.stat().st_size)
+            # Копии прошлых версий того же фото больше не нужны
+            prefix = f"{self._prefix(source)}{size}-"
+            for path in [path for path in self.files if path.name.startswith(prefix) and path != target]:
+                self._unlink(path)
+            self._evict()
+
+    def _scan(self):
+        files = sorted((path for path in self.root.iterdir() if path.suffix == f".{self.format}"),
+                       key=lambda path: path.stat().st_atime)
+        for path in files:
+            self._remember(path, path.stat().st_size)
+        self._evict()
+
+    def _remember(self, path: Path, size: int):
+        self.total += size - self.files.get(path, 0)
+        self.files[path] = size
+
+    def _evict(self):
+        while self.total > self.max_bytes and len(self.files) > 1:
+            path = next(iter(self.files))
+            self._unlink(path)
+            self.evictions += 1
+
+    def _unlink(self, path: Path):
+        self.total -= self.files.pop(path)
+        path.unlink(missing_ok=True)
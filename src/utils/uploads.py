@@ -0,0 +1,107 @@
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from fastapi import UploadFile
+from starlette.responses import JSONResponse
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadError(ValueError):
+    pass
+
+
+def image_type(header: bytes) -> str | None:
+    """Тип картинки по первым байтам файла, а не по имени или Content-Type от клиента"""
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+async def save_upload(upload: UploadFile, target: Path, max_bytes: int) -> str:
+    """
+    Копирует загруженный файл в target кусками в пуле потоков: сначала во временный файл
+    в том же каталоге, затем атомарно переименовывает. Возвращает тип картинки.
+    """
+    return await asyncio.to_thread(copy_image, upload.file, Path(target), max_bytes)
+
+
+def copy_image(source, target: Path, max_bytes: int) -> str:
+    """Синхронная часть save_upload, source - любой файловый объект с seek (в том числе файл из ZIP)"""
+    source.seek(0)
+    header = source.read(16)
+    kind = image_type(header)
+    if kind is None:
+        raise UploadError("unsupported image type")
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.stem}-", suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(header)
+            size = len(header)
+            while chunk := source.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadError("file is too large")
+                file.write(chunk)
+        os.replace(tmp, target)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return kind
+
+
+class BodySizeLimit:
+
+    """
+    ASGI middleware: ограничение размера тела запроса на загрузку файлов.
+    Срабатывает до разбора multipart, поэтому большой файл не успевает лечь на диск.
+    Запрос без Content-Length обрывается, как только прочитано больше max_bytes, и тоже получает 413.
+    """
+
+    def __init__(self, app, max_bytes: int, paths: tuple[str, ...]):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        too_large = JSONResponse({"resultCode": 5}, status_code=413)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            return await too_large(scope, receive, send)
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadError("request body is too large")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # После обрыва тела ответ приложения (ошибка разбора формы) не отправляется, вместо него 413
+            if exceeded and not started:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded or started:
+                raise
+        if exceeded and not started:
+            await too_large(scope, receive, send)
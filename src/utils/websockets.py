@@ -1,19 +1,340 @@
-from fastapi import WebSocket
-from typing import List
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from collections import deque
+from fastapi import WebSocket, WebSocketDisconnect
+from src.utils.pubsub import BroadcastBackend, MemoryBroadcast
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("drop_oldest", "drop_newest", "close")
+# 1013 Try Again Later - клиент не успевает читать уведомления
+SLOW_CLIENT_CODE = 1013
+# 1001 Going Away - клиент перестал отвечать на ping
+HEARTBEAT_TIMEOUT_CODE = 1001
+
+
+class Event:
+
+    """
+    Сообщение с номером. Событие приходит из backend уже сериализованным в JSON и разбирается один раз
+    на воркер - для фильтров. Варианты для отправки собираются при первом обращении и общие для всех клиентов.
+    """
+
+    __slots__ = ("seq", "message", "data", "_framed", "_legacy")
+
+    def __init__(self, seq: int, message: str):
+        self.seq = seq
+        self.message = message
+        self.data = None
+        if message.startswith("{"):
+            with contextlib.suppress(ValueError):
+                self.data = json.loads(message)
+        self._framed = None
+        self._legacy = None
+
+    @property
+    def framed(self) -> str:
+        """{"seq": n, "data": <событие>} - событие вставляется строкой, без повторной сериализации"""
+        if self._framed is None:
+            data = self.message if self.data is not None else json.dumps(self.message, ensure_ascii=False)
+            self._framed = f'{{"seq": {self.seq}, "data": {data}}}'
+        return self._framed
+
+    @property
+    def legacy(self) -> str:
+        """Прежний формат: "1"/"0" - разрешён ли проход"""
+        if self._legacy is None:
+            access = self.data.get("access") if isinstance(self.data, dict) else None
+            self._legacy = self.message if access is None else ("1" if access else "0")
+        return self._legacy
+
+
+class Subscription:
+
+    """Фильтр событий клиента: по сотрудникам и по результату прохода, None - без ограничения"""
+
+    __slots__ = ("employee_ids", "access")
+
+    def __init__(self, employee_ids=None, access: bool = None):
+        self.employee_ids = frozenset(employee_ids) if employee_ids else None
+        self.access = access
+
+    @classmethod
+    def parse(cls, data: dict) -> "Subscription":
+        employee_ids = data.get("employeeIds")
+        access = data.get("access")
+        if employee_ids is not None and (not isinstance(employee_ids, list)
+                                         or not all(isinstance(i, int) for i in employee_ids)):
+            raise ValueError("employeeIds must be a list of integers")
+        if access is not None and not isinstance(access, bool):
+            raise ValueError("access must be a boolean")
+        return cls(employee_ids, access)
+
+    def matches(self, event: Event) -> bool:
+        if self.employee_ids is None and self.access is None:
+            return True
+        data = event.data
+        if not isinstance(data, dict):
+            # Не событие прохода - фильтры к нему не относятся
+            return True
+        if self.employee_ids is not None and data.get("employeeId") not in self.employee_ids:
+            return False
+        return self.access is None or data.get("access") == self.access
+
+
+class Connection:
+
+    """Один подключённый клиент: своя очередь отправки и своя задача-отправитель"""
+
+    def __init__(self, websocket: WebSocket, max_queue: int, subscription: Subscription = None,
+                 legacy: bool = False):
+        self.websocket = websocket
+        self.subscription = subscription if subscription is not None else Subscription()
+        # format=legacy: только "1"/"0" без номеров, как до структурированных событий
+        self.legacy = legacy
+        self.queue = asyncio.Queue(max_queue)
+        self.sender = None
+        self.last_seen = time.monotonic()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+    def format(self, event: Event) -> str:
+        return event.legacy if self.legacy else event.framed
 
 
 class WebSocketManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
 
-    async def connect(self, websocket: WebSocket):
+    """
+    Рассылка уведомлений по WebSocket.
+    broadcast только кладёт сообщение в ограниченную очередь каждого клиента и не ждёт отправки,
+    отправляют задачи клиентов параллельно, каждая с send_timeout. Медленный клиент не задерживает остальных:
+    при переполненной очереди по policy отбрасывается самое старое (drop_oldest) или новое (drop_newest)
+    сообщение, либо клиент отключается (close). Клиенты с ошибкой отправки удаляются сразу.
+    Heartbeat: раз в heartbeat_interval клиентам отправляется ping_message (если задан), клиент может
+    сам присылать "ping" и получает "pong". Клиент, от которого ничего не приходило heartbeat_timeout секунд,
+    отключается. 0 отключает heartbeat.
+    Сообщения идут через backend (между воркерами) и приходят обратно пронумерованными в общем порядке,
+    клиенты получают {"seq": n, "data": <событие>}. Клиент выбирает события фильтром Subscription при подключении
+    или сообщением {"subscribe": {"employeeIds": [...], "access": true}}, фильтр проверяется на сервере.
+    Последние history_size сообщений хранятся, клиент, переподключившийся с ?since=<seq>, сначала получает
+    пропущенные без запроса к базе. Если нужные уже вытеснены, не дошли до этого воркера (скачок seq)
+    или воркер запущен позже, первыми приходят {"gap": {"from", "to"}} - их надо запросить из API.
+    "to": null - до первого сообщения, которое придёт после gap.
+    """
+
+    def __init__(self, max_queue: int = 100, policy: str = "drop_oldest", send_timeout: float = 5,
+                 heartbeat_interval: float = 0, heartbeat_timeout: float = 0, ping_message: str = None,
+                 backend: BroadcastBackend = None, history_size: int = 1000):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown slow client policy {policy!r}, expected one of {POLICIES}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.ping_message = ping_message
+        self.backend = backend if backend is not None else MemoryBroadcast()
+        self.history: deque[Event] = deque(maxlen=history_size)
+        # Пропуски номеров внутри истории (from, to): сообщения, не дошедшие до воркера
+        self.holes: deque[tuple[int, int]] = deque()
+        self.last_seq = 0
+        self.active_connections: dict[WebSocket, Connection] = {}
+        self.heartbeat = None
+        self.broadcasts = 0
+        self.dropped = 0
+        self.slow_closed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.discontinuities = 0
+
+    async def start(self):
+        await self.backend.start(self._deliver)
+        if self.heartbeat_interval > 0:
+            self.heartbeat = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.heartbeat
+            self.heartbeat = None
+        await self.backend.stop()
+        await asyncio.gather(*(self._close(connection, 1001) for connection in list(self.active_connections.values())))
+
+    async def connect(self, websocket: WebSocket, since: int = None, subscription: Subscription = None,
+                      legacy: bool = False) -> Connection:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = Connection(websocket, self.max_queue, subscription, legacy)
+        if since is not None:
+            # Пропущенные сообщения ставятся в очередь до регистрации без await между ними:
+            # следующее сообщение из backend попадёт в очередь уже после них, без пропусков и повторов
+            self._replay(connection, since)
+        connection.sender = asyncio.create_task(self._send_loop(connection))
+        self.active_connections[websocket] = connection
+        return connection
+
+    def _replay(self, connection: Connection, since: int):
+        if since > self.last_seq and not self.backend.shared_seq:
+            # Номер из будущего: счётчик этого процесса начат заново (перезапуск), отдаём всё что есть
+            since = 0
+        gaps = self._gaps(since)
+        missed = [event for event in self.history if event.seq > since and connection.subscription.matches(event)]
+        if len(missed) + len(gaps) > self.max_queue:
+            # Всё не помещается в очередь клиента (max_queue): старые - в один gap до первого отправленного
+            missed = missed[len(missed) - self.max_queue + 1:] if self.max_queue > 1 else []
+            gaps = [(since + 1, (missed[0].seq if missed else self.last_seq + 1) - 1)]
+        for start, end in gaps:
+            self.send(connection, json.dumps({"gap": {"from": start, "to": end}}))
+        for event in missed:
+            self.send(connection, connection.format(event))
+
+    def _gaps(self, since: int) -> list[tuple[int, int | None]]:
+        """Номера после since, которых нет в истории этого воркера"""
+        gaps = []
+        if self.history:
+            if since + 1 < self.history[0].seq:
+                gaps.append((since + 1, self.history[0].seq - 1))
+        elif since < self.last_seq:
+            gaps.append((since + 1, self.last_seq))
+        elif self.last_seq == 0 and self.backend.shared_seq:
+            # Воркер ещё ничего не получал - что было после since, ему неизвестно
+            gaps.append((since + 1, None))
+        gaps.extend((max(start, since + 1), end) for start, end in self.holes if end > since)
+        return gaps
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection is not None:
+            connection.closed = True
+            if connection.sender is not asyncio.current_task():
+                connection.sender.cancel()
+
+    async def listen(self, connection: Connection):
+        """Чтение входящих сообщений до отключения клиента, любое сообщение продлевает heartbeat"""
+        try:
+            while not connection.closed:
+                message = await connection.websocket.receive_text()
+                connection.last_seen = time.monotonic()
+                if message == "ping":
+                    self.send(connection, "pong")
+                elif message.startswith("{"):
+                    self._command(connection, message)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self.disconnect(connection.websocket)
+
+    def _command(self, connection: Connection, message: str):
+        try:
+            command = json.loads(message)
+            if not isinstance(command, dict) or not isinstance(command.get("subscribe"), dict):
+                raise ValueError("unknown command")
+            connection.subscription = Subscription.parse(command["subscribe"])
+        except ValueError as e:
+            self.send(connection, json.dumps({"error": str(e)}))
+            return
+        self.send(connection, json.dumps({"subscribed": command["subscribe"]}))
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            print("Send notify")
-            await connection.send_text(message)
+        """Публикует сообщение для клиентов всех воркеров"""
+        await self.backend.publish(message)
+
+    def _deliver(self, seq: int, message: str) -> int:
+        """Сообщение из backend: в историю и в очереди клиентов этого воркера"""
+        event = Event(seq, message)
+        if self.last_seq and seq <= self.last_seq:
+            # Номера начаты заново (перезапуск брокера) - старая история с ними несравнима
+            logger.warning("broadcast seq went back from %d to %d, history is reset", self.last_seq, seq)
+            self.history.clear()
+            self.holes.clear()
+            self.discontinuities += 1
+        elif self.last_seq and seq > self.last_seq + 1:
+            # Часть сообщений не дошла (например, переподключение LISTEN) - replay сообщит о них как о gap
+            self.holes.append((self.last_seq + 1, seq - 1))
+            self.discontinuities += 1
+        self.history.append(event)
+        while self.holes and (not self.history or self.holes[0][1] < self.history[0].seq):
+            self.holes.popleft()
+        self.last_seq = seq
+        self.broadcasts += 1
+        delivered = 0
+        for connection in list(self.active_connections.values()):
+            if connection.subscription.matches(event):
+                delivered += self.send(connection, connection.format(event))
+        return delivered
+
+    def send(self, connection: Connection, message: str) -> bool:
+        if connection.closed:
+            return False
+        try:
+            connection.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.policy == "close":
+            self.slow_closed += 1
+            self._schedule_close(connection, SLOW_CLIENT_CODE)
+            return False
+        connection.dropped += 1
+        self.dropped += 1
+        if self.policy == "drop_newest":
+            return False
+        connection.queue.get_nowait()
+        connection.queue.put_nowait(message)
+        return True
+
+    async def _send_loop(self, connection: Connection):
+        websocket = connection.websocket
+        try:
+            while True:
+                message = await connection.queue.get()
+                await asyncio.wait_for(websocket.send_text(message), self.send_timeout)
+                connection.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Отправка не прошла или зависла - клиент потерян, очередь ему больше не нужна
+            self.failed += 1
+            logger.debug("websocket send failed: %r", e)
+            self.disconnect(websocket)
+            with contextlib.suppress(Exception):
+                await asyncio.wait_for(websocket.close(), self.send_timeout)
+
+    def _schedule_close(self, connection: Connection, code: int):
+        if not connection.closed:
+            self.disconnect(connection.websocket)
+            asyncio.create_task(self._close(connection, code))
+
+    async def _close(self, connection: Connection, code: int):
+        self.disconnect(connection.websocket)
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(connection.websocket.close(code), self.send_timeout)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for connection in list(self.active_connections.values()):
+                if self.heartbeat_timeout > 0 and now - connection.last_seen > self.heartbeat_timeout:
+                    self.timed_out += 1
+                    self._schedule_close(connection, HEARTBEAT_TIMEOUT_CODE)
+                elif self.ping_message is not None:
+                    self.send(connection, self.ping_message)
+
+    def stats(self):
+        return {
+            "connections": len(self.active_connections),
+            "queued": sum(connection.queue.qsize() for connection in self.active_connections.values()),
+            "broadcasts": self.broadcasts,
+            "lastSeq": self.last_seq,
+            "history": len(self.history),
+            "discontinuities": self.discontinuities,
+            "dropped": self.dropped,
+            "slowClosed": self.slow_closed,
+            "failed": self.failed,
+            "timedOut": self.timed_out,
+        }